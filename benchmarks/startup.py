@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Startup benchmark for the webtest entry points.
+
+Imports each entry point module in a fresh interpreter, records how long
+every module import takes (self time, without its own imports) and prints
+the slowest ones. Also fails if an optional backend (selenium, influxdb,
+PIL, tinys3, twisted) gets imported eagerly.
+
+usage:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --save startup.json
+    python benchmarks/startup.py --baseline startup.json --tolerance 0.2
+
+"""
+
+import __builtin__
+import json
+import os
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+ENTRY_POINTS = ['webtest', 'webtest.main', 'webtest.nrpe']
+LAZY_BACKENDS = ['selenium', 'influxdb', 'PIL', 'tinys3', 'twisted', 'lxml']
+REPEAT = 5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(module_name):
+    """Runs in the fresh interpreter: imports module_name and dumps timings"""
+    timings = {}
+    stack = []
+    original_import = __builtin__.__import__
+
+    def timed_import(name, *args, **kwargs):
+        already = name in sys.modules
+        stack.append(0.0)
+        t1 = time.time()
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - t1
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if not already and name in sys.modules:
+                timings[name] = timings.get(name, 0) + elapsed - nested
+
+    __builtin__.__import__ = timed_import
+    t1 = time.time()
+    __import__(module_name)
+    total = time.time() - t1
+    __builtin__.__import__ = original_import
+
+    eager = sorted(set(m.split('.')[0] for m in sys.modules
+        if m.split('.')[0] in LAZY_BACKENDS and sys.modules[m] is not None))
+    json.dump({'total': total, 'modules': timings, 'eager': eager}, sys.stdout)
+
+
+def measure(module_name, repeat=REPEAT):
+    """Best of `repeat` fresh imports of module_name"""
+    best = None
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child', module_name],
+            cwd=ROOT)
+        result = json.loads(output)
+        if best is None or result['total'] < best['total']:
+            best = result
+    return best
+
+
+def report(results, top):
+    for module_name, result in sorted(results.items()):
+        print "{:<20} {:8.1f} ms".format(module_name, result['total'] * 1000)
+        slowest = sorted(result['modules'].items(), key=lambda i: -i[1])[:top]
+        for name, elapsed in slowest:
+            print "    {:<40} {:8.2f} ms".format(name, elapsed * 1000)
+        if result['eager']:
+            print "    eager backends: {}".format(", ".join(result['eager']))
+
+
+def compare(results, baseline, tolerance):
+    """Returns the list of regressions against baseline"""
+    errors = []
+    for module_name, result in sorted(results.items()):
+        if result['eager']:
+            errors.append("{} imports {} eagerly".format(
+                module_name, ", ".join(result['eager'])))
+        previous = baseline.get(module_name)
+        if previous and result['total'] > previous['total'] * (1 + tolerance):
+            errors.append("{} import went from {:.1f} ms to {:.1f} ms".format(
+                module_name, previous['total'] * 1000, result['total'] * 1000))
+    return errors
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] [module ...]")
+    parser.add_option("--child", action="store", help=None)
+    parser.add_option("--repeat", "-n", action="store", type="int",
+        default=REPEAT, help="Fresh imports per module (best is kept)")
+    parser.add_option("--top", action="store", type="int", default=10,
+        help="Slowest modules shown per entry point")
+    parser.add_option("--save", action="store",
+        help="Write results as json to this file")
+    parser.add_option("--baseline", action="store",
+        help="Compare against results saved with --save")
+    parser.add_option("--tolerance", action="store", type="float", default=0.2,
+        help="Allowed slowdown against the baseline (0.2 = 20%)")
+    options, args = parser.parse_args()
+
+    if options.child:
+        sys.path.insert(0, ROOT)
+        child(options.child)
+        return 0
+
+    results = dict((name, measure(name, options.repeat))
+        for name in (args or ENTRY_POINTS))
+    report(results, options.top)
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    errors = compare(results, baseline, options.tolerance)
+    for error in errors:
+        print "REGRESSION: {}".format(error)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
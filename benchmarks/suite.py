@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Offline benchmark suite for the framework's own overhead.
+
+Runs the hot paths of WebTest against webtest.testing.FakeWebDriver and a
+local FixtureServer (no browser, no network) and reports, per operation,
+latency percentiles, throughput and allocations:
+
+    steps.dispatch      _get_steps (inspect.getmembers + sort)
+    steps.iterate       iterating a 10 step test (step decorator + waits)
+    waits.browser       wait_for_id / wait_for_css_selector (in-browser waits)
+    waits.polling       the same through WebDriverWait (needs selenium)
+    run.stats           WebTest.run() with stats, metrics to a null client
+    run.error           WebTest.run() with a failing step (error html)
+    errors.format       format_exception of a real traceback
+    metrics.<backend>   serializing one run's points (line protocol, statsd)
+    screenshots.<fmt>   process_screenshot of a tall page (needs PIL)
+    fixture.get         FakeWebDriver.get against the fixture server
+    fixture.http        HttpDriver.get + find_element (needs requests, lxml)
+
+Allocations are bytes allocated (tracemalloc) when available; on python 2
+they are the net gc tracked objects created per operation.
+
+usage:
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --save suite.json
+    python benchmarks/suite.py --baseline suite.json --tolerance 0.25
+    python benchmarks/suite.py waits run
+
+"""
+
+import gc
+import json
+import os
+import sys
+import time
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from webtest import WebTest, step
+from webtest.base import format_exception
+from webtest.testing import FakeWebDriver, FixtureServer, NullMetricsClient, make_png
+from webtest.metrics import get_metrics_writer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+MIN_TIME = 0.5          # seconds measured per operation at least
+MAX_ITERATIONS = 100000
+INFLUX_CONF = {'HOST': 'benchmark', 'PORT': 0, 'USER': '', 'PASSWD': '',
+    'DBNAME': 'benchmark', 'FLUSH_INTERVAL': 3600}
+
+
+class BenchTest(WebTest):
+    URL = 'about:blank'
+    BROWSER_WAITS = True
+
+    @classmethod
+    def create_driver(cls, *args, **kwargs):
+        return FakeWebDriver()
+
+
+def _make_step(index):
+    def method(self):
+        self.wait_for_id('content')
+    method.__name__ = 'step_{:02d}'.format(index)
+    method.__doc__ = 'Step {}'.format(index)
+    return step(method, order=index)
+
+for _index in range(10):
+    setattr(BenchTest, 'step_{:02d}'.format(_index), _make_step(_index))
+
+
+class PollingTest(BenchTest):
+    BROWSER_WAITS = False
+
+
+class FailingTest(BenchTest):
+
+    @step(order=5)
+    def step_05(self):
+        "Fails"
+        self.wait_for_id('missing-element', timeout=0.01)
+
+
+def measure(func, min_time=MIN_TIME):
+    """Ejecuta func repetidamente; devuelve el resumen de la operacion"""
+    func()  # calentamiento
+    timings = []
+    deadline = time.time() + min_time
+    while time.time() < deadline and len(timings) < MAX_ITERATIONS:
+        t1 = time.time()
+        func()
+        timings.append(time.time() - t1)
+
+    allocations = None
+    samples = min(len(timings), 50)
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(samples):
+            func()
+        allocations = (tracemalloc.get_traced_memory()[1] - before) / float(samples)
+        tracemalloc.stop()
+    else:
+        gc.collect()
+        gc.disable()
+        try:
+            before = gc.get_count()[0]
+            for _ in range(samples):
+                func()
+            allocations = (gc.get_count()[0] - before) / float(samples)
+        finally:
+            gc.enable()
+
+    timings.sort()
+    total = sum(timings)
+    return {
+        'iterations': len(timings),
+        'mean': total / len(timings),
+        'p50': timings[len(timings) // 2],
+        'p99': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        'ops': len(timings) / total if total else None,
+        'allocations': allocations,
+    }
+
+
+def bench_steps():
+    test = BenchTest()
+    yield 'steps.dispatch', test._get_steps
+
+    def iterate():
+        for _ in test:
+            pass
+    yield 'steps.iterate', iterate
+
+
+def bench_waits():
+    test = BenchTest()
+    yield 'waits.browser.id', lambda: test.wait_for_id('content')
+    yield 'waits.browser.css', lambda: test.wait_for_css_selector('#content .item')
+    try:
+        import selenium
+    except ImportError:
+        return
+    polling = PollingTest()
+    yield 'waits.polling.id', lambda: polling.wait_for_id('content')
+
+
+def bench_run():
+    get_metrics_writer(INFLUX_CONF, client=NullMetricsClient())
+
+    def run(test_class):
+        def func():
+            test_class(stats=True, influx_conf=INFLUX_CONF).run(quiet=True)
+        return func
+    yield 'run.stats', run(BenchTest)
+    yield 'run.error', run(FailingTest)
+
+
+def bench_errors():
+    def func():
+        try:
+            raise ValueError("benchmark error " * 20)
+        except ValueError as e:
+            format_exception(e, 'step_name', 'Step doc')
+    yield 'errors.format', func
+
+
+def bench_metrics():
+    from webtest.backends import LineProtocol, StatsdClient
+    test_uid = 'a0c3f4b2-6f8e-11e6-9b3e-0242ac110002'
+    points = [{'name': 'benchmark.step_{:02d}'.format(index), 'columns': ['time', 'elapsed', 'test_uid'],
+        'points': [[time.time(), 0.5, test_uid]]} for index in range(10)]
+    protocol = LineProtocol({'host': 'benchmark'})
+    statsd = StatsdClient({})
+    yield 'metrics.line', lambda: protocol.serialize(points)
+    yield 'metrics.statsd', lambda: statsd.serialize(points)
+
+
+def bench_screenshots():
+    try:
+        from webtest.screenshots import process_screenshot
+        import PIL
+    except ImportError:
+        return
+    png = make_png(1280, 6000)
+    for screenshot_format in ('png', 'png8', 'jpeg', 'webp'):
+        conf = {'SCREENSHOT_FORMAT': screenshot_format}
+        yield ('screenshots.{}'.format(screenshot_format),
+            lambda conf=conf: process_screenshot(png, conf))
+
+
+def bench_fixture():
+    server = FixtureServer().start()
+    driver = FakeWebDriver()
+    url = server.url('/')
+    yield 'fixture.get', lambda: driver.get(url)
+    try:
+        from webtest.httpdriver import HttpDriver
+        http_driver = HttpDriver()
+    except ImportError:
+        return
+
+    def http_get():
+        http_driver.get(url)
+        http_driver.find_element('css selector', '#content .item')
+    yield 'fixture.http', http_get
+
+
+BENCHMARKS = [
+    ('steps', bench_steps),
+    ('waits', bench_waits),
+    ('run', bench_run),
+    ('errors', bench_errors),
+    ('metrics', bench_metrics),
+    ('screenshots', bench_screenshots),
+    ('fixture', bench_fixture),
+]
+
+
+def run_benchmarks(groups=None, min_time=MIN_TIME):
+    results = {}
+    for group, factory in BENCHMARKS:
+        if groups and group not in groups:
+            continue
+        for name, func in factory():
+            results[name] = measure(func, min_time)
+            report_line(name, results[name])
+    return results
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return "{:8.1f} us".format(seconds * 1e6)
+    return "{:8.2f} ms".format(seconds * 1e3)
+
+
+def report_line(name, result):
+    allocations = result['allocations']
+    print "{:<22} {:>11} {:>15} {:>15} {:>10.0f} ops/s {:>18}".format(name,
+        format_time(result['mean']), format_time(result['p50']),
+        format_time(result['p99']), result['ops'] or 0,
+        "-" if allocations is None else "{:.0f}".format(allocations))
+    sys.stdout.flush()
+
+
+def compare(results, baseline, tolerance):
+    """Operaciones mas lentas que en baseline (por la mediana)"""
+    errors = []
+    for name, result in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous and result['p50'] > previous['p50'] * (1 + tolerance):
+            errors.append("{} went from {} to {}".format(name,
+                format_time(previous['p50']).strip(), format_time(result['p50']).strip()))
+    return errors
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] [group ...]")
+    parser.add_option("--min-time", action="store", type="float",
+        default=MIN_TIME, dest="min_time",
+        help="Seconds measured per operation")
+    parser.add_option("--save", action="store",
+        help="Write results as json to this file")
+    parser.add_option("--baseline", action="store",
+        help="Compare against results saved with --save")
+    parser.add_option("--tolerance", action="store", type="float", default=0.25,
+        help="Allowed slowdown of the median against the baseline (0.25 = 25%)")
+    options, args = parser.parse_args()
+
+    print "{:<22} {:>11} {:>15} {:>15} {:>16} {:>18}".format(
+        "operation", "mean", "p50", "p99", "throughput", "allocations")
+    results = run_benchmarks(args, options.min_time)
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    errors = compare(results, baseline, options.tolerance)
+    for error in errors:
+        print "REGRESSION: {}".format(error)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
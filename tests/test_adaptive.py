@@ -0,0 +1,99 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Timeouts adaptativos: limites, ventanas y mezcla entre procesos"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from webtest.adaptive import (AdaptiveTimeouts, StepWindows, get_adaptive_timeouts,
+    percentile)
+
+
+class Home(object):
+    pass
+
+
+class Login(object):
+    pass
+
+
+class AdaptiveTimeoutsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "windows.json")
+
+    def timeouts(self, values, **conf):
+        conf.setdefault('MIN_SAMPLES', 5)
+        adaptive = AdaptiveTimeouts(StepWindows(self.path), conf)
+        for value in values:
+            adaptive.record('home', value)
+        return adaptive
+
+    def test_default_until_min_samples(self):
+        self.assertEqual(self.timeouts([1.0] * 4).timeout('home', 30), 30)
+        self.assertEqual(self.timeouts([1.0] * 4).timeout('other', 30), 30)
+
+    def test_percentile_times_factor(self):
+        adaptive = self.timeouts([1.0, 2.0, 3.0, 4.0, 5.0], PERCENTILE=50, FACTOR=2)
+        self.assertEqual(adaptive.timeout('home', 30), 6.0)
+
+    def test_bounded_by_floor_and_ceiling(self):
+        self.assertEqual(self.timeouts([0.01] * 10).timeout('home', 30), 1.0)
+        self.assertEqual(self.timeouts([0.01] * 10, FLOOR=0.5).timeout('home', 30), 0.5)
+        # Sin CEILING nunca pasa del timeout del test
+        self.assertEqual(self.timeouts([20.0] * 10).timeout('home', 30), 30)
+        self.assertEqual(self.timeouts([20.0] * 10, CEILING=45).timeout('home', 60), 45)
+
+    def test_only_the_last_window_counts(self):
+        adaptive = self.timeouts([10.0] * 10 + [1.0] * 5, WINDOW=5, FACTOR=1, FLOOR=0)
+        self.assertEqual(adaptive.timeout('home', 30), 1.0)
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 99), 4)
+        self.assertEqual(percentile([1, 2, 3, 4], 0), 1)
+
+
+class StepWindowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "stats", "windows.json")
+
+    def test_save_merges_samples_of_other_processes(self):
+        one, two = StepWindows(self.path), StepWindows(self.path)
+        one.record('home', 1.0)
+        two.record('home', 2.0)
+        two.record('login', 3.0)
+        one.save()
+        two.save()
+        one.save()
+        self.assertEqual(StepWindows(self.path).sorted_window('home'), [1.0, 2.0])
+        self.assertEqual(StepWindows(self.path).sorted_window('login'), [3.0])
+
+    def test_saved_windows_keep_their_size(self):
+        windows = StepWindows(self.path, window=3)
+        for value in range(10):
+            windows.record('home', value)
+        windows.save()
+        self.assertEqual(StepWindows(self.path, window=3).sorted_window('home'), [7, 8, 9])
+
+    def test_windows_are_per_test_class(self):
+        conf = {'PATH': self.dir}
+        home = get_adaptive_timeouts(Home, 'site', conf)
+        self.assertIs(get_adaptive_timeouts(Home, 'site', conf).windows, home.windows)
+        self.assertIsNot(get_adaptive_timeouts(Login, 'site', conf).windows, home.windows)
+        self.assertIsNot(get_adaptive_timeouts(Home, 'other', conf).windows, home.windows)
+        self.assertEqual(home.windows.path,
+            os.path.join(self.dir, 'site', "{}.Home.json".format(__name__)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Ejecucion de muchos tests: seleccion por nombre, glob o modulo:Clase"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from webtest.batch import expand_tests, run_tests, summarize
+from webtest.testing import FixtureServer
+
+MODULE_SOURCE = """
+from webtest.base import WebTest, step
+
+class {first}(WebTest):
+    URL = {url!r}
+
+    @step
+    def home(self):
+        self.driver.get(self.url)
+
+class {second}(WebTest):
+    URL = {url!r}
+
+    @step
+    def home(self):
+        self.driver.get(self.url + "missing")
+        self.driver.find_element_by_id("nothing-here")
+"""
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.testdir)
+        self.server = FixtureServer().start()
+        self.addCleanup(self.server.stop)
+        # Nombres unicos: los modulos quedan en sys.modules entre tests
+        self.prefix = "b{}".format(uuid.uuid4().hex[:8])
+        self.write("smoke_home", "Home", "Search")
+        self.write("smoke_login", "Login", "Logout")
+        self.write("checkout", "Guest", "Member")
+
+    def write(self, name, first, second):
+        with open(os.path.join(self.testdir, "{}_{}.py".format(self.prefix, name)), "w") as f:
+            f.write(MODULE_SOURCE.format(first=first, second=second, url=self.server.url('/')))
+
+    def name(self, name):
+        return "{}_{}".format(self.prefix, name)
+
+    def test_module_name_and_class(self):
+        found = expand_tests([self.name("checkout") + ":Member", self.name("smoke_home")],
+            self.testdir)
+        self.assertEqual(found, [(self.name("checkout"), "Member"), (self.name("smoke_home"), "Home")])
+
+    def test_globs_over_modules_and_classes(self):
+        found = expand_tests([self.name("smoke_*")], self.testdir)
+        self.assertEqual(found, [(self.name("smoke_home"), "Home"), (self.name("smoke_home"), "Search"),
+            (self.name("smoke_login"), "Login"), (self.name("smoke_login"), "Logout")])
+        found = expand_tests([self.name("*") + ":*e*"], self.testdir)
+        self.assertEqual(found, [(self.name("checkout"), "Guest"), (self.name("checkout"), "Member"),
+            (self.name("smoke_home"), "Home"), (self.name("smoke_home"), "Search")])
+
+    def test_no_repeats_and_unknown_names(self):
+        found = expand_tests([self.name("smoke_home"), self.name("smoke_h*") + ":Home",
+            "missing", "missing_*"], self.testdir)
+        self.assertEqual(found, [(self.name("smoke_home"), "Home")])
+
+    def test_run_tests_in_threads(self):
+        tests = expand_tests([self.name("smoke_home") + ":*"], self.testdir)
+        seen = []
+        results = run_tests(tests, self.testdir, jobs=2, threads=True,
+            test_kwargs={'driver': 'http'}, callback=seen.append)
+        self.assertEqual([r['test'] for r in results],
+            ["{}:{}".format(*test) for test in tests])
+        self.assertEqual([r['ok'] for r in results], [True, False])
+        self.assertEqual(len(seen), 2)
+        summary = summarize(results, 1.0)
+        self.assertEqual((summary['tests'], summary['passed']), (2, 1))
+
+    def test_callback_errors_are_raised(self):
+        tests = expand_tests([self.name("smoke_home") + ":Home"], self.testdir)
+
+        def callback(result):
+            raise KeyError("callback failed")
+        self.assertRaises(KeyError, run_tests, tests, self.testdir, jobs=1, threads=True,
+            test_kwargs={'driver': 'http'}, callback=callback)
+
+
+if __name__ == "__main__":
+    unittest.main()
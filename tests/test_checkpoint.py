@@ -0,0 +1,107 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Checkpoints: caducidad, invalidacion y runs que empiezan en un checkpoint"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from webtest.base import WebTest, step
+from webtest.checkpoint import CheckpointCache, checkpoint_key
+from webtest.testing import FixtureServer
+
+
+class CheckpointCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_load_saved_state(self):
+        cache = CheckpointCache(self.path, ttl=60)
+        cache.save("key", "login", {'url': 'http://example.com/'})
+        self.assertEqual(cache.load("key"), ("login", {'url': 'http://example.com/'}))
+        self.assertEqual(os.stat(cache._file("key")).st_mode & 0o777, 0o600)
+
+    def test_expired_checkpoint_is_removed(self):
+        cache = CheckpointCache(self.path, ttl=60)
+        cache.save("key", "login", {})
+        cache.ttl = -1
+        self.assertIsNone(cache.load("key"))
+        self.assertFalse(os.path.exists(cache._file("key")))
+
+    def test_invalidate(self):
+        cache = CheckpointCache(self.path)
+        cache.save("key", "login", {})
+        cache.invalidate("key")
+        cache.invalidate("key")
+        self.assertIsNone(cache.load("key"))
+
+    def test_key_depends_on_class_and_url(self):
+        self.assertNotEqual(checkpoint_key(WebTest, "http://a/"), checkpoint_key(WebTest, "http://b/"))
+        self.assertNotEqual(checkpoint_key(WebTest, "http://a/"), checkpoint_key(object, "http://a/"))
+
+
+class CheckpointRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.server = FixtureServer().start()
+        self.addCleanup(self.server.stop)
+
+    def make_test(self, last_checkpoint):
+        written = []
+
+        class Account(WebTest):
+            URL = self.server.url('/')
+            CHECKPOINT_PATH = self.path
+
+            @step(order=1, checkpoint=True)
+            def login(self):
+                self.driver.get(self.url)
+
+            @step(order=2, checkpoint=last_checkpoint)
+            def home(self):
+                self.driver.get(self.url)
+
+            def _write_points(self, points):
+                written.extend(point['name'] for point in points)
+
+        return Account, written
+
+    def test_second_run_starts_after_checkpoint(self):
+        Account, written = self.make_test(last_checkpoint=False)
+        self.assertEqual([r[1] for r in Account(driver='http', stats=True).run(quiet=True)],
+            ['login', 'home'])
+        self.assertIn('webtest.total', written)
+        del written[:]
+        test = Account(driver='http', stats=True)
+        self.assertEqual([r[1] for r in test.run(quiet=True)], ['home'])
+        self.assertEqual(test.restored_checkpoint, 'login')
+        self.assertIn('webtest.total.checkpoint', written)
+        self.assertNotIn('webtest.total', written)
+
+    def test_last_step_is_never_a_checkpoint(self):
+        Account, written = self.make_test(last_checkpoint=True)
+        for i in range(2):
+            del written[:]
+            test = Account(driver='http', stats=True)
+            self.assertEqual([r[1] for r in test.run(quiet=True)], ['home'] if i else ['login', 'home'])
+            self.assertIn('webtest.total.checkpoint' if i else 'webtest.total', written)
+
+    def test_saved_checkpoint_of_last_step_is_ignored(self):
+        Account, written = self.make_test(last_checkpoint=True)
+        key = checkpoint_key(Account, Account.URL)
+        CheckpointCache(self.path).save(key, 'home', {'url': Account.URL, 'cookies': [],
+            'local': {}, 'session': {}})
+        test = Account(driver='http', stats=True)
+        self.assertEqual([r[1] for r in test.run(quiet=True)], ['login', 'home'])
+        self.assertIsNone(test.restored_checkpoint)
+        self.assertIn('webtest.total', written)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Servidor de checks: peticiones simultaneas, cache con TTL y cliente HTTP"""
+
+import threading
+import time
+import unittest
+
+from webtest.checkserver import CheckServer, CheckService, request_check
+
+
+class SlowCheckService(CheckService):
+    """CheckService cuyos checks tardan `delay` sin cargar tests"""
+
+    def __init__(self, ttl=60, delay=0.1, fail=False):
+        CheckService.__init__(self, testdir=None, ttl=ttl)
+        self.delay = delay
+        self.fail = fail
+
+    def _run(self, test_name):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("browser crashed")
+        return 0, "OK : {} run {}".format(test_name, self.runs)
+
+
+class CheckServiceTest(unittest.TestCase):
+
+    def check_concurrently(self, service, count=8):
+        results = []
+        errors = []
+
+        def worker():
+            try:
+                results.append(service.check('home'))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def test_concurrent_requests_share_one_run(self):
+        service = SlowCheckService()
+        results, errors = self.check_concurrently(service)
+        self.assertEqual((service.runs, errors), (1, []))
+        self.assertEqual(set(output for _, output, _, _ in results), set(["OK : home run 1"]))
+        self.assertEqual(sorted(cached for _, _, _, cached in results), [False] + [True] * 7)
+
+    def test_results_are_cached_for_ttl(self):
+        service = SlowCheckService(ttl=60, delay=0)
+        self.assertFalse(service.check('home')[3])
+        code, output, age, cached = service.check('home')
+        self.assertTrue(cached)
+        self.assertLess(age, 60)
+        self.assertEqual(service.runs, 1)
+        service.check('other')
+        self.assertEqual(service.runs, 2)
+
+    def test_expired_or_too_old_results_run_again(self):
+        service = SlowCheckService(ttl=0.05, delay=0)
+        service.check('home')
+        time.sleep(0.1)
+        self.assertFalse(service.check('home')[3])
+        self.assertFalse(service.check('home', max_age=-1)[3])
+        self.assertEqual(service.runs, 3)
+
+    def test_waiters_are_released_when_the_run_fails(self):
+        service = SlowCheckService(fail=True)
+        results, errors = self.check_concurrently(service, count=4)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual([output for _, output, _, _ in results], ["UNKNOWN : check aborted"] * 3)
+        self.assertEqual(service.status()['running'], [])
+
+
+class CheckServerTest(unittest.TestCase):
+
+    def test_client_gets_code_and_output(self):
+        server = CheckServer(('127.0.0.1', 0), SlowCheckService(delay=0))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        address = "127.0.0.1:{}".format(server.server_address[1])
+        self.assertEqual(request_check(address, 'home'), (0, "OK : home run 1"))
+        self.assertEqual(request_check(address, 'home', max_age=60), (0, "OK : home run 1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
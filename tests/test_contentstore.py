@@ -0,0 +1,105 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Almacen de contenidos compartido entre procesos"""
+
+import errno
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from webtest import contentstore
+from webtest.contentstore import ContentStore, bytes_key
+
+
+def save_and_release(args):
+    """Guarda el mismo contenido varias veces y borra la mitad de enlaces"""
+    root, worker, count = args
+    store = ContentStore(root)
+    data = b"shared screenshot"
+    for i in range(count):
+        dest = os.path.join(root, "w{}_{}.png".format(worker, i))
+        store.save(bytes_key(data), "png", data, dest)
+        if i % 2:
+            store.release(dest)
+            os.remove(dest)
+
+
+class ContentStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.store = ContentStore(self.root)
+
+    def dest(self, name):
+        return os.path.join(self.root, name)
+
+    def test_duplicates_share_one_object(self):
+        data = b"same bytes"
+        key = bytes_key(data)
+        path, new = self.store.save(key, "png", data, self.dest("1.png"))
+        self.assertTrue(new)
+        self.assertEqual(self.store.save(key, "png", data, self.dest("2.png")), (path, False))
+        self.assertEqual(os.stat(path).st_nlink, 3)
+        with open(self.dest("2.png"), "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_release_removes_object_with_last_link(self):
+        data = b"only once"
+        key = bytes_key(data)
+        path, _ = self.store.save(key, "png", data, self.dest("1.png"))
+        self.store.save(key, "png", data, self.dest("2.png"))
+        self.store.release(self.dest("1.png"))
+        os.remove(self.dest("1.png"))
+        self.assertTrue(os.path.exists(path))
+        self.store.release(self.dest("2.png"))
+        os.remove(self.dest("2.png"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_release_sees_objects_of_other_instances(self):
+        data = b"from another process"
+        key = bytes_key(data)
+        path, _ = ContentStore(self.root).save(key, "png", data, self.dest("1.png"))
+        self.store.put(bytes_key(b"other"), "png", b"other")
+        self.store.release(self.dest("1.png"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_without_hard_links_files_are_stored_plain(self):
+        def no_link(source, dest):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        old_link = contentstore.os.link
+        contentstore.os.link = no_link
+        self.addCleanup(setattr, contentstore.os, 'link', old_link)
+        data = b"no links here"
+        key = bytes_key(data)
+        for name in ("1.png", "2.png"):
+            self.assertEqual(self.store.save(key, "png", data, self.dest(name)),
+                (self.dest(name), True))
+            with open(self.dest(name), "rb") as f:
+                self.assertEqual(f.read(), data)
+        self.assertFalse(os.path.exists(self.store.object_path(key, "png")))
+        self.store.release(self.dest("1.png"))
+        self.assertTrue(os.path.exists(self.dest("2.png")))
+
+    def test_processes_never_lose_a_linked_object(self):
+        pool = multiprocessing.Pool(4)
+        try:
+            pool.map(save_and_release, [(self.root, worker, 20) for worker in range(4)])
+        finally:
+            pool.close()
+            pool.join()
+        kept = [name for name in os.listdir(self.root) if name.endswith(".png")]
+        self.assertEqual(len(kept), 4 * 10)
+        data = b"shared screenshot"
+        path = self.store.object_path(bytes_key(data), "png")
+        self.assertEqual(os.stat(path).st_nlink, len(kept) + 1)
+        for name in kept:
+            with open(self.dest(name), "rb") as f:
+                self.assertEqual(f.read(), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Reparto de sesiones entre hubs: orden de preferencia y grids compartidos"""
+
+import time
+import unittest
+
+from webtest.grid import HubGrid, get_grid, parse_status
+
+
+class HubGridTest(unittest.TestCase):
+
+    def make_grid(self, *hubs):
+        """hubs: (healthy, free, start_ewma); sin consultas a /status"""
+        grid = HubGrid(["http://hub{}:4444/wd/hub".format(i) for i in range(len(hubs))],
+            probe_interval=3600)
+        for hub, (healthy, free, start_ewma) in zip(grid.hubs, hubs):
+            hub.healthy = healthy
+            hub.free = free
+            hub.start_ewma = start_ewma
+            hub.last_probe = time.time()
+        return grid
+
+    def names(self, grid):
+        return [hub.url.split("//")[1].split(":")[0] for hub in grid.candidates()]
+
+    def test_free_slots_first_then_unknown_then_full(self):
+        grid = self.make_grid((True, 0, None), (True, None, None), (True, 2, None), (True, 5, None))
+        self.assertEqual(self.names(grid), ['hub3', 'hub2', 'hub1', 'hub0'])
+
+    def test_ties_prefer_faster_session_start(self):
+        grid = self.make_grid((True, 2, 4.0), (True, 2, 1.5), (True, 2, None))
+        self.assertEqual(self.names(grid), ['hub2', 'hub1', 'hub0'])
+
+    def test_unhealthy_hubs_are_skipped(self):
+        grid = self.make_grid((False, 9, None), (True, 1, None))
+        self.assertEqual(self.names(grid), ['hub1'])
+
+    def test_placed_sessions_use_up_free_slots(self):
+        grid = self.make_grid((True, 2, 1.0), (True, 1, 1.0))
+        grid.hubs[0].record_start(1.0)
+        grid.hubs[0].record_start(1.0)
+        self.assertEqual(self.names(grid), ['hub1', 'hub0'])
+
+    def test_get_grid_is_shared_per_hubs_and_options(self):
+        urls = ["http://shared1:4444/wd/hub", "http://shared2:4444/wd/hub"]
+        grid = get_grid(urls, probe_interval=5)
+        self.assertIs(get_grid(urls, probe_interval=5), grid)
+        other = get_grid(urls, probe_interval=60)
+        self.assertIsNot(other, grid)
+        self.assertEqual(other.probe_interval, 60)
+
+    def test_parse_status(self):
+        self.assertEqual(parse_status({'status': 0}, {'slotCounts': {'free': 3, 'total': 5}}),
+            (True, 3, 5))
+        status = {'value': {'ready': True, 'nodes': [
+            {'slots': [{'session': None}, {'session': {'id': 1}}]},
+            {'availability': 'DOWN', 'slots': [{'session': None}]}]}}
+        self.assertEqual(parse_status(status), (True, 1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Histograma log-lineal: buckets, percentiles, merge y resumenes"""
+
+import random
+import unittest
+
+from webtest.histogram import Histogram, HistogramAggregator, SUMMARY_COLUMNS
+
+
+class RecordingWriter(object):
+
+    def __init__(self):
+        self.points = []
+
+    def write_points(self, points):
+        self.points.extend(points)
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_buckets_contain_their_values(self):
+        histogram = Histogram()
+        for units in [0, 1, 127, 128, 129, 255, 256, 1000, 123456, 2 ** 40 + 17]:
+            lower, width = histogram._bounds(histogram._index(units))
+            self.assertTrue(lower <= units < lower + width, units)
+
+    def test_bucket_width_bounds_relative_error(self):
+        histogram = Histogram()
+        for units in xrange(histogram._sub, 10 ** 6, 997):
+            lower, width = histogram._bounds(histogram._index(units))
+            self.assertLessEqual(float(width) / lower, 2.0 / histogram._sub)
+
+    def test_indexes_are_monotonic(self):
+        histogram = Histogram()
+        indexes = [histogram._index(units) for units in xrange(0, 50000)]
+        self.assertEqual(indexes, sorted(indexes))
+
+    def test_percentiles_within_one_percent(self):
+        random.seed(1)
+        values = [random.lognormvariate(0, 1) for i in range(20000)]
+        histogram = Histogram()
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for pct in (50, 90, 99):
+            exact = values[int(round(pct / 100.0 * len(values))) - 1]
+            self.assertAlmostEqual(histogram.percentile(pct) / exact, 1, delta=0.01)
+        self.assertEqual(histogram.percentile(100), values[-1])
+        self.assertEqual((histogram.min, histogram.max), (values[0], values[-1]))
+
+    def test_percentile_is_clamped_to_recorded_range(self):
+        histogram = Histogram()
+        histogram.record(1.2345)
+        self.assertEqual(histogram.percentile(50), 1.2345)
+        self.assertIsNone(Histogram().percentile(50))
+
+    def test_merge_equals_recording_everything(self):
+        one, two, both = Histogram(), Histogram(), Histogram()
+        for i in range(1000):
+            value = (i % 97) * 0.013
+            (one if i % 2 else two).record(value)
+            both.record(value)
+        one.merge(two)
+        self.assertEqual((one.counts, one.count, one.min, one.max),
+            (both.counts, both.count, both.min, both.max))
+        self.assertRaises(ValueError, one.merge, Histogram(significant_bits=5))
+
+
+class HistogramAggregatorTest(unittest.TestCase):
+
+    def test_flush_sends_one_summary_per_series_and_resets(self):
+        writer = RecordingWriter()
+        aggregator = HistogramAggregator(writer, interval=3600)
+        self.addCleanup(aggregator.close)
+        for value in (0.1, 0.2, 0.3):
+            aggregator.record('home.summary', value)
+        aggregator.record('login.summary', 1.0)
+        aggregator.flush()
+        self.assertEqual([p['name'] for p in writer.points], ['home.summary', 'login.summary'])
+        row = dict(zip(SUMMARY_COLUMNS, writer.points[0]['points'][0]))
+        self.assertEqual((row['count'], row['max']), (3, 0.3))
+        self.assertAlmostEqual(row['p50'], 0.2, delta=0.002)
+        aggregator.flush()
+        self.assertEqual(len(writer.points), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
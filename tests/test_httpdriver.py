@@ -0,0 +1,70 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Driver HTTP sin navegador contra el sitio de prueba"""
+
+import unittest
+
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+from webtest.httpdriver import HttpDriver, StaticWait
+from webtest.testing import FixtureServer, FIXTURE_PAGES
+
+PAGES = dict(FIXTURE_PAGES)
+PAGES['/form'] = """<!DOCTYPE html>
+<html><head><title>Form</title></head><body>
+<div id="hidden" style="display: none">hidden</div>
+<form id="search" action="/results"><input id="q" name="q">
+<button id="go" type="submit">Go</button></form>
+</body></html>"""
+PAGES['/results'] = "<html><head><title>Results</title></head><body></body></html>"
+
+
+class HttpDriverTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FixtureServer(pages=PAGES).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.driver = HttpDriver()
+        self.addCleanup(self.driver.quit)
+
+    def test_find_elements_in_document_and_under_elements(self):
+        self.driver.get(self.server.url('/'))
+        self.assertEqual(self.driver.title, "Fixture home")
+        self.assertEqual(len(self.driver.find_elements_by_css_selector("li.item")), 50)
+        content = self.driver.find_element_by_id("content")
+        # Buscando bajo un elemento solo se ve su subarbol
+        self.assertEqual(content.find_element_by_tag_name("input").get_attribute("id"), "q")
+        self.assertRaises(NoSuchElementException, content.find_element_by_id, "login")
+        self.assertIs(content.find_element_by_tag_name("ul").parent, self.driver)
+
+    def test_links_and_forms_navigate(self):
+        self.driver.get(self.server.url('/'))
+        self.driver.find_element_by_id("login").click()
+        self.assertEqual(self.driver.current_url, self.server.url('/login'))
+        self.driver.get(self.server.url('/form'))
+        self.driver.find_element_by_id("q").send_keys("shoes")
+        self.driver.find_element_by_id("go").click()
+        self.assertEqual(self.driver.current_url, self.server.url('/results?q=shoes'))
+        self.assertEqual(self.driver.title, "Results")
+
+    def test_static_wait(self):
+        self.driver.get(self.server.url('/form'))
+        wait = StaticWait(self.driver)
+        index, element = wait.until_any([('id', 'missing'), ('id', 'q')], 1)
+        self.assertEqual((index, element.get_attribute('name')), (1, 'q'))
+        self.assertRaises(TimeoutException, wait.until_any, [('id', 'hidden')], 1, visible=True)
+
+    def test_missing_page_has_status_code(self):
+        self.driver.get(self.server.url('/missing'))
+        self.assertEqual(self.driver.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
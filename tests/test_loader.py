@@ -0,0 +1,73 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Registro de tests: orden de las clases y recarga al cambiar el fichero"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+
+from webtest.loader import TestRegistry
+
+SOURCE = """
+from webtest.base import WebTest
+
+class {first}(WebTest):
+    URL = 'http://example.com/'
+
+class {second}(WebTest):
+    URL = 'http://example.com/'
+
+class _Private(WebTest):
+    URL = 'http://example.com/'
+"""
+
+
+class TestRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.testdir)
+        self.registry = TestRegistry(self.testdir)
+        self.module = "r{}".format(uuid.uuid4().hex[:8])
+
+    def write(self, first, second, mtime=None):
+        path = os.path.join(self.testdir, self.module + ".py")
+        with open(path, "w") as f:
+            f.write(SOURCE.format(first=first, second=second))
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_classes_in_definition_order(self):
+        self.write("Zeta", "Alpha")
+        self.assertEqual([Test.__name__ for _, Test in self.registry.scan()], ["Zeta", "Alpha"])
+        self.assertEqual(self.registry.get(self.module).__name__, "Zeta")
+        self.assertEqual(self.registry.get(self.module + ".py", "Alpha").__name__, "Alpha")
+        self.assertIsNone(self.registry.get(self.module, "_Private"))
+        self.assertIsNone(self.registry.get("missing"))
+
+    def test_modules_are_imported_once(self):
+        self.write("Home", "Search", mtime=time.time() - 10)
+        first = self.registry.get(self.module, "Home")
+        self.assertIs(self.registry.get(self.module, "Home"), first)
+
+    def test_changed_file_is_reloaded(self):
+        self.write("Home", "Search", mtime=time.time() - 10)
+        old = self.registry.get(self.module, "Home")
+        self.write("Home", "Checkout")
+        self.assertIsNot(self.registry.get(self.module, "Home"), old)
+        self.assertIsNotNone(self.registry.get(self.module, "Checkout"))
+
+    def test_removed_file_is_forgotten(self):
+        self.write("Home", "Search")
+        self.assertEqual(len(self.registry.scan()), 2)
+        os.remove(os.path.join(self.testdir, self.module + ".py"))
+        self.assertEqual(self.registry.scan(), [])
+        self.assertIsNone(self.registry.get(self.module))
+
+
+if __name__ == "__main__":
+    unittest.main()
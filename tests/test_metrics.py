@@ -0,0 +1,125 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Escritor de metricas: volcado a disco y reenvio cuando Influx vuelve"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from webtest.metrics import BufferedMetricsWriter
+from webtest.testing import NullMetricsClient
+
+
+def point(value):
+    return {'name': 'test.step', 'columns': ['time', 'value'], 'points': [[0, value]]}
+
+
+class FlakyMetricsClient(NullMetricsClient):
+    """NullMetricsClient que falla mientras `down` o tras `fail_after` escrituras"""
+
+    def __init__(self):
+        NullMetricsClient.__init__(self)
+        self.down = False
+        self.fail_after = None
+
+    def write_points(self, points):
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                self.fail_after = None
+                raise IOError("influx went away")
+            self.fail_after -= 1
+        if self.down:
+            raise IOError("influx is down")
+        NullMetricsClient.write_points(self, points)
+
+
+class BufferedMetricsWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.spill_path = os.path.join(self.dir, "spill.json")
+
+    def make_writer(self, client, **conf):
+        conf.setdefault("FLUSH_INTERVAL", 0.01)
+        writer = BufferedMetricsWriter(conf, client=client)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_flush_writes_everything_from_many_threads(self):
+        client = NullMetricsClient()
+        writer = self.make_writer(client, BATCH_SIZE=7, QUEUE_SIZE=16,
+            OVERFLOW="spill", SPILL_PATH=self.spill_path)
+
+        def worker():
+            for i in range(200):
+                writer.write_points([point(i)])
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(writer.flush(timeout=5))
+        # Lo desbordado a disco se reenvia tras la siguiente escritura
+        writer.write_points([point(0)])
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(client.points, 4 * 200 + 1)
+        self.assertEqual(writer.dropped, 0)
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_spill_replay_resumes_without_duplicates(self):
+        client = FlakyMetricsClient()
+        client.down = True
+        writer = self.make_writer(client, BATCH_SIZE=1,
+            OVERFLOW="spill", SPILL_PATH=self.spill_path)
+        for i in range(5):
+            writer.write_points([point(i)])
+            writer.flush(timeout=5)
+        self.assertEqual(client.points, 0)
+        with open(self.spill_path) as f:
+            self.assertEqual(len(f.readlines()), 5)
+
+        # Vuelve, pero se cae otra vez a mitad del reenvio
+        client.down = False
+        client.fail_after = 2
+        writer.write_points([point(5)])
+        writer.flush(timeout=5)
+        self.assertEqual(client.points, 2)
+        self.assertTrue(os.path.exists(self.spill_path + ".replay.cursor"))
+
+        writer.write_points([point(6)])
+        writer.flush(timeout=5)
+        self.assertEqual(client.points, 7)
+        for path in (self.spill_path, self.spill_path + ".replay",
+                self.spill_path + ".replay.cursor"):
+            self.assertFalse(os.path.exists(path))
+
+    def test_unwritable_spill_drops_points_and_keeps_running(self):
+        client = FlakyMetricsClient()
+        client.down = True
+        writer = self.make_writer(client, BATCH_SIZE=1, OVERFLOW="spill",
+            SPILL_PATH=os.path.join(self.dir, "missing", "spill.json"))
+        writer.write_points([point(1)])
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(writer.dropped, 1)
+        client.down = False
+        writer.write_points([point(2)])
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(client.points, 1)
+
+    def test_replay_skips_partial_last_line(self):
+        with open(self.spill_path, "w") as f:
+            f.write('[{"name": "a", "columns": ["value"], "points": [[1]]}]\n'
+                    '[{"name": "a", "columns": ["val')
+        client = NullMetricsClient()
+        writer = self.make_writer(client, SPILL_PATH=self.spill_path, OVERFLOW="spill")
+        writer.write_points([point(0)])
+        writer.flush(timeout=5)
+        self.assertEqual(client.points, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Pool de sesiones con varios hilos pidiendo y devolviendo a la vez"""
+
+import threading
+import time
+import unittest
+
+from webtest.base import WebTest
+from webtest.pool import SessionPool, PoolTimeout
+from webtest.testing import FakeWebDriver
+
+
+class CountingDriver(FakeWebDriver):
+    """FakeWebDriver que apunta cuantas sesiones hay vivas a la vez"""
+
+    def __init__(self, counter):
+        FakeWebDriver.__init__(self)
+        self.counter = counter
+        counter.started()
+
+    def delete_all_cookies(self):
+        # Limpiar la sesion no es instantaneo
+        time.sleep(0.002)
+
+    def quit(self):
+        time.sleep(0.005)
+        self.counter.stopped()
+
+
+class Counter(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.live = 0
+        self.peak = 0
+
+    def started(self):
+        with self.lock:
+            self.live += 1
+            self.peak = max(self.peak, self.live)
+
+    def stopped(self):
+        with self.lock:
+            self.live -= 1
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def make_pool(self, **kwargs):
+        counter = Counter()
+
+        def factory(driver, proxy=None, min_window_width=None):
+            time.sleep(0.002)
+            return CountingDriver(counter)
+        return SessionPool(factory=factory, **kwargs), counter
+
+    def test_reuses_released_session(self):
+        pool, counter = self.make_pool(max_sessions=2)
+        driver = pool.acquire('fake')
+        pool.release(driver)
+        self.assertIs(pool.acquire('fake'), driver)
+        self.assertEqual(counter.peak, 1)
+
+    def test_concurrent_acquires_never_exceed_max_sessions(self):
+        pool, counter = self.make_pool(max_sessions=3, max_uses=2)
+        errors = []
+
+        def worker(index):
+            try:
+                for i in range(25):
+                    driver = pool.acquire('ab'[(index + i) % 2])
+                    time.sleep(0.001)
+                    pool.release(driver)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(counter.peak, 3)
+        stats = pool.stats()
+        self.assertEqual((stats['borrowed'], stats['starting'], stats['in_transit']), (0, 0, 0))
+        pool.close()
+        self.assertEqual(counter.live, 0)
+
+    def test_full_pool_times_out(self):
+        pool, _ = self.make_pool(max_sessions=1)
+        pool.acquire('fake')
+        self.assertRaises(PoolTimeout, pool.acquire, 'fake', timeout=0.05)
+
+    def test_dead_session_is_replaced(self):
+        pool, counter = self.make_pool(max_sessions=1)
+        driver = pool.acquire('fake')
+        pool.release(driver)
+        # La sesion deja de responder mientras esta libre
+        del driver.current_url
+        other = pool.acquire('fake', timeout=1)
+        self.assertIsNot(other, driver)
+        self.assertEqual(counter.live, 1)
+
+    def test_failed_test_setup_releases_session(self):
+        class BrokenDriver(FakeWebDriver):
+            def implicitly_wait(self, seconds):
+                raise ValueError("implicitly_wait failed")
+        pool = SessionPool(max_sessions=1, acquire_timeout=0.1,
+            factory=lambda *args, **kwargs: BrokenDriver())
+        for i in range(2):
+            self.assertRaises(ValueError, WebTest, driver='fake', pool=pool)
+        stats = pool.stats()
+        self.assertEqual((stats['borrowed'], stats['idle'], stats['in_transit']), (0, 0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
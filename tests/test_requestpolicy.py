@@ -0,0 +1,101 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Modo origin only: cache LRU de estaticos y politica de peticiones"""
+
+import unittest
+
+from webtest.base import WebTest
+from webtest.pool import SessionPool
+from webtest.requestpolicy import AssetCache, RequestPolicy, DEFAULT_TTL
+from webtest.testing import FakeWebDriver
+
+
+def response(size):
+    return (200, "OK", [], "x" * size)
+
+
+class AssetCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        cache = AssetCache(max_bytes=100)
+        cache.put('a', response(40), 60)
+        cache.put('b', response(40), 60)
+        cache.get('a')
+        cache.put('c', response(40), 60)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.size, 80)
+
+    def test_big_item_evicts_several(self):
+        cache = AssetCache(max_bytes=100)
+        for key in 'abcd':
+            cache.put(key, response(25), 60)
+        cache.put('big', response(90), 60)
+        self.assertEqual(cache.stats()['items'], 1)
+        self.assertEqual(cache.size, 90)
+
+    def test_items_over_max_item_bytes_are_not_stored(self):
+        cache = AssetCache(max_bytes=100, max_item_bytes=10)
+        cache.put('a', response(11), 60)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
+
+    def test_replacing_and_expiring_keep_size_right(self):
+        cache = AssetCache(max_bytes=100)
+        cache.put('a', response(30), 60)
+        cache.put('a', response(10), 60)
+        self.assertEqual(cache.size, 10)
+        cache.put('b', response(20), -1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.size, 10)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+
+class RequestPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RequestPolicy(cache=AssetCache())
+
+    def test_blocked(self):
+        self.assertTrue(self.policy.blocked("https://www.google-analytics.com/analytics.js"))
+        self.assertFalse(self.policy.blocked("https://example.com/app.js"))
+        self.assertFalse(RequestPolicy(block=(), cache=False).blocked("https://doubleclick.net/"))
+
+    def test_cache_key_only_for_static_gets(self):
+        key = self.policy.cache_key('GET', "http://a.com/app.js?v=1", [('Accept-Encoding', ['gzip'])])
+        self.assertEqual(key, ("http://a.com/app.js?v=1", None, 'gzip'))
+        self.assertIsNone(self.policy.cache_key('POST', "http://a.com/app.js", []))
+        self.assertIsNone(self.policy.cache_key('GET', "http://a.com/page.html", []))
+        self.assertIsNone(self.policy.cache_key('GET', "http://a.com/v1.2/item", []))
+        self.assertIsNone(self.policy.cache_key('GET', "http://a.com/app.js",
+            [('Authorization', ['Basic x'])]))
+
+    def test_cache_key_depends_on_origin(self):
+        self.assertNotEqual(self.policy.cache_key('GET', "http://a.com/app.js", [], '10.0.0.1'),
+            self.policy.cache_key('GET', "http://a.com/app.js", [], '10.0.0.2'))
+
+    def test_response_ttl(self):
+        ttl = self.policy.response_ttl
+        self.assertEqual(ttl(200, [('Cache-Control', ['public, max-age=600'])]), 600)
+        self.assertEqual(ttl(200, []), DEFAULT_TTL)
+        self.assertIsNone(ttl(404, []))
+        self.assertIsNone(ttl(200, [('Cache-Control', ['private'])]))
+        self.assertIsNone(ttl(200, [('Set-Cookie', ['a=1'])]))
+        self.assertIsNone(ttl(200, [('Vary', ['Cookie'])]))
+        self.assertEqual(ttl(200, [('Vary', ['Accept-Encoding'])]), DEFAULT_TTL)
+
+
+class OriginOnlyTest(unittest.TestCase):
+
+    def test_explicit_proxy_keeps_full_page_series(self):
+        pool = SessionPool(factory=lambda *args, **kwargs: FakeWebDriver())
+        test = WebTest(driver='fake', pool=pool, proxy='127.0.0.1:3128', origin_only=True)
+        self.addCleanup(test.close)
+        self.assertIsNone(test.serie_sufix)
+        self.assertIsNone(test.proxy_server)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Almacen local de resultados: filas desordenadas, errores y reenvio"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from webtest.results import ResultsStore, split_step_points
+
+
+class RecordingClient(object):
+    """Cliente de influx que guarda los puntos que recibe"""
+
+    def __init__(self):
+        self.points = []
+
+    def write_points(self, points):
+        self.points.extend(points)
+
+
+class ResultsStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.store = ResultsStore(self.path)
+        self.uid = str(uuid.uuid1())
+
+    def row(self, timestamp, series='home', elapsed=1.0, error=False):
+        return (timestamp, series, elapsed, error, self.uid)
+
+    def test_scan_in_time_range(self):
+        self.store.append([self.row(t) for t in (10, 20, 30, 40)])
+        times = [row.time for row in self.store.scan(since=20, until=40)]
+        self.assertEqual(times, [20, 30])
+        self.assertEqual(set(row.test_uid for row in self.store.scan()), set([self.uid]))
+
+    def test_out_of_order_rows_are_found(self):
+        self.store.append([self.row(t) for t in (10, 20, 30)])
+        # Reenviadas tarde desde otro proceso
+        self.store.append([self.row(15), self.row(5)])
+        times = sorted(row.time for row in self.store.scan(since=12, until=25))
+        self.assertEqual(times, [15, 20])
+        self.assertEqual(len(list(self.store.scan(since=1))), 5)
+
+    def test_segments_roll_over(self):
+        store = ResultsStore(self.path, segment_rows=2)
+        for t in range(5):
+            store.append([self.row(t)])
+        self.assertEqual(store.segments(), [1, 2, 3])
+        self.assertEqual([row.time for row in store.scan(since=1, until=4)], [1, 2, 3])
+
+    def test_partial_append_does_not_misalign_columns(self):
+        self.store.append([self.row(10, 'a'), self.row(20, 'b', error="<p>boom</p>")])
+        # Un append anterior murio tras escribir solo la columna time
+        with open(os.path.join(self.path, "000001.time"), "ab") as f:
+            f.write("\0" * 8)
+        self.store.append([self.row(30, 'c', error="<p>late</p>")])
+        rows = list(self.store.scan())
+        self.assertEqual([(row.time, row.series) for row in rows],
+            [(10, 'a'), (20, 'b'), (30, 'c')])
+        self.assertEqual(self.store._errors(1), {1: "<p>boom</p>", 2: "<p>late</p>"})
+
+    def test_replay_sends_each_row_once_with_error_text(self):
+        self.store.append([self.row(10), self.row(20, error="<p>boom</p>")])
+        client = RecordingClient()
+        self.assertEqual(self.store.replay(client), 2)
+        errors = [p for p in client.points if 'error' in p['columns']]
+        self.assertEqual(errors[0]['points'][0][2], "<p>boom</p>")
+
+        self.store.append([self.row(5, elapsed=2.0)])
+        client = RecordingClient()
+        self.assertEqual(self.store.replay(client), 1)
+        self.assertEqual(client.points[0]['points'][0][:2], [5, 2.0])
+        self.assertEqual(self.store.replay(RecordingClient()), 0)
+
+    def test_split_step_points_keeps_error_text(self):
+        rows, others = split_step_points([
+            {'name': 'home', 'columns': ['time', 'elapsed', 'error', 'test_uid'],
+             'points': [[1, 0.5, "<p>boom</p>", self.uid]]},
+            {'name': 'other', 'columns': ['value'], 'points': [[1]]},
+        ])
+        self.assertEqual(rows, [(1, 'home', 0.5, "<p>boom</p>", self.uid)])
+        self.assertEqual([p['name'] for p in others], ['other'])
+
+
+if __name__ == "__main__":
+    unittest.main()
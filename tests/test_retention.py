@@ -0,0 +1,103 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Indice de retencion compartido entre instancias y procesos"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from webtest import retention
+from webtest.retention import RetentionIndex
+
+
+def write(path, size):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def add_files(args):
+    root, worker, count = args
+    index = RetentionIndex(root)
+    for i in range(count):
+        index.add(write(os.path.join(root, "w{}".format(worker), "{}.png".format(i)), 10))
+    index.close()
+
+
+class RetentionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def path(self, folder, name):
+        return os.path.join(self.root, folder, name)
+
+    def test_rebuilds_from_directory(self):
+        write(self.path("a", "1.png"), 10)
+        write(self.path("b", "1.png"), 20)
+        index = RetentionIndex(self.root)
+        self.assertEqual(index.total_bytes, 30)
+        self.assertEqual(index.folder_bytes(os.path.join(self.root, "b")), 20)
+
+    def test_enforce_evicts_oldest_first(self):
+        index = RetentionIndex(self.root, max_dir_bytes=25)
+        first = index.add(write(self.path("a", "1.png"), 10))
+        index.add(write(self.path("a", "2.png"), 10))
+        evicted = index.add(write(self.path("a", "3.png"), 10))
+        self.assertEqual(first, [])
+        self.assertEqual([path for path, _ in evicted], [self.path("a", "1.png")])
+        self.assertFalse(os.path.exists(self.path("a", "1.png")))
+        self.assertEqual(index.folder_bytes(self.path("a", "")), 20)
+
+    def test_instances_see_each_other(self):
+        one = RetentionIndex(self.root, max_total_bytes=25)
+        two = RetentionIndex(self.root, max_total_bytes=25)
+        one.add(write(self.path("a", "1.png"), 10))
+        two.add(write(self.path("b", "1.png"), 10))
+        evicted = one.add(write(self.path("a", "2.png"), 10))
+        # one ve la entrada de two al sincronizar; la mas antigua sigue siendo a/1
+        self.assertEqual([path for path, _ in evicted], [self.path("a", "1.png")])
+        two.discard(self.path("b", "1.png"))
+        one.enforce()
+        self.assertEqual(one.folder_bytes(self.path("b", "")), 0)
+        self.assertEqual(two.total_bytes, 10)
+        self.assertEqual(one.total_bytes, 10)
+
+    def test_compaction_keeps_other_instances_entries(self):
+        self.patch_compact_ratio(0.05)
+        one = RetentionIndex(self.root)
+        two = RetentionIndex(self.root)
+        for i in range(20):
+            one.add(write(self.path("a", "{}.png".format(i)), 1))
+            two.add(write(self.path("b", "{}.png".format(i)), 1))
+        three = RetentionIndex(self.root)
+        for index in (one, two, three):
+            index.enforce()
+            self.assertEqual(index.total_bytes, 40)
+
+    def test_processes_share_the_journal(self):
+        self.patch_compact_ratio(0.05)
+        RetentionIndex(self.root).close()
+        pool = multiprocessing.Pool(4)
+        try:
+            pool.map(add_files, [(self.root, worker, 30) for worker in range(4)])
+        finally:
+            pool.close()
+            pool.join()
+        index = RetentionIndex(self.root)
+        self.assertEqual(index.total_bytes, 4 * 30 * 10)
+
+    def patch_compact_ratio(self, ratio):
+        old = retention.COMPACT_RATIO
+        retention.COMPACT_RATIO = ratio
+        self.addCleanup(setattr, retention, 'COMPACT_RATIO', old)
+
+
+if __name__ == "__main__":
+    unittest.main()
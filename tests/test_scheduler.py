@@ -0,0 +1,155 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Planificador de `webtest serve`: orden, jitter, re-escaneo y cierre de tests"""
+
+import heapq
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+
+from webtest.base import WebTest
+from webtest.loader import TestRegistry
+from webtest.pool import SessionPool
+from webtest.scheduler import Job, Scheduler
+from webtest.testing import FakeWebDriver
+
+TEST_SOURCE = """
+from webtest.base import WebTest
+
+class {name}(WebTest):
+    INTERVAL = 30
+"""
+
+
+class Dummy(object):
+    __name__ = 'Dummy'
+    INTERVAL = 10
+    MAX_CONCURRENCY = 1
+
+
+def make_job(name, interval=10, max_concurrency=1):
+    job = Job('tests', Dummy, interval, max_concurrency)
+    job.name = name
+    return job
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def due(self, scheduler, *jobs):
+        """Mete los jobs en el heap con horas ya pasadas, en ese orden"""
+        now = time.time() - 100
+        for index, job in enumerate(jobs):
+            heapq.heappush(scheduler._heap, (now + index, index, job))
+
+    def queued(self, scheduler):
+        names = []
+        while not scheduler._queue.empty():
+            names.append(scheduler._queue.get_nowait().name)
+        return names
+
+    def test_jitter_stays_within_bounds(self):
+        scheduler = Scheduler([], jitter=0.2)
+        job = make_job('a', interval=100)
+        times = [scheduler._next_time(job, 1000) for i in range(500)]
+        self.assertTrue(all(1080 <= t <= 1120 for t in times))
+        self.assertGreater(len(set(times)), 1)
+        self.assertEqual(Scheduler([], jitter=0)._next_time(job, 1000), 1100)
+
+    def test_due_jobs_run_in_time_order(self):
+        scheduler = Scheduler([], workers=4)
+        first, second, third = make_job('first'), make_job('second'), make_job('third')
+        self.due(scheduler, first, second, third)
+        for i in range(3):
+            scheduler.tick()
+        self.assertEqual(self.queued(scheduler), ['first', 'second', 'third'])
+        # Cada uno vuelve al heap un intervalo despues
+        self.assertTrue(all(when > time.time() - 100 + 5 for when, _, _ in scheduler._heap))
+
+    def test_first_runs_are_spread_over_the_interval(self):
+        tests = [('tests', type('T{}'.format(i), (Dummy,), {'INTERVAL': 60})) for i in range(20)]
+        scheduler = Scheduler(tests, workers=0)
+        now = time.time()
+        scheduler.start()
+        firsts = [when - now for when, _, _ in scheduler._heap]
+        self.assertTrue(all(0 <= first <= 61 for first in firsts))
+        self.assertEqual(len(scheduler._heap), 20)
+
+    def test_skips_job_at_max_concurrency(self):
+        scheduler = Scheduler([], workers=4)
+        job = make_job('busy', max_concurrency=1)
+        job.running = 1
+        self.due(scheduler, job)
+        scheduler.tick()
+        self.assertEqual((job.skipped, self.queued(scheduler)), (1, []))
+
+    def test_skips_job_when_workers_are_busy(self):
+        scheduler = Scheduler([], workers=1)
+        one, two = make_job('one'), make_job('two')
+        self.due(scheduler, one, two)
+        scheduler.tick()
+        scheduler.tick()
+        self.assertEqual((two.skipped, two.running), (1, 0))
+        self.assertEqual(self.queued(scheduler), ['one'])
+
+
+class RescanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.testdir)
+        self.registry = TestRegistry(self.testdir)
+
+    def write_test(self):
+        module_name = "t_{}".format(uuid.uuid4().hex[:8])
+        with open(os.path.join(self.testdir, module_name + ".py"), "w") as f:
+            f.write(TEST_SOURCE.format(name="Home"))
+        return module_name
+
+    def test_new_and_removed_tests(self):
+        first = self.write_test()
+        scheduler = Scheduler(self.registry.scan(), workers=0, registry=self.registry,
+            rescan_interval=0)
+        scheduler.start()
+        second = self.write_test()
+        os.remove(os.path.join(self.testdir, first + ".py"))
+        scheduler.rescan()
+        self.assertEqual([job.name for job in scheduler.jobs], [second + ".Home"])
+        removed = [job for _, _, job in scheduler._heap if job.removed]
+        self.assertEqual([job.name for job in removed], [first + ".Home"])
+        # Al llegar su hora el borrado sale del heap sin lanzarse
+        scheduler._heap = [(0, 0, removed[0])]
+        scheduler.rescan_interval = 3600
+        scheduler.tick()
+        self.assertEqual(scheduler._heap, [])
+
+
+class RunJobTest(unittest.TestCase):
+
+    def test_failed_run_releases_session_once(self):
+        releases = []
+
+        class CountingPool(SessionPool):
+            def release(self, driver, broken=False):
+                releases.append(driver)
+                SessionPool.release(self, driver, broken)
+
+        class Failing(WebTest):
+            def run(self, quiet=False):
+                self.close()
+                raise ValueError("failed after closing")
+
+        pool = CountingPool(factory=lambda *args, **kwargs: FakeWebDriver())
+        scheduler = Scheduler([('tests', Failing)], workers=0, pool=pool,
+            test_kwargs={'driver': 'fake'})
+        job = scheduler.jobs[0]
+        scheduler.run_job(job)
+        self.assertEqual((job.errors, len(releases)), (1, 1))
+        self.assertEqual(pool.stats()['idle'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
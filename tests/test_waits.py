@@ -0,0 +1,78 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Esperas en el navegador: reintentos solo cuando la pagina ha navegado"""
+
+import unittest
+
+from selenium.common import exceptions
+
+from webtest.testing import FakeWebDriver
+from webtest.waits import BrowserWait, is_navigation_error
+
+
+class ScriptedDriver(FakeWebDriver):
+    """execute_async_script devuelve o lanza, por orden, lo que hay en `outcomes`"""
+
+    def __init__(self, outcomes):
+        FakeWebDriver.__init__(self)
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.script_timeouts = []
+
+    def set_script_timeout(self, seconds):
+        self.script_timeouts.append(seconds)
+
+    def execute_async_script(self, script, *args):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class BrowserWaitTest(unittest.TestCase):
+
+    def test_returns_first_found_locator(self):
+        driver = ScriptedDriver([[1, 'element']])
+        self.assertEqual(BrowserWait(driver).until_any([('id', 'a'), ('id', 'b')], 5), (1, 'element'))
+
+    def test_retries_after_navigation(self):
+        driver = ScriptedDriver([
+            exceptions.WebDriverException("document unloaded while waiting for result"),
+            exceptions.NoSuchWindowException("window closed"),
+            [0, 'element']])
+        self.assertEqual(BrowserWait(driver).until_any([('id', 'a')], 5), (0, 'element'))
+        self.assertEqual(driver.calls, 3)
+
+    def test_other_errors_are_raised_at_once(self):
+        driver = ScriptedDriver([exceptions.InvalidSelectorException("bad selector")])
+        self.assertRaises(exceptions.InvalidSelectorException,
+            BrowserWait(driver).until_any, [('css selector', '[')], 5)
+        self.assertEqual(driver.calls, 1)
+
+    def test_not_found_times_out(self):
+        driver = ScriptedDriver([None])
+        self.assertRaises(exceptions.TimeoutException,
+            BrowserWait(driver).until_any, [('id', 'a')], 5)
+
+    def test_script_timeout_only_grows(self):
+        driver = ScriptedDriver([[0, 'a'], [0, 'b'], [0, 'c']])
+        wait = BrowserWait(driver)
+        wait.until_any([('id', 'a')], 5)
+        wait.until_any([('id', 'a')], 2)
+        wait.until_any([('id', 'a')], 10)
+        self.assertEqual(len(driver.script_timeouts), 2)
+        self.assertLess(driver.script_timeouts[0], driver.script_timeouts[1])
+
+    def test_is_navigation_error(self):
+        stale = exceptions.StaleElementReferenceException("stale element")
+        self.assertTrue(is_navigation_error(stale))
+        # Con root el elemento raiz era de la pagina anterior: no se reintenta
+        self.assertFalse(is_navigation_error(stale, root=object()))
+        self.assertTrue(is_navigation_error(exceptions.WebDriverException("Page navigated")))
+        self.assertFalse(is_navigation_error(exceptions.WebDriverException("javascript error")))
+
+
+if __name__ == "__main__":
+    unittest.main()
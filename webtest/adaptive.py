@@ -0,0 +1,193 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Timeouts adaptativos por step.
+
+Con un unico `timeout` todas las esperas de todos los steps tienen el
+mismo margen: un step colgado consume siempre el timeout completo. En modo
+adaptativo se guarda, por test (modulo:Clase), stats_name y step, una
+ventana con las ultimas duraciones correctas y cada step espera como mucho
+
+    percentil(PERCENTILE) * FACTOR, acotado entre FLOOR y CEILING
+
+(CEILING por defecto es el timeout del test: solo se acorta). Hasta tener
+MIN_SAMPLES muestras se usa el timeout normal. La conf se aplica por test.
+Las ventanas se guardan en PATH/<stats_name>/<modulo>.<Clase>.json para que
+check_web, un proceso por check, aprenda de las ejecuciones anteriores; al
+guardar se mezclan con lo que hayan guardado otros procesos.
+
+    class HomeCheck(WebTest):
+        ADAPTIVE_TIMEOUTS = {'FACTOR': 2}
+"""
+
+import atexit
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ADAPTIVE_PATH = "~/.webtest/adaptive"
+DEFAULT_CONF = {
+    'PATH': DEFAULT_ADAPTIVE_PATH,
+    'PERCENTILE': 99,
+    'FACTOR': 3.0,
+    'FLOOR': 1.0,           # segundos
+    'CEILING': None,        # segundos; None = timeout del test
+    'MIN_SAMPLES': 20,
+    'WINDOW': 200,          # duraciones guardadas por step
+}
+
+
+def percentile(values, pct):
+    """Percentil por rango mas cercano de una secuencia ordenada"""
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[min(len(values) - 1, max(0, rank))]
+
+
+class StepWindows(object):
+    """Ventanas de duraciones de los steps de un test, compartidas en el proceso"""
+
+    def __init__(self, path, window=DEFAULT_CONF['WINDOW']):
+        self.path = path
+        self.window = window
+        self._windows = {}
+        self._sorted = {}
+        self._new = {}          # muestras aun no guardadas
+        self._lock = threading.Lock()
+        with self._lock:
+            self._windows = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        return dict((step_name, deque(values, maxlen=self.window))
+            for step_name, values in data.get('steps', {}).items())
+
+    def sorted_window(self, step_name, last=None):
+        """
+        Ultimas `last` duraciones del step, ordenadas; la ventana completa se
+        cachea hasta el siguiente record
+        """
+        with self._lock:
+            values = self._windows.get(step_name, ())
+            if last is not None and len(values) > last:
+                return sorted(list(values)[-last:])
+            ordered = self._sorted.get(step_name)
+            if ordered is None:
+                ordered = self._sorted[step_name] = sorted(values)
+            return ordered
+
+    def record(self, step_name, elapsed, window=None):
+        with self._lock:
+            if window and window > self.window:
+                self.window = window
+                self._windows = dict((name, deque(values, maxlen=window))
+                    for name, values in self._windows.items())
+            values = self._windows.get(step_name)
+            if values is None:
+                values = self._windows[step_name] = deque(maxlen=self.window)
+            values.append(round(elapsed, 4))
+            self._new.setdefault(step_name, []).append(round(elapsed, 4))
+            self._sorted.pop(step_name, None)
+
+    def save(self):
+        """Añade las muestras nuevas a lo que haya en disco (de otros procesos)"""
+        with self._lock:
+            if not self._new:
+                return
+            new, self._new = self._new, {}
+            directory = os.path.dirname(self.path)
+            tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                with open(self.path + ".lock", "a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        windows = self._read()
+                        for step_name, values in new.items():
+                            merged = windows.get(step_name)
+                            if merged is None:
+                                merged = windows[step_name] = deque(maxlen=self.window)
+                            merged.extend(values)
+                        with open(tmp_path, "w") as f:
+                            json.dump({'steps': dict((name, list(values))
+                                for name, values in windows.items())}, f)
+                        os.rename(tmp_path, self.path)
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+            except (IOError, OSError) as e:
+                log.warning("Could not save adaptive timeouts {}: {}".format(self.path, e))
+                return
+            self._windows = windows
+            self._sorted = {}
+
+
+class AdaptiveTimeouts(object):
+    """Timeouts de los steps de un test con su conf"""
+
+    def __init__(self, windows, conf=None):
+        self.windows = windows
+        self.conf = dict(DEFAULT_CONF)
+        self.conf.update(conf or {})
+
+    def timeout(self, step_name, default):
+        """Margen de espera del step; default si aun no hay muestras suficientes"""
+        values = self.windows.sorted_window(step_name, self.conf['WINDOW'])
+        if len(values) < self.conf['MIN_SAMPLES']:
+            return default
+        budget = percentile(values, self.conf['PERCENTILE']) * self.conf['FACTOR']
+        ceiling = self.conf['CEILING'] or default
+        return min(ceiling, max(self.conf['FLOOR'], budget))
+
+    def record(self, step_name, elapsed):
+        """Duracion de un step correcto"""
+        self.windows.record(step_name, elapsed, self.conf['WINDOW'])
+
+    def save(self):
+        self.windows.save()
+
+
+_windows = {}
+_windows_lock = threading.Lock()
+
+
+def test_id(test_class):
+    return "{}.{}".format(test_class.__module__, test_class.__name__)
+
+
+def get_adaptive_timeouts(test_class, stats_name, conf=None):
+    """
+    AdaptiveTimeouts de un test con su conf; las ventanas se comparten entre
+    los tests del proceso de la misma clase y stats_name
+    """
+    conf = conf or {}
+    path = os.path.join(os.path.expanduser(conf.get('PATH', DEFAULT_ADAPTIVE_PATH)),
+        stats_name, "{}.json".format(test_id(test_class)))
+    with _windows_lock:
+        windows = _windows.get(path)
+        if windows is None:
+            windows = _windows[path] = StepWindows(path,
+                conf.get('WINDOW', DEFAULT_CONF['WINDOW']))
+    return AdaptiveTimeouts(windows, conf)
+
+
+def save_adaptive_timeouts():
+    with _windows_lock:
+        windows = _windows.values()
+    for step_windows in windows:
+        step_windows.save()
+
+
+atexit.register(save_adaptive_timeouts)
@@ -0,0 +1,468 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cliente asincrono del protocolo WebDriver (W3C) y WebTest asincrono.
+
+El cliente de selenium es sincrono: un hilo por navegador. Aqui los
+comandos son peticiones HTTP de twisted sobre un pool de conexiones
+keep-alive al hub y devuelven Deferreds, asi que un proceso puede llevar
+decenas de sesiones a la vez en un unico hilo (el del reactor).
+
+Los steps de un AsyncWebTest son generadores al estilo inlineCallbacks;
+cada `yield` espera un comando:
+
+    class HomeCheck(AsyncWebTest):
+        URL = 'http://www.example.com/'
+
+        @async_step(order=1)
+        def home(self):
+            "Home"
+            yield self.driver.get(self.url)
+            yield self.wait_for_id('content')
+
+    results = run_blocking([HomeCheck(stats=True) for _ in range(30)],
+        concurrency=30)
+
+(En python 2 no hay asyncio; se usa twisted, que ya usa webtest.proxy.)
+"""
+
+import base64
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+import uuid
+from StringIO import StringIO
+
+from twisted.internet import defer, reactor, threads
+from twisted.web import client
+from twisted.web.http_headers import Headers
+
+from webtest.base import StepStats, format_exception, STEP_COLUMNS, DEFAULT_TIMEOUT
+from webtest.lazy import LazyImport
+from webtest.waits import WAIT_SCRIPT, SCRIPT_TIMEOUT_MARGIN
+
+exceptions = LazyImport('selenium.common.exceptions')
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DRIVER_URL = 'http://hub:4444/wd/hub'
+DEFAULT_MAX_PER_HOST = 50       # conexiones keep-alive guardadas por hub
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_CONCURRENCY = 20
+W3C_ELEMENT = 'element-6066-11e4-a52e-4f735466cecf'
+
+# Errores W3C (y status del protocolo JSON antiguo) -> excepciones de selenium
+ERRORS = {
+    'no such element': 'NoSuchElementException',
+    'stale element reference': 'StaleElementReferenceException',
+    'timeout': 'TimeoutException',
+    'script timeout': 'TimeoutException',
+    'invalid selector': 'InvalidSelectorException',
+    'no such window': 'NoSuchWindowException',
+    'invalid session id': 'NoSuchWindowException',
+    7: 'NoSuchElementException',
+    10: 'StaleElementReferenceException',
+    21: 'TimeoutException',
+    28: 'TimeoutException',
+}
+
+# Locators que W3C no tiene, traducidos a css como hace selenium
+def w3c_locator(by, value):
+    if by == 'id':
+        return 'css selector', '[id="{}"]'.format(value)
+    if by == 'name':
+        return 'css selector', '[name="{}"]'.format(value)
+    if by == 'class name':
+        return 'css selector', '.{}'.format(value)
+    return by, value
+
+
+def make_error(error, message):
+    name = ERRORS.get(error, 'WebDriverException')
+    return getattr(exceptions, name)("{}: {}".format(error, message))
+
+
+class WebDriverClient(object):
+    """Peticiones al hub con un pool de conexiones persistente"""
+
+    def __init__(self, url=DEFAULT_DRIVER_URL, max_per_host=DEFAULT_MAX_PER_HOST,
+            connect_timeout=DEFAULT_CONNECT_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.pool = client.HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = max_per_host
+        self.agent = client.Agent(reactor, connectTimeout=connect_timeout, pool=self.pool)
+        self.commands = 0
+
+    @defer.inlineCallbacks
+    def request(self, method, path, data=None):
+        """Respuesta json completa de un comando; lanza la excepcion de selenium"""
+        body = None
+        if data is not None:
+            body = client.FileBodyProducer(StringIO(json.dumps(data)))
+        headers = Headers({'Content-Type': ['application/json; charset=utf-8'],
+            'Accept': ['application/json']})
+        self.commands += 1
+        response = yield self.agent.request(method, self.url + path, headers, body)
+        content = yield client.readBody(response)
+        try:
+            payload = json.loads(content) if content else {}
+        except ValueError:
+            payload = {'value': {'error': 'unknown error', 'message': content[:300]}}
+        value = payload.get('value')
+        if isinstance(value, dict) and 'error' in value:
+            raise make_error(value['error'], value.get('message', ''))
+        if payload.get('status'):
+            message = value.get('message', '') if isinstance(value, dict) else value
+            raise make_error(payload['status'], message)
+        if response.code >= 400:
+            raise make_error('unknown error', "HTTP {}".format(response.code))
+        defer.returnValue(payload)
+
+    @defer.inlineCallbacks
+    def new_session(self, capabilities=None):
+        capabilities = capabilities or {}
+        payload = yield self.request('POST', '/session', {
+            'capabilities': {'alwaysMatch': capabilities},
+            'desiredCapabilities': capabilities,
+        })
+        value = payload.get('value') or {}
+        session_id = payload.get('sessionId') or value.get('sessionId')
+        defer.returnValue(AsyncSession(self, session_id,
+            value.get('capabilities', value)))
+
+    def close(self):
+        return self.pool.closeCachedConnections()
+
+
+class _Finder(object):
+    """
+    find_element* comunes a la sesion y a los elementos; las rutas de los
+    comandos empiezan por _path ('' en la sesion, /element/<id> en un elemento)
+    """
+    _path = ''
+
+    @defer.inlineCallbacks
+    def find_element(self, by='id', value=None):
+        using, value = w3c_locator(by, value)
+        value = yield self._command('POST', self._path + '/element',
+            {'using': using, 'value': value})
+        defer.returnValue(self._session._element(value))
+
+    @defer.inlineCallbacks
+    def find_elements(self, by='id', value=None):
+        using, value = w3c_locator(by, value)
+        values = yield self._command('POST', self._path + '/elements',
+            {'using': using, 'value': value})
+        defer.returnValue([self._session._element(v) for v in values])
+
+
+class AsyncElement(_Finder):
+
+    def __init__(self, session, element_id):
+        self._session = session
+        self.id = element_id
+        self._path = '/element/{}'.format(element_id)
+
+    def _command(self, method, path, data=None):
+        return self._session._command(method, path, data)
+
+    def to_json(self):
+        return {W3C_ELEMENT: self.id, 'ELEMENT': self.id}
+
+    def click(self):
+        return self._command('POST', self._path + '/click', {})
+
+    def clear(self):
+        return self._command('POST', self._path + '/clear', {})
+
+    def send_keys(self, *values):
+        text = u"".join(values)
+        return self._command('POST', self._path + '/value',
+            {'text': text, 'value': list(text)})
+
+    def text(self):
+        return self._command('GET', self._path + '/text')
+
+    def get_attribute(self, name):
+        return self._command('GET', self._path + '/attribute/{}'.format(name))
+
+    def is_displayed(self):
+        return self._command('GET', self._path + '/displayed')
+
+
+class AsyncSession(_Finder):
+    """Sesion de webdriver; cada comando devuelve un Deferred"""
+
+    def __init__(self, driver_client, session_id, capabilities=None):
+        self.client = driver_client
+        self.session_id = session_id
+        self.capabilities = capabilities or {}
+        self._session = self
+
+    def _element(self, value):
+        element_id = value.get(W3C_ELEMENT) or value.get('ELEMENT')
+        return AsyncElement(self, element_id)
+
+    def _unwrap(self, value):
+        if isinstance(value, list):
+            return [self._unwrap(v) for v in value]
+        if isinstance(value, dict):
+            if W3C_ELEMENT in value or 'ELEMENT' in value:
+                return self._element(value)
+            return dict((k, self._unwrap(v)) for k, v in value.items())
+        return value
+
+    def _command(self, method, path, data=None):
+        d = self.client.request(method, '/session/{}{}'.format(self.session_id, path), data)
+        return d.addCallback(lambda payload: payload.get('value'))
+
+    def get(self, url):
+        return self._command('POST', '/url', {'url': url})
+
+    def current_url(self):
+        return self._command('GET', '/url')
+
+    def title(self):
+        return self._command('GET', '/title')
+
+    def page_source(self):
+        return self._command('GET', '/source')
+
+    def set_timeouts(self, implicit=None, script=None, page_load=None):
+        """Segundos; solo se cambian los que se pasan"""
+        timeouts = dict((key, int(value * 1000)) for key, value in
+            (('implicit', implicit), ('script', script), ('pageLoad', page_load))
+            if value is not None)
+        return self._command('POST', '/timeouts', timeouts)
+
+    def _script(self, kind, script, args):
+        args = [arg.to_json() if isinstance(arg, AsyncElement) else arg for arg in args]
+        d = self._command('POST', '/execute/{}'.format(kind), {'script': script, 'args': args})
+        return d.addCallback(self._unwrap)
+
+    def execute_script(self, script, *args):
+        return self._script('sync', script, args)
+
+    def execute_async_script(self, script, *args):
+        return self._script('async', script, args)
+
+    def get_screenshot_as_png(self):
+        return self._command('GET', '/screenshot').addCallback(base64.b64decode)
+
+    def get_cookies(self):
+        return self._command('GET', '/cookie')
+
+    def delete_all_cookies(self):
+        return self._command('DELETE', '/cookie')
+
+    def set_window_size(self, width, height):
+        return self._command('POST', '/window/rect', {'width': width, 'height': height})
+
+    def quit(self):
+        return self._command('DELETE', '')
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_webdriver_client(url=DEFAULT_DRIVER_URL, **kwargs):
+    """WebDriverClient compartido (un pool de conexiones por hub)"""
+    with _clients_lock:
+        driver_client = _clients.get(url)
+        if driver_client is None:
+            driver_client = _clients[url] = WebDriverClient(url, **kwargs)
+        return driver_client
+
+
+def async_step(func=None, order=1):
+    """Como webtest.step, para steps que devuelven Deferreds o son generadores"""
+
+    if func is None:
+        return functools.partial(async_step, order=order)
+
+    call = defer.inlineCallbacks(func) if inspect.isgeneratorfunction(func) else func
+
+    @functools.wraps(func)
+    def f(*args, **kwargs):
+        step_name = func.__name__
+        step_doc = func.__doc__
+        t1 = time.time()
+
+        def done(result):
+            return time.time() - t1, step_name, step_doc, None
+
+        def failed(failure):
+            try:
+                failure.raiseException()
+            except Exception as e:
+                error = format_exception(e, step_name, step_doc)
+            return time.time() - t1, step_name, step_doc, error
+
+        return defer.maybeDeferred(call, *args, **kwargs).addCallbacks(done, failed)
+    f.order = order
+    return f
+
+
+class AsyncWebTest(StepStats):
+    """WebTest cuyos steps y wait_for_* devuelven Deferreds"""
+    URL = ''
+    DRIVER_URL = DEFAULT_DRIVER_URL
+    CAPABILITIES = {'browserName': 'firefox'}
+
+    def __init__(self, url=None, timeout=DEFAULT_TIMEOUT, stats=False,
+            stats_name='webtest', serie_sufix=None, influx_conf=None,
+            results_path=None, capabilities=None, driver_client=None):
+        self.url = url or self.URL
+        self.timeout = timeout
+        self.stats = stats
+        self.stats_name = stats_name
+        self.serie_sufix = serie_sufix
+        self.influx_conf = influx_conf
+        self.results_path = results_path
+        self.capabilities = capabilities or self.CAPABILITIES
+        self.client = driver_client or get_webdriver_client(self.DRIVER_URL)
+        self.driver = None
+        self._script_timeout = None
+
+    @defer.inlineCallbacks
+    def start(self):
+        """Abre la sesion en el hub"""
+        self.driver = yield self.client.new_session(self.capabilities)
+        self._script_timeout = self.timeout + SCRIPT_TIMEOUT_MARGIN
+        yield self.driver.set_timeouts(implicit=self.timeout, script=self._script_timeout)
+        defer.returnValue(self)
+
+    def close(self):
+        driver, self.driver = self.driver, None
+        if driver is None:
+            return defer.succeed(None)
+        return driver.quit()
+
+    @defer.inlineCallbacks
+    def wait_for_any(self, *locators, **kwargs):
+        """Como WebTest.wait_for_any, esperando dentro del navegador"""
+        timeout = kwargs.get('timeout') or self.timeout
+        visible = kwargs.get('visible', False)
+        root = kwargs.get('root')
+        if self._script_timeout < timeout + SCRIPT_TIMEOUT_MARGIN:
+            self._script_timeout = timeout + SCRIPT_TIMEOUT_MARGIN
+            yield self.driver.set_timeouts(script=self._script_timeout)
+        locators = [list(w3c_locator(*locator)) for locator in locators]
+        try:
+            result = yield self.driver.execute_async_script(WAIT_SCRIPT,
+                locators, visible, int(timeout * 1000), root)
+        except exceptions.TimeoutException:
+            result = None
+        if not result:
+            raise exceptions.TimeoutException(
+                "Timed out after {}s waiting for {}".format(timeout,
+                    " or ".join("{}={}".format(*l) for l in locators)))
+        defer.returnValue((result[0], result[1]))
+
+    def _wait_for(self, by, name, timeout=None, visible=False):
+        d = self.wait_for_any((by, name), timeout=timeout, visible=visible)
+        return d.addCallback(lambda found: found[1])
+
+    def wait_for_id(self, name, timeout=None, visible=False):
+        return self._wait_for('id', name, timeout, visible)
+
+    def wait_for_class(self, name, timeout=None, visible=False):
+        return self._wait_for('class name', name, timeout, visible)
+
+    def wait_for_xpath(self, name, timeout=None, visible=False):
+        return self._wait_for('xpath', name, timeout, visible)
+
+    def wait_for_css_selector(self, name, timeout=None, visible=False):
+        return self._wait_for('css selector', name, timeout, visible)
+
+    def _get_steps(self):
+        steps = inspect.getmembers(self, predicate=inspect.ismethod)
+        steps = [s for _, s in steps if hasattr(s, "order")]
+        steps.sort(key=lambda f: f.order)
+        return steps
+
+    @defer.inlineCallbacks
+    def steps(self):
+        """[(elapsed, name, doc, error), ...] hasta el primer error"""
+        results = []
+        for step in self._get_steps():
+            result = yield step()
+            results.append(result)
+            if result[3]:
+                break
+        defer.returnValue(results)
+
+    @defer.inlineCallbacks
+    def run(self):
+        """Abre la sesion si hace falta, ejecuta los steps y envia los tiempos"""
+        own_session = self.driver is None
+        if own_session:
+            yield self.start()
+        test_uid = str(uuid.uuid1())
+        init_test_time = time.time()
+        try:
+            results = yield self.steps()
+        finally:
+            if own_session:
+                # Un fallo al cerrar no debe tapar el resultado de los steps
+                try:
+                    yield self.close()
+                except Exception as e:
+                    log.warn("Error closing session of {}: {}".format(self.stats_name, e))
+        elapsed_test_time = time.time() - init_test_time
+        if self.stats:
+            # El almacen local escribe en disco: fuera del hilo del reactor
+            yield threads.deferToThread(self._write_points,
+                self._points(results, test_uid, elapsed_test_time))
+        defer.returnValue(results)
+
+    def _points(self, results, test_uid, elapsed_test_time):
+        now = time.time()
+        points = [{
+            'points': [[now, test_uid]],
+            'name': self._compose_serie_name('{}.executions'.format(self.stats_name),
+                False, self.serie_sufix),
+            'columns': ['time', "test_uid"]
+        }]
+        failed = False
+        for elapsed, name, doc, error in results:
+            serie_name = self._compose_serie_name("{}.{}".format(self.stats_name, name),
+                error, self.serie_sufix)
+            if error:
+                failed = True
+                points.append({'points': [[now, elapsed, error, test_uid]], 'name': serie_name,
+                    'columns': ['time', 'elapsed', "error", "test_uid"]})
+            else:
+                points.append({'points': [[now, elapsed, test_uid]], 'name': serie_name,
+                    'columns': STEP_COLUMNS})
+        if not failed:
+            points.append({
+                'points': [[now, elapsed_test_time, test_uid]],
+                'name': self._compose_serie_name('{}.total'.format(self.stats_name),
+                    False, self.serie_sufix),
+                'columns': STEP_COLUMNS
+            })
+        return points
+
+
+def run_tests(tests, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Ejecuta los AsyncWebTest con como mucho `concurrency` sesiones a la vez.
+    Deferred con [(exito, resultados o Failure), ...] en el orden de tests
+    """
+    semaphore = defer.DeferredSemaphore(concurrency)
+    return defer.DeferredList([semaphore.run(test.run) for test in tests],
+        consumeErrors=True)
+
+
+def run_blocking(tests, concurrency=DEFAULT_CONCURRENCY):
+    """run_tests desde codigo sincrono: el reactor corre en su propio hilo"""
+    from twisted.internet.threads import blockingCallFromThread
+    from webtest.proxy import start_reactor
+    start_reactor()
+    return blockingCallFromThread(reactor, run_tests, tests, concurrency)
@@ -0,0 +1,390 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Backends de metricas alternativos a influxdb08.
+
+Se eligen con BACKEND en influx_conf (ver webtest.metrics.get_metrics_client);
+todos reciben los mismos puntos estilo 0.8 ({'name', 'columns', 'points'})
+desde el hilo de BufferedMetricsWriter, asi que nunca retrasan un test.
+
+    'influx_line'  line protocol por HTTP (/write), conexion keep-alive
+                   URL o HOST/PORT, DBNAME, USER, PASSWD, PRECISION, TAGS
+    'influx_udp'   line protocol por UDP, sin respuesta: HOST, PORT, TAGS
+    'statsd'       timers (elapsed), contadores y gauges: HOST, PORT, PREFIX
+    'prometheus'   histogramas en memoria servidos en http://INTERFACE:PORT/metrics
+                   (y en /metrics de `webtest checkserver`)
+
+La serializacion se hace sobre un bytearray que se reutiliza entre lotes.
+"""
+
+import BaseHTTPServer
+import httplib
+import logging
+import socket
+import threading
+import urllib
+import urlparse
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INFLUX_PORT = 8086
+DEFAULT_INFLUX_UDP_PORT = 8089
+DEFAULT_STATSD_PORT = 8125
+DEFAULT_PROMETHEUS_PORT = 9108
+DEFAULT_TIMEOUT = 10
+UDP_PAYLOAD = 1400          # bytes por datagrama, por debajo del MTU habitual
+PRECISIONS = {'s': 1, 'ms': 1000, 'u': 1000000, 'ns': 1000000000}
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _escape_measurement(value):
+    return _utf8(value).replace(',', '\\,').replace(' ', '\\ ')
+
+
+def _escape_key(value):
+    return _utf8(value).replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def _escape_string(value):
+    return '"{}"'.format(_utf8(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n'))
+
+
+def send_datagrams(sock, address, payload, max_size=UDP_PAYLOAD):
+    """Envia payload (lineas terminadas en \\n) en datagramas de como mucho max_size"""
+    view = memoryview(payload)
+    start, size = 0, len(payload)
+    while start < size:
+        end = start + max_size
+        if end < size:
+            cut = payload.rfind(b'\n', start, end)
+            if cut < start:
+                # Una sola linea mas larga que max_size: va entera
+                cut = payload.find(b'\n', end)
+                if cut < 0:
+                    cut = size - 1
+            end = cut + 1
+        sock.sendto(view[start:end], address)
+        start = end
+
+
+class LineProtocol(object):
+    """Puntos 0.8 -> line protocol de InfluxDB en un buffer reutilizable"""
+
+    def __init__(self, tags=None, precision='ms'):
+        self.buffer = bytearray()
+        self.multiplier = PRECISIONS[precision]
+        self._tags = "".join(",{}={}".format(_escape_key(key), _escape_key(value))
+            for key, value in sorted((tags or {}).items()))
+        self._measurements = {}
+        self._keys = {}
+
+    def _measurement(self, name):
+        measurement = self._measurements.get(name)
+        if measurement is None:
+            measurement = self._measurements[name] = _escape_measurement(name) + self._tags + " "
+        return measurement
+
+    def _key(self, column):
+        key = self._keys.get(column)
+        if key is None:
+            key = self._keys[column] = _escape_key(column) + "="
+        return key
+
+    def serialize(self, points):
+        """Devuelve el buffer con una linea por fila (valido hasta la siguiente llamada)"""
+        buf = self.buffer
+        del buf[:]
+        multiplier = self.multiplier
+        for point in points:
+            measurement = self._measurement(point['name'])
+            columns = point['columns']
+            keys = [self._key(column) for column in columns]
+            time_index = columns.index('time') if 'time' in columns else None
+            for row in point['points']:
+                fields = []
+                for index, value in enumerate(row):
+                    if index == time_index or value is None:
+                        continue
+                    if isinstance(value, bool):
+                        value = 'true' if value else 'false'
+                    elif isinstance(value, (int, long, float)):
+                        # Siempre float: influx no admite cambiar el tipo de un campo
+                        value = repr(float(value))
+                    else:
+                        value = _escape_string(value)
+                    fields.append(keys[index] + value)
+                if not fields:
+                    continue
+                buf += measurement
+                buf += ",".join(fields)
+                if time_index is not None and row[time_index] is not None:
+                    buf += " %d" % (row[time_index] * multiplier)
+                buf += "\n"
+        return buf
+
+
+class InfluxLineClient(object):
+    """Escritura por lotes en /write de InfluxDB 1.x (o compatibles)"""
+
+    def __init__(self, influx_conf):
+        self.protocol = LineProtocol(influx_conf.get("TAGS"), influx_conf.get("PRECISION", 'ms'))
+        url = influx_conf.get("URL") or "http://{}:{}".format(influx_conf["HOST"],
+            influx_conf.get("PORT") or DEFAULT_INFLUX_PORT)
+        parsed = urlparse.urlparse(url)
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        query = {'db': influx_conf["DBNAME"], 'precision': influx_conf.get("PRECISION", 'ms')}
+        if influx_conf.get("USER"):
+            query.update({'u': influx_conf["USER"], 'p': influx_conf.get("PASSWD", "")})
+        self.path = "{}/write?{}".format(parsed.path.rstrip("/"), urllib.urlencode(query))
+        self.timeout = influx_conf.get("TIMEOUT", DEFAULT_TIMEOUT)
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection_class = (httplib.HTTPSConnection if self.scheme == 'https'
+                else httplib.HTTPConnection)
+            self._connection = connection_class(self.netloc, timeout=self.timeout)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def write_points(self, points):
+        body = self.protocol.serialize(points)
+        if not body:
+            return
+        for retry in (False, True):
+            try:
+                connection = self._connect()
+                connection.request('POST', self.path, body,
+                    {'Content-Type': 'text/plain; charset=utf-8'})
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                # Conexion keep-alive cerrada por el servidor: un reintento
+                self.close()
+                if retry:
+                    raise
+        if response.status >= 300:
+            raise Exception("InfluxDB write failed: HTTP {} {}".format(response.status, data[:300]))
+
+
+class InfluxUdpClient(object):
+    """Line protocol por UDP: no espera respuesta ni falla si influx no esta"""
+
+    def __init__(self, influx_conf):
+        self.protocol = LineProtocol(influx_conf.get("TAGS"), influx_conf.get("PRECISION", 'ms'))
+        self.address = (influx_conf["HOST"], influx_conf.get("PORT") or DEFAULT_INFLUX_UDP_PORT)
+        self.max_size = influx_conf.get("UDP_PAYLOAD", UDP_PAYLOAD)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def write_points(self, points):
+        try:
+            send_datagrams(self.sock, self.address, self.protocol.serialize(points), self.max_size)
+        except socket.error as e:
+            log.warning("Error sending metrics to {}:{}: {}".format(self.address[0], self.address[1], e))
+
+
+def _statsd_name(name):
+    return _utf8(name).replace(':', '_').replace('|', '_').replace('@', '_').replace(' ', '_')
+
+
+class StatsdClient(object):
+    """
+    Series con elapsed -> timers (ms), series sin valores (executions) ->
+    contadores y el resto de columnas numericas -> gauges
+    """
+
+    def __init__(self, influx_conf):
+        self.address = (influx_conf.get("HOST", "127.0.0.1"),
+            influx_conf.get("PORT") or DEFAULT_STATSD_PORT)
+        self.prefix = influx_conf.get("PREFIX", "")
+        self.max_size = influx_conf.get("UDP_PAYLOAD", UDP_PAYLOAD)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.buffer = bytearray()
+        self._names = {}
+
+    def _name(self, name):
+        statsd_name = self._names.get(name)
+        if statsd_name is None:
+            statsd_name = self._names[name] = self.prefix + _statsd_name(name)
+        return statsd_name
+
+    def serialize(self, points):
+        buf = self.buffer
+        del buf[:]
+        for point in points:
+            name = self._name(point['name'])
+            columns = point['columns']
+            if 'elapsed' in columns:
+                index = columns.index('elapsed')
+                for row in point['points']:
+                    if row[index] is not None:
+                        buf += "%s:%.3f|ms\n" % (name, row[index] * 1000)
+                continue
+            numeric = [(index, _statsd_name(column)) for index, column in enumerate(columns)
+                if column != 'time' and point['points']
+                and isinstance(point['points'][0][index], (int, long, float))]
+            if not numeric:
+                buf += "%s:%d|c\n" % (name, len(point['points']))
+                continue
+            for row in point['points']:
+                for index, column in numeric:
+                    if row[index] is not None:
+                        buf += "%s.%s:%r|g\n" % (name, column, float(row[index]))
+        return buf
+
+    def write_points(self, points):
+        try:
+            send_datagrams(self.sock, self.address, self.serialize(points), self.max_size)
+        except socket.error as e:
+            log.warning("Error sending metrics to statsd {}:{}: {}".format(
+                self.address[0], self.address[1], e))
+
+
+def _label(value):
+    return _utf8(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusRegistry(object):
+    """Estado acumulado de las series para la exposicion de Prometheus"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._histograms = {}   # serie -> [cuentas por bucket, count, sum]
+        self._gauges = {}       # (serie, columna) -> ultimo valor
+        self._counters = {}     # serie -> eventos
+        self._lock = threading.Lock()
+
+    def _observe(self, series, value):
+        histogram = self._histograms.get(series)
+        if histogram is None:
+            histogram = self._histograms[series] = [[0] * len(self.buckets), 0, 0.0]
+        counts = histogram[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        histogram[1] += 1
+        histogram[2] += value
+
+    def update(self, points):
+        with self._lock:
+            for point in points:
+                series = point['name']
+                columns = point['columns']
+                if 'elapsed' in columns:
+                    index = columns.index('elapsed')
+                    for row in point['points']:
+                        if row[index] is not None:
+                            self._observe(series, row[index])
+                    continue
+                rows = point['points']
+                numeric = [(index, column) for index, column in enumerate(columns)
+                    if column != 'time' and rows and isinstance(rows[-1][index], (int, long, float))]
+                if not numeric:
+                    self._counters[series] = self._counters.get(series, 0) + len(rows)
+                for index, column in numeric:
+                    if rows[-1][index] is not None:
+                        self._gauges[(series, column)] = rows[-1][index]
+
+    def render(self):
+        """Texto de la exposicion (formato 0.0.4)"""
+        lines = []
+        with self._lock:
+            lines.append("# TYPE webtest_elapsed_seconds histogram")
+            for series, (counts, count, total) in sorted(self._histograms.items()):
+                label = _label(series)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('webtest_elapsed_seconds_bucket{series="%s",le="%r"} %d'
+                        % (label, float(bound), cumulative))
+                lines.append('webtest_elapsed_seconds_bucket{series="%s",le="+Inf"} %d' % (label, count))
+                lines.append('webtest_elapsed_seconds_count{series="%s"} %d' % (label, count))
+                lines.append('webtest_elapsed_seconds_sum{series="%s"} %r' % (label, total))
+            lines.append("# TYPE webtest_events_total counter")
+            for series, count in sorted(self._counters.items()):
+                lines.append('webtest_events_total{series="%s"} %d' % (_label(series), count))
+            lines.append("# TYPE webtest_value gauge")
+            for (series, column), value in sorted(self._gauges.items()):
+                lines.append('webtest_value{series="%s",column="%s"} %r'
+                    % (_label(series), _label(column), float(value)))
+        return "\n".join(lines) + "\n"
+
+
+_registry = None
+_registry_lock = threading.Lock()
+_servers = {}
+
+
+def get_prometheus_registry(buckets=DEFAULT_BUCKETS):
+    """Registro unico del proceso (lo comparten todos los PrometheusClient)"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PrometheusRegistry(buckets)
+        return _registry
+
+
+def render_prometheus():
+    """Exposicion del registro, o None si ningun test usa el backend prometheus"""
+    with _registry_lock:
+        registry = _registry
+    return registry.render() if registry is not None else None
+
+
+class PrometheusRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus() or ""
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+def start_exposition(port=DEFAULT_PROMETHEUS_PORT, interface=''):
+    """Sirve /metrics en un hilo (una vez por puerto)"""
+    with _registry_lock:
+        if port in _servers:
+            return _servers[port]
+        server = BaseHTTPServer.HTTPServer((interface, port), PrometheusRequestHandler)
+        thread = threading.Thread(target=server.serve_forever, name="webtest-prometheus")
+        thread.daemon = True
+        thread.start()
+        _servers[port] = server
+        log.info("Prometheus metrics on {}:{}/metrics".format(interface, server.server_address[1]))
+        return server
+
+
+class PrometheusClient(object):
+    """Acumula los puntos para que Prometheus los recoja"""
+
+    def __init__(self, influx_conf):
+        self.registry = get_prometheus_registry(influx_conf.get("BUCKETS", DEFAULT_BUCKETS))
+        if influx_conf.get("PORT"):
+            start_exposition(influx_conf["PORT"], influx_conf.get("INTERFACE", ""))
+
+    def write_points(self, points):
+        self.registry.update(points)
@@ -7,22 +7,36 @@ import inspect
 import logging
 import traceback
 import sys
-from webtest.metrics import get_metrics_client
-from selenium import webdriver
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
-from selenium.webdriver.common.proxy import Proxy, ProxyType
+from webtest.metrics import get_metrics_writer
+from webtest.histogram import get_histogram_aggregator
+from webtest.har import save_har, har_points
+from webtest.requestpolicy import RequestPolicy, DEFAULT_BLOCK_URLS
+from webtest.results import get_results_store, split_step_points, DEFAULT_RESULTS_PATH
+from webtest.lazy import LazyImport, resolve
+from webtest.adaptive import get_adaptive_timeouts
+from webtest.checkpoint import (CheckpointCache, checkpoint_key, snapshot, restore,
+    DEFAULT_CHECKPOINT_PATH, DEFAULT_CHECKPOINT_TTL)
+from webtest.waits import BrowserWait
+from webtest.timing import collect_timing, timing_points, NAVIGATION_COLUMNS, RESOURCE_COLUMNS
 import uuid
 from collections import defaultdict
-from webtest.screenshots import save_htmls_screenshots
+from webtest.screenshots import capture_artifact, get_artifact_pipeline, screenshot_extension
 import cgi
 
+# selenium se importa la primera vez que se usa
+webdriver = LazyImport('selenium.webdriver')
+WebDriverWait = LazyImport('selenium.webdriver.support.ui', 'WebDriverWait')
+EC = LazyImport('selenium.webdriver.support.expected_conditions')
+By = LazyImport('selenium.webdriver.common.by', 'By')
+Proxy = LazyImport('selenium.webdriver.common.proxy', 'Proxy')
+ProxyType = LazyImport('selenium.webdriver.common.proxy', 'ProxyType')
+
 log = logging.getLogger(__name__)
 
 DEFAULT_TIMEOUT = 5
 LIMIT_EXCEPTION_CHARS = 300
+STEP_COLUMNS = ["time", "elapsed", "test_uid"]
+ORIGIN_ONLY_SUFIX = "origin"
 
 
 def format_traceback(trace):
@@ -43,27 +57,49 @@ def format_exception(e, step_name, step_doc):
     return error
 
 
-def step(func=None, order=1):
-    """Decorador para step. para obtener tiempo"""
+def step(func=None, order=1, checkpoint=False):
+    """
+    Decorador para step. para obtener tiempo
+    checkpoint = guardar el estado del navegador al acabar bien el step y
+                 empezar por el siguiente en las proximas ejecuciones
+                 (webtest.checkpoint)
+    """
 
     if func is None:
-        return functools.partial(step, order=order)
+        return functools.partial(step, order=order, checkpoint=checkpoint)
 
     @functools.wraps(func)
     def f(*args, **kwargs):
         error = None
         step_name = func.__name__
         step_doc = func.__doc__
+        har_capture = getattr(args[0], '_har_capture', None) if args else None
+        if har_capture is not None:
+            har_capture.step(step_name)
         t1 = time.time()
         try:
             func(*args, **kwargs)
         except Exception as e:
             error = format_exception(e, step_name, step_doc)
         elapsed = time.time() - t1
+        # Fuera del tiempo del step: tiempos del navegador si se han pedido
+        if args and getattr(args[0], 'browser_timing', False):
+            args[0].collect_browser_timing(step_name)
         return elapsed, step_name, step_doc, error
     f.order = order
+    f.checkpoint = checkpoint
     return f
 
+def set_min_width(driver, min_width):
+    """Sets minimal width"""
+    if min_width:
+        size = driver.get_window_size()
+        width = size.get('width')
+        height = size.get('height')
+        if width < min_width:
+            driver.set_window_size(min_width, height)
+
+
 class AnyCondition(object):
     """ Clase para usar con WebDriverWait """
     def __init__(self, *args):
@@ -77,17 +113,76 @@ class AnyCondition(object):
                 pass
         return False
 
-class WebTest(object):
+class StepStats(object):
+    """Nombres de series y envio de puntos, comun a WebTest y AsyncWebTest"""
+    stats_name = 'webtest'
+    serie_sufix = None
+    influx_conf = None
+    results_path = None
+    aggregate = False
+
+    def _compose_serie_name(self, name, error, serie_sufix):
+        """ Wrapper para componer el nombre de las series """
+        serie_name = name
+        if error:
+            serie_name += ".errors"
+        if serie_sufix:
+            serie_name += ".{}".format(serie_sufix)
+        return serie_name
+
+    def _write_points(self, points):
+        """Envia los puntos de una ejecucion a influx y/o al almacen local"""
+        if self.results_path or not self.influx_conf:
+            # Sin influx los tiempos se guardan en local (webtest stats)
+            rows, _ = split_step_points(points)
+            try:
+                get_results_store(self.results_path or DEFAULT_RESULTS_PATH).append(rows)
+            except Exception as e:
+                log.error("Error saving results: {}".format(e))
+        if self.influx_conf:
+            if self.aggregate:
+                points = [point for point in points if point['columns'] != STEP_COLUMNS]
+            get_metrics_writer(self.influx_conf).write_points(points)
+
+    def record_summaries(self, step_times):
+        """[(step, elapsed)] correctos a los histogramas <serie>.summary"""
+        aggregator = get_histogram_aggregator(self.influx_conf)
+        for step_name, elapsed in step_times:
+            aggregator.record(self._compose_serie_name(
+                "{}.{}.summary".format(self.stats_name, step_name), False, self.serie_sufix), elapsed)
+
+
+class WebTest(StepStats):
     """Clase base para tests"""
     URL = ''
+    INTERVAL = 60          # segundos entre ejecuciones en `webtest serve`
+    MAX_CONCURRENCY = 1    # ejecuciones simultaneas del test en `webtest serve`
+    BROWSER_WAITS = True   # wait_for_* esperan dentro del navegador (webtest.waits)
+    # {'www.example.com': '10.0.0.12'}: sin proxy explicito, las peticiones
+    # pasan por un webtest.proxy local que envia esos hosts a esas IPs
+    HOST_OVERRIDES = None
+    PROXY_ARGS = {}        # argumentos de webtest.proxy.get_proxy
+    # Modo origin_only: URLs bloqueadas (204) y estaticos desde cache local
+    BLOCK_URLS = DEFAULT_BLOCK_URLS
+    CACHE_STATIC = True
+    # {} o {'FACTOR': 2, ...}: margen de cada step aprendido de sus
+    # duraciones anteriores (webtest.adaptive); None = siempre `timeout`
+    ADAPTIVE_TIMEOUTS = None
+    # command_executor del driver remoto puede ser una lista de hubs
+    GRID_ARGS = {}         # argumentos de webtest.grid.get_grid
+    # Estado guardado por los steps con checkpoint=True
+    CHECKPOINT_PATH = DEFAULT_CHECKPOINT_PATH
+    CHECKPOINT_TTL = DEFAULT_CHECKPOINT_TTL
 
     DRIVER_FIREFOX = 'firefox'
     DRIVER_PHANTOMJS = 'phantomjs'
     DRIVER_REMOTE = 'remote'
+    DRIVER_HTTP = 'http'    # sin navegador ni javascript (webtest.httpdriver)
     DRIVER_CHOICES = (
-        (DRIVER_FIREFOX, webdriver.Firefox),
-        (DRIVER_PHANTOMJS, webdriver.PhantomJS),
-        (DRIVER_REMOTE, webdriver.Remote),
+        (DRIVER_FIREFOX, LazyImport('selenium.webdriver', 'Firefox')),
+        (DRIVER_PHANTOMJS, LazyImport('selenium.webdriver', 'PhantomJS')),
+        (DRIVER_REMOTE, LazyImport('selenium.webdriver', 'Remote')),
+        (DRIVER_HTTP, LazyImport('webtest.httpdriver', 'HttpDriver')),
     )
     DRIVER_ARGS = {
         DRIVER_PHANTOMJS:  {
@@ -97,16 +192,125 @@ class WebTest(object):
         },
         DRIVER_REMOTE: {
             'command_executor': 'http://hub:4444/wd/hub',
-            'desired_capabilities': DesiredCapabilities.FIREFOX,
+            'desired_capabilities': LazyImport('selenium.webdriver', 'DesiredCapabilities.FIREFOX'),
             },
     }
 
     def __init__(self, driver=DRIVER_PHANTOMJS, url=None,
             timeout=DEFAULT_TIMEOUT, proxy=None, stats=False,
             stats_name='webtest', serie_sufix=None,
-            min_window_width=None, influx_conf=None, screenshots_conf=None):
-        # proxy = "url_sin_http:port"
-        kwargs = self.DRIVER_ARGS[driver]
+            min_window_width=None, influx_conf=None, screenshots_conf=None,
+            pool=None, browser_timing=False, aggregate=False,
+            results_path=None, har_conf=None, origin_only=False,
+            adaptive_conf=None, checkpoints=True):
+        # proxy = "url_sin_http:port" o un webtest.proxy.RewritingProxy
+        # pool = SessionPool del que tomar prestada una sesion ya arrancada
+        # browser_timing = recoger Navigation/Resource/Paint timing por step
+        # aggregate = enviar resumenes periodicos (histogramas) en lugar de
+        #             un punto por step y ejecucion
+        # results_path = directorio del almacen local de resultados; sin
+        #                influx_conf se usa siempre (DEFAULT_RESULTS_PATH)
+        # har_conf = capturar las peticiones de cada run con webtest.proxy
+        #            ({} o {'HAR_PATH': dir} para guardar los .har)
+        # origin_only = medir solo el origen: aplica BLOCK_URLS y CACHE_STATIC
+        #               en el proxy; las series llevan el sufijo "origin"
+        # adaptive_conf = timeouts adaptativos por step (ADAPTIVE_TIMEOUTS)
+        # checkpoints = False para hacer siempre todos los steps aunque
+        #               haya checkpoints guardados
+        if origin_only and proxy is not None:
+            # Sin nuestro proxy no hay bloqueo ni cache: son tiempos de pagina
+            # completa y no deben ir a las series "origin"
+            log.warn("origin_only ignored: an explicit proxy was given")
+            origin_only = False
+        if origin_only and serie_sufix is None:
+            serie_sufix = ORIGIN_ONLY_SUFIX
+        if proxy is None and (self.HOST_OVERRIDES or har_conf is not None or origin_only):
+            from webtest.proxy import get_proxy, reachable_host
+            proxy_args = dict(self.PROXY_ARGS)
+            if origin_only:
+                proxy_args['policy'] = RequestPolicy(self.BLOCK_URLS, self.CACHE_STATIC)
+            if driver == self.DRIVER_REMOTE and 'interface' not in proxy_args:
+                # El navegador esta en otra maquina: no llega a 127.0.0.1
+                executor = self.DRIVER_ARGS.get(driver, {}).get('command_executor')
+                if isinstance(executor, (list, tuple)):
+                    executor = executor[0]
+                proxy_args['interface'] = '0.0.0.0'
+                proxy_args.setdefault('public_host', reachable_host(executor))
+            proxy = get_proxy(self.HOST_OVERRIDES or {}, **proxy_args)
+        self.proxy_server = None
+        self._har_port = None
+        if hasattr(proxy, 'address'):
+            self.proxy_server = proxy
+            if har_conf is not None:
+                # Puerto propio: la captura solo ve las peticiones de este test
+                self._har_port = proxy.lease_port()
+                proxy = proxy.address_for(self._har_port)
+            else:
+                proxy = proxy.address
+        self.pool = pool
+        self.driver = None
+        self._browser_waiter = None
+        self.timeout = timeout
+        self.step_timeout = timeout
+        self.url = url or self.URL
+        self.stats = stats
+        self.stats_name = stats_name
+        self.serie_sufix = serie_sufix
+        self.influx_conf = influx_conf
+        self.screenshots_conf = screenshots_conf
+        self.browser_timing = browser_timing
+        self.aggregate = aggregate
+        self.results_path = results_path
+        self.har_conf = har_conf
+        self._har_capture = None
+        if adaptive_conf is None:
+            adaptive_conf = self.ADAPTIVE_TIMEOUTS
+        self.adaptive = None
+        if adaptive_conf is not None:
+            self.adaptive = get_adaptive_timeouts(type(self), stats_name, adaptive_conf)
+        self.checkpoints = checkpoints
+        self._checkpoint_cache = None
+        self.restored_checkpoint = None     # step recuperado en este run
+        self.step_timings = {}
+        self._last_navigation = None
+
+        try:
+            if pool is not None:
+                self.driver = pool.acquire(driver, proxy=proxy,
+                    min_window_width=min_window_width)
+            else:
+                self.driver = self.create_driver(driver, proxy=proxy,
+                    min_window_width=min_window_width)
+            self.driver.implicitly_wait(timeout)
+            self.wait = WebDriverWait(self.driver, timeout)
+        except Exception:
+            exc_info = sys.exc_info()
+            self._abort_init()
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _abort_init(self):
+        """El test no ha llegado a arrancar: no dejamos la sesion prestada"""
+        try:
+            if self.driver is not None:
+                if self.pool is not None:
+                    self.pool.release(self.driver, broken=True)
+                else:
+                    self.driver.quit()
+        except Exception as e:
+            log.warn("Error discarding driver: {}".format(e))
+        self._release_har_port()
+
+    def _release_har_port(self):
+        if self._har_port is not None:
+            self.proxy_server.release_port(self._har_port)
+            self._har_port = None
+
+    @classmethod
+    def create_driver(cls, driver=DRIVER_PHANTOMJS, proxy=None,
+            min_window_width=None):
+        """Arranca una nueva sesion de webdriver"""
+        kwargs = dict((key, resolve(value))
+            for key, value in cls.DRIVER_ARGS.get(driver, {}).items())
         if proxy:
             selenium_proxy = Proxy(
                 {'proxyType': ProxyType.MANUAL,
@@ -115,125 +319,214 @@ class WebTest(object):
                 })
             kwargs["proxy"] = selenium_proxy
         try:
-            self.driver = dict(self.DRIVER_CHOICES)[driver](**kwargs)
+            executor = kwargs.get('command_executor')
+            if driver == cls.DRIVER_REMOTE and isinstance(executor, (list, tuple)):
+                from webtest.grid import get_grid
+                web_driver = get_grid(executor, **cls.GRID_ARGS).create(**kwargs)
+            else:
+                web_driver = dict(cls.DRIVER_CHOICES)[driver](**kwargs)
         except KeyError:
-            self.driver = webdriver.PhantomJS()
-
-        self._set_min_width(min_window_width)
-        self.timeout = timeout
-        self.driver.implicitly_wait(timeout)
-        self.wait = WebDriverWait(self.driver, timeout)
-        self.url = url or self.URL
-        self.stats = stats
-        self.stats_name = stats_name
-        self.serie_sufix = serie_sufix
-        self.influx_conf = influx_conf
-        self.screenshots_conf = screenshots_conf
+            web_driver = webdriver.PhantomJS()
+        set_min_width(web_driver, min_window_width)
+        return web_driver
 
     def _set_min_width(self, min_width):
         """Sets minimal width"""
-        if min_width:
-            size = self.driver.get_window_size()
-            width = size.get('width')
-            height = size.get('height')
-            if width < min_width:
-                self.driver.set_window_size(min_width, height)
+        set_min_width(self.driver, min_width)
 
     def close(self):
-        self.driver.quit()
+        """Devuelve o cierra el driver; se puede llamar mas de una vez"""
+        driver, self.driver = self.driver, None
+        if driver is not None:
+            if self.pool is not None:
+                self.pool.release(driver)
+            else:
+                driver.quit()
+        self._release_har_port()
+
+    def _browser_wait(self):
+        if self._browser_waiter is None or self._browser_waiter.driver is not self.driver:
+            # Los drivers sin navegador traen su propia espera (WAITER)
+            waiter = getattr(self.driver, 'WAITER', BrowserWait)
+            self._browser_waiter = waiter(self.driver)
+        return self._browser_waiter
+
+    def _wait_polling(self, locators, timeout, visible=False, root=None):
+        """Espera clasica con WebDriverWait, un comando por sondeo"""
+        expected = EC.visibility_of_element_located if visible else EC.presence_of_element_located
+        conditions = [expected(tuple(locator)) for locator in locators]
+
+        def any_condition(driver):
+            for index, cond in enumerate(conditions):
+                try:
+                    found = cond(driver)
+                except Exception:
+                    continue
+                if found:
+                    return index, found
+            return False
+
+        self.driver.implicitly_wait(0.5)
+        try:
+            return WebDriverWait(root or self.driver, timeout).until(any_condition)
+        finally:
+            self.driver.implicitly_wait(self.step_timeout) # Restauramos implicitly_wait
+
+    def wait_for_any(self, *locators, **kwargs):
+        """
+        Waits for the first of several (By.*, value) locators, like AnyCondition.
+        kwargs: timeout, visible, root (web element to search in).
+        Returns (locator index, element)
+        """
+        timeout = kwargs.get('timeout') or self.step_timeout
+        visible = kwargs.get('visible', False)
+        root = kwargs.get('root')
+        if self.BROWSER_WAITS or getattr(self.driver, 'STATIC_DOM', False):
+            return self._browser_wait().until_any(locators, timeout,
+                visible=visible, root=root)
+        return self._wait_polling(locators, timeout, visible=visible, root=root)
 
     def wait_for_id(self, name, timeout=None, visible=False):
         """calls selenium webdriver wait for ID name"""
-        self.driver.implicitly_wait(0.5)
-        if not timeout:
-            timeout = self.timeout
-        if visible:
-            found_element = WebDriverWait(self.driver, timeout).until(
-                EC.visibility_of_element_located((By.ID, name)))
-        else:
-            found_element = WebDriverWait(self.driver, timeout).until(
-                EC.presence_of_element_located((By.ID, name)))
-        self.driver.implicitly_wait(self.timeout) # Restauramos implicitly_wait
+        _, found_element = self.wait_for_any((By.ID, name),
+            timeout=timeout, visible=visible)
         return found_element
 
     def wait_for_class(self, name):
         """calls selenium webdriver wait for class name"""
-        self.driver.implicitly_wait(0.5)
-        self.wait.until(EC.presence_of_element_located((By.CLASS_NAME, name)))
-        self.driver.implicitly_wait(self.timeout) # Restauramos implicitly_wait
+        self.wait_for_any((By.CLASS_NAME, name))
 
 
     def wait_for_xpath(self, name, timeout=None, visible=False):
         """calls selenium webdriver wait for xpath"""
-        self.driver.implicitly_wait(0.5)
-        if not timeout:
-            timeout = self.timeout
-        if visible:
-            found_element = WebDriverWait(self.driver, timeout).until(
-                EC.visibility_of_element_located((By.XPATH, name)))
-        else:
-            found_element = WebDriverWait(self.driver, timeout).until(
-                EC.presence_of_element_located((By.XPATH, name)))
-        self.driver.implicitly_wait(self.timeout) # Restauramos implicitly_wait
+        _, found_element = self.wait_for_any((By.XPATH, name),
+            timeout=timeout, visible=visible)
         return found_element
 
     def wait_for_css_selector(self, name, timeout=None, visible=False):
         """calls selenium webdriver wait for css"""
-        self.driver.implicitly_wait(0.5)
-        if not timeout:
-            timeout = self.timeout
-        if visible:
-            found_element = WebDriverWait(self.driver, timeout).until(
-                EC.visibility_of_element_located((By.CSS_SELECTOR, name)))
-        else:
-            found_element = WebDriverWait(self.driver, timeout).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, name)))
-        self.driver.implicitly_wait(self.timeout) # Restauramos implicitly_wait
+        _, found_element = self.wait_for_any((By.CSS_SELECTOR, name),
+            timeout=timeout, visible=visible)
         return found_element
 
     def wait_for_css_selector_in_element(self, web_element, name):
         """calls selenium webdriver wait for css, search in web_element"""
-        self.driver.implicitly_wait(0.5)
-        found_element = WebDriverWait(web_element, self.timeout).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, name)))
-        self.driver.implicitly_wait(self.timeout) # Restauramos implicitly_wait
+        _, found_element = self.wait_for_any((By.CSS_SELECTOR, name),
+            root=web_element)
         return found_element
 
     def wait_until(self, condition, timeout=None):
         self.driver.implicitly_wait(0.1)
         if not timeout:
-            timeout = self.timeout
+            timeout = self.step_timeout
         found_element =  WebDriverWait(self.driver, timeout).until(condition)
-        self.driver.implicitly_wait(self.timeout) # Restauramos implicitly_wait
+        self.driver.implicitly_wait(self.step_timeout) # Restauramos implicitly_wait
         return found_element
 
+    def collect_browser_timing(self, step_name):
+        """Guarda en step_timings los tiempos del navegador del step"""
+        try:
+            timing = collect_timing(self.driver, self._last_navigation)
+        except Exception as e:
+            log.debug("Could not collect browser timing for {}: {}".format(step_name, e))
+            return
+        if timing:
+            self._last_navigation = timing['navigation_id'] or self._last_navigation
+            self.step_timings[step_name] = timing
+
     def _get_steps(self):
         steps = inspect.getmembers(self, predicate=inspect.ismethod)
         steps = [s for _, s in steps if hasattr(s, "order")]
         steps.sort(key=lambda f: f.order)
         return steps
 
-    def __iter__(self):
-        for step in self._get_steps():
-            yield step()
-
-    def _compose_serie_name(self, name, error, serie_sufix):
-        """ Wrapper para componer el nombre de las series """
-        serie_name = name
-        if error:
-            serie_name += ".errors"
-        if serie_sufix:
-            serie_name += ".{}".format(serie_sufix)
-        return serie_name
+    def _set_step_timeout(self, timeout):
+        """Margen de las esperas (y de implicitly_wait) del step actual"""
+        if timeout != self.step_timeout:
+            self.step_timeout = timeout
+            self.driver.implicitly_wait(timeout)
+
+    def _restore_checkpoint(self, steps):
+        """Steps pendientes tras recuperar el ultimo checkpoint guardado"""
+        self._checkpoint_cache = None
+        self.restored_checkpoint = None
+        if not self.checkpoints or not any(getattr(s, 'checkpoint', False) for s in steps):
+            return steps
+        self._checkpoint_cache = CheckpointCache(self.CHECKPOINT_PATH, self.CHECKPOINT_TTL)
+        key = checkpoint_key(type(self), self.url)
+        saved = self._checkpoint_cache.load(key)
+        if saved is None:
+            return steps
+        step_name, state = saved
+        names = [s.__name__ for s in steps]
+        # El ultimo step no es checkpoint: despues no quedaria nada que medir
+        if step_name not in names[:-1]:
+            self._checkpoint_cache.invalidate(key)
+            return steps
+        try:
+            restore(self.driver, state)
+        except Exception as e:
+            log.warn("Could not restore checkpoint {} of {}: {}".format(step_name, self.url, e))
+            self._checkpoint_cache.invalidate(key)
+            self.driver.delete_all_cookies()
+            return steps
+        log.debug("Restored checkpoint {} of {}".format(step_name, self.url))
+        self.restored_checkpoint = step_name
+        return steps[names.index(step_name) + 1:]
+
+    def _is_last_step(self, step):
+        steps = self._get_steps()
+        return bool(steps) and steps[-1].__name__ == step.__name__
+
+    def _after_step(self, step, result):
+        """Guarda el checkpoint del step o lo borra si algo ha fallado"""
+        cache = self._checkpoint_cache
+        if cache is None:
+            return
+        key = checkpoint_key(type(self), self.url)
+        if result[3]:
+            cache.invalidate(key)
+        elif getattr(step, 'checkpoint', False) and not self._is_last_step(step):
+            try:
+                cache.save(key, result[1], snapshot(self.driver))
+            except Exception as e:
+                log.warn("Could not save checkpoint {}: {}".format(result[1], e))
 
-    def run(self):
+    def __iter__(self):
+        adaptive = self.adaptive
+        try:
+            for step in self._restore_checkpoint(self._get_steps()):
+                if adaptive is not None:
+                    self._set_step_timeout(adaptive.timeout(step.__name__, self.timeout))
+                elapsed, name, doc, error = result = step()
+                if adaptive is not None and not error:
+                    adaptive.record(name, elapsed)
+                self._after_step(step, result)
+                yield result
+        finally:
+            if adaptive is not None:
+                adaptive.save()
+
+    def run(self, quiet=False):
+        """
+        Ejecuta los steps hasta el primer error, envia los tiempos y cierra
+        el driver. Devuelve [(elapsed, name, doc, error), ...]
+        quiet = no imprimir el progreso (webtest.batch)
+        """
         ok_stats = defaultdict(list)
         err_stats = defaultdict(list)
+        ok_times = []
+        results = []
 
         test_uid = str(uuid.uuid1())
         init_test_time = time.time()
+        self.step_timings = {}
+        if self.har_conf is not None and self.proxy_server is not None:
+            self._har_capture = self.proxy_server.recorder.begin(test_uid, self.stats_name,
+                self._har_port)
 
         for elapsed, name, doc, error in self:
+            results.append((elapsed, name, doc, error))
             if error:
 
 # <style>
@@ -260,11 +553,15 @@ class WebTest(object):
     </table>
 </div>
 """
-                print u"ERROR {name} in {elapsed:10.2f}s ({doc}) --> [[{error}]]".format(**locals())
+                if not quiet:
+                    print u"ERROR {name} in {elapsed:10.2f}s ({doc}) --> [[{error}]]".format(**locals())
                 error = cgi.escape(error)
                 error = error.replace("\n", "<br>")
-                img_src = "{}/{}/errors/{}/{}_{}.png".format(
-                    self.screenshots_conf["SCREENSHOTS_URL_PREFIX"], self.stats_name, name, name, test_uid)
+                img_src = ""
+                if self.screenshots_conf:
+                    img_src = "{}/{}/errors/{}/{}_{}.{}".format(
+                        self.screenshots_conf["SCREENSHOTS_URL_PREFIX"], self.stats_name, name, name, test_uid,
+                        screenshot_extension(self.screenshots_conf))
                 
                 serie_name = self._compose_serie_name("{}.{}".format(self.stats_name, name), error, self.serie_sufix)
 
@@ -278,7 +575,8 @@ class WebTest(object):
                     test_uid])
                 break
             else:
-                print u"Run {name} in {elapsed:10.2f}s ({doc})".format(**locals())
+                if not quiet:
+                    print u"Run {name} in {elapsed:10.2f}s ({doc})".format(**locals())
 
                 serie_name = self._compose_serie_name("{}.{}".format(self.stats_name, name), error, self.serie_sufix)
 
@@ -286,24 +584,42 @@ class WebTest(object):
                 # if self.serie_sufix:
                 #     serie_name += ("." + self.serie_sufix)
                 ok_stats[serie_name].append([time.time(), elapsed, test_uid])
+                ok_times.append((name, elapsed))
 
         elapsed_test_time = time.time() - init_test_time
-        print u"Total in {}".format(elapsed_test_time)
+        if not quiet:
+            print u"Total in {}".format(elapsed_test_time)
+
+        har_capture, self._har_capture = self._har_capture, None
+        if har_capture is not None:
+            self.proxy_server.recorder.end(har_capture)
+            try:
+                save_har(har_capture, self.har_conf, self.stats_name)
+            except Exception as e:
+                log.error("Error saving HAR: {}".format(e))
 
         if self.stats:
+            # Los runs que empiezan en un checkpoint no hacen todos los
+            # steps: su total va aparte para no mezclarlo con los completos
+            total_name = 'total.checkpoint' if self.restored_checkpoint else 'total'
             serie_name  = self._compose_serie_name('{}.executions'.format(self.stats_name), False, self.serie_sufix)
             points = [{
                 'points': [[time.time(), test_uid]],
                 'name': serie_name,
                 'columns': ['time', "test_uid"]
             }]
-            if not err_stats:
+            if self.aggregate and self.influx_conf:
+                # Los tiempos correctos van a histogramas: <serie>.summary
+                if not err_stats and results:
+                    ok_times.append((total_name, elapsed_test_time))
+                self.record_summaries(ok_times)
+            if not err_stats and results:
                 # Tiempo Total
-                serie_name  = self._compose_serie_name('{}.total'.format(self.stats_name), False, self.serie_sufix)
+                serie_name  = self._compose_serie_name('{}.{}'.format(self.stats_name, total_name), False, self.serie_sufix)
                 points.append({
                     'points': [[time.time(), elapsed_test_time, test_uid]],
                     'name': serie_name,
-                    'columns': ['time', "elapsed", "test_uid"]
+                    'columns': STEP_COLUMNS
                 })
                 
             for key, value in err_stats.iteritems():
@@ -316,27 +632,49 @@ class WebTest(object):
                 points.append({
                         'points': value,
                         'name': key,
-                        'columns': ['time', 'elapsed', "test_uid"]
+                        'columns': STEP_COLUMNS
+                    })
+            for step_name, timing in self.step_timings.iteritems():
+                navigation_rows, resource_rows = timing_points(timing, time.time(), test_uid)
+                if navigation_rows:
+                    points.append({
+                        'points': navigation_rows,
+                        'name': self._compose_serie_name("{}.{}.timing".format(self.stats_name, step_name),
+                            False, self.serie_sufix),
+                        'columns': ['time'] + NAVIGATION_COLUMNS + ["test_uid"]
                     })
-            
+                if resource_rows:
+                    points.append({
+                        'points': resource_rows,
+                        'name': self._compose_serie_name("{}.{}.resources".format(self.stats_name, step_name),
+                            False, self.serie_sufix),
+                        'columns': ['time'] + RESOURCE_COLUMNS + ["test_uid"]
+                    })
+            if har_capture is not None:
+                points.extend(har_points(har_capture, time.time(),
+                    lambda step_name, group: self._compose_serie_name(
+                        "{}.{}.{}".format(self.stats_name, step_name, group), False, self.serie_sufix)))
 
-            client = get_metrics_client(self.influx_conf)
-            client.write_points(points)
+            self._write_points(points)
 
             try:
-                if self.screenshots_conf:
+                if self.screenshots_conf and results:
+                    # Solo leemos del navegador; recorte, guardado y subida
+                    # se hacen en segundo plano
                     if not err_stats:
-                        save_htmls_screenshots("{}/oks".format(self.stats_name), self.driver,
+                        artifact = capture_artifact("{}/oks".format(self.stats_name), self.driver,
                             "{}_{}".format(name, test_uid), self.screenshots_conf)
                     else:
-                        save_htmls_screenshots("{}/errors/{}".format(self.stats_name, name),
+                        artifact = capture_artifact("{}/errors/{}".format(self.stats_name, name),
                             self.driver, "{}_{}".format(name, test_uid), self.screenshots_conf)
+                    get_artifact_pipeline(self.screenshots_conf).submit(artifact)
             except:
                 exc_info = sys.exc_info()
                 trace = "".join(traceback.format_exception(*exc_info))
                 log.error(trace)
 
         self.close()
+        return results
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Ejecucion de muchos tests a la vez desde la linea de comandos.
+
+    webtest --jobs 8 --summary smoke.json 'smoke_*' checkout:GuestCheckout
+
+Los nombres son modulos de testdir, globs sobre ellos o modulo:Clase. Los
+tests se reparten entre `jobs` procesos (o hilos con --threads); cada
+resultado se escribe en cuanto acaba como una linea json:
+
+    {"test": "smoke_home:HomeTest", "ok": true, "elapsed": 3.1,
+     "steps": [{"name": "home", "doc": "Home", "elapsed": 1.2, "error": null}, ...]}
+
+y al final, con --summary, un json con los totales y todos los resultados.
+"""
+
+import fnmatch
+import json
+import logging
+import multiprocessing
+import multiprocessing.pool
+import sys
+import time
+import traceback
+
+from webtest.loader import get_registry, DEFAULT_TESTDIR
+
+log = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 4
+
+
+def expand_tests(patterns, testdir=DEFAULT_TESTDIR):
+    """[(modulo, clase)] para nombres, globs o modulo:Clase, sin repetir"""
+    registry = get_registry(testdir)
+    found = []
+    available = None
+    for pattern in patterns:
+        module_pattern, _, class_name = pattern.partition(":")
+        if not any(c in pattern for c in "*?["):
+            Test = registry.get(module_pattern, class_name or None)
+            matches = [(module_pattern, Test.__name__)] if Test else []
+        else:
+            if available is None:
+                available = registry.scan()
+            matches = [(module_name, Test.__name__) for module_name, Test in available
+                if fnmatch.fnmatch(module_name, module_pattern)
+                and (not class_name or fnmatch.fnmatch(Test.__name__, class_name))]
+        if not matches:
+            log.warn("No test matches {} in {}".format(pattern, testdir))
+        for match in matches:
+            if match not in found:
+                found.append(match)
+    return found
+
+
+def run_test(spec):
+    """Ejecuta un test (en el proceso o hilo del pool); devuelve su resultado"""
+    module_name, class_name, testdir, test_kwargs = spec
+    result = {'test': "{}:{}".format(module_name, class_name), 'ok': False,
+        'elapsed': None, 'steps': [], 'error': None}
+    t1 = time.time()
+    try:
+        Test = get_registry(testdir).get(module_name, class_name)
+        if Test is None:
+            raise Exception("Test {} not found in {}".format(result['test'], testdir))
+        steps = Test(**test_kwargs).run(quiet=True)
+        result['steps'] = [{'name': name, 'doc': doc, 'elapsed': elapsed, 'error': error}
+            for elapsed, name, doc, error in steps]
+        result['ok'] = not any(step['error'] for step in result['steps'])
+    except Exception as e:
+        # Fallos fuera de los steps: arranque del driver, import del test...
+        log.debug(traceback.format_exc())
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    result['elapsed'] = time.time() - t1
+    return result
+
+
+def run_tests(tests, testdir=DEFAULT_TESTDIR, jobs=DEFAULT_JOBS, threads=False,
+        test_kwargs=None, callback=None):
+    """
+    Ejecuta [(modulo, clase)] con `jobs` procesos o hilos; callback(result)
+    se llama en cuanto acaba cada uno. Devuelve los resultados en el orden de tests
+    """
+    specs = [(module_name, class_name, testdir, test_kwargs or {})
+        for module_name, class_name in tests]
+    jobs = max(1, min(jobs, len(specs)))
+    pool_class = multiprocessing.pool.ThreadPool if threads else multiprocessing.Pool
+    pool = pool_class(jobs)
+    results = {}
+    try:
+        for result in pool.imap_unordered(run_test, specs):
+            results[result['test']] = result
+            if callback is not None:
+                callback(result)
+    except BaseException:
+        # Ctrl-C o un fallo en el callback: no esperamos al resto de tests
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+    return [results["{}:{}".format(*test)] for test in tests if "{}:{}".format(*test) in results]
+
+
+def summarize(results, elapsed):
+    """Totales y tiempos por test y por step"""
+    return {
+        'elapsed': elapsed,
+        'tests': len(results),
+        'passed': len([r for r in results if r['ok']]),
+        'failed': [r['test'] for r in results if not r['ok']],
+        'results': results,
+    }
+
+
+def write_json_line(result, stream=None):
+    stream = stream or sys.stdout
+    stream.write(json.dumps(result) + "\n")
+    stream.flush()
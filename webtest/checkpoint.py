@@ -0,0 +1,145 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoints: guardar y recuperar el estado del navegador tras un step.
+
+Un step marcado con checkpoint (normalmente el login o el aviso de
+cookies) guarda al terminar bien las cookies, localStorage, sessionStorage
+y la url actual en PATH/<clave>.json, con la clave sacada del test y su
+url. Las siguientes ejecuciones, mientras no pase el TTL, recuperan ese
+estado y empiezan en el step siguiente al checkpoint:
+
+    class Account(WebTest):
+        @step(order=1, checkpoint=True)
+        def login(self):
+            ...
+
+Si falla un step posterior, el checkpoint se borra y la siguiente
+ejecucion vuelve a hacer todos los steps. El ultimo step nunca se guarda
+como checkpoint: la ejecucion siguiente no mediria nada. El tiempo total de los runs que
+empiezan en un checkpoint va a <stats_name>.total.checkpoint en lugar de
+<stats_name>.total. Los ficheros contienen cookies
+de sesion: se crean con permisos 0600.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import urlparse
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_PATH = "~/.webtest/checkpoints"
+DEFAULT_CHECKPOINT_TTL = 3600
+# Pagina ligera del mismo origen en la que fijar cookies y storage
+RESTORE_PATH = "/favicon.ico"
+COOKIE_KEYS = ('name', 'value', 'path', 'domain', 'secure', 'httpOnly', 'expiry')
+
+SNAPSHOT_STORAGE_SCRIPT = """
+function dump(storage) {
+    var data = {};
+    for (var i = 0; i < storage.length; i++) {
+        data[storage.key(i)] = storage.getItem(storage.key(i));
+    }
+    return data;
+}
+var result = {url: window.location.href, local: {}, session: {}};
+try { result.local = dump(window.localStorage); } catch (e) {}
+try { result.session = dump(window.sessionStorage); } catch (e) {}
+return result;
+"""
+
+RESTORE_STORAGE_SCRIPT = """
+var local = arguments[0], session = arguments[1];
+for (var key in local) { window.localStorage.setItem(key, local[key]); }
+for (var key in session) { window.sessionStorage.setItem(key, session[key]); }
+"""
+
+
+def checkpoint_key(test_class, url):
+    """Clave del checkpoint: clase del test y url"""
+    name = "{}.{}|{}".format(test_class.__module__, test_class.__name__, url)
+    return hashlib.sha1(name).hexdigest()
+
+
+def snapshot(driver):
+    """Estado del navegador: cookies, storage y url actual"""
+    try:
+        state = driver.execute_script(SNAPSHOT_STORAGE_SCRIPT) or {}
+    except Exception as e:
+        # Drivers sin javascript (webtest.httpdriver): solo cookies y url
+        log.debug("Could not read storage: {}".format(e))
+        state = {}
+    return {
+        'url': state.get('url') or driver.current_url,
+        'cookies': [dict((key, cookie[key]) for key in COOKIE_KEYS if key in cookie)
+            for cookie in driver.get_cookies()],
+        'local': state.get('local') or {},
+        'session': state.get('session') or {},
+    }
+
+
+def restore(driver, state):
+    """Deja el navegador como estaba al guardar state y en su url"""
+    parsed = urlparse.urlparse(state['url'])
+    host = parsed.hostname or ''
+    driver.get("{}://{}{}".format(parsed.scheme, parsed.netloc, RESTORE_PATH))
+    driver.delete_all_cookies()
+    for cookie in state['cookies']:
+        domain = (cookie.get('domain') or host).lstrip('.')
+        if host != domain and not host.endswith('.' + domain):
+            # El navegador solo acepta cookies del dominio cargado
+            log.debug("Skipping cookie {} for {}".format(cookie['name'], domain))
+            continue
+        cookie = dict(cookie)
+        if 'expiry' in cookie:
+            cookie['expiry'] = int(cookie['expiry'])
+        driver.add_cookie(cookie)
+    if state['local'] or state['session']:
+        driver.execute_script(RESTORE_STORAGE_SCRIPT, state['local'], state['session'])
+    driver.get(state['url'])
+
+
+class CheckpointCache(object):
+    """Checkpoints en disco, un json por clave"""
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH, ttl=DEFAULT_CHECKPOINT_TTL):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+
+    def _file(self, key):
+        return os.path.join(self.path, "{}.json".format(key))
+
+    def load(self, key):
+        """(step, estado) guardado hace menos de ttl, o None"""
+        try:
+            with open(self._file(key)) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if time.time() - data.get('saved', 0) > self.ttl:
+            self.invalidate(key)
+            return None
+        return data['step'], data['state']
+
+    def save(self, key, step_name, state):
+        data = json.dumps({'saved': time.time(), 'step': step_name, 'state': state})
+        tmp_path = "{}.{}.tmp".format(self._file(key), os.getpid())
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, 0o700)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(data)
+            os.rename(tmp_path, self._file(key))
+        except (IOError, OSError) as e:
+            log.warning("Could not save checkpoint {}: {}".format(self._file(key), e))
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
@@ -0,0 +1,199 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Servidor residente de checks de nagios.
+
+`webtest checkserver` mantiene cargados los tests y las sesiones del
+navegador (SessionPool) y ejecuta los checks bajo demanda:
+
+    GET /check/<test_name>[?max_age=segundos]
+    -> {"code": 0, "output": "OK : Test Ok en ... | ...", "age": 3.2, "cached": true}
+    GET /status
+    GET /metrics   (tests con BACKEND 'prometheus' en influx_conf)
+
+Las peticiones simultaneas del mismo test comparten una unica ejecucion y
+el resultado se sirve desde cache durante TTL segundos. `check_web --server
+host:puerto test` es el cliente: imprime la misma linea y sale con el mismo
+codigo que check_web en local.
+"""
+
+import BaseHTTPServer
+import json
+import logging
+import SocketServer
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8090
+DEFAULT_TTL = 60
+DEFAULT_CLIENT_TIMEOUT = 120
+EVICT_INTERVAL = 30
+
+
+class _Inflight(object):
+    """Ejecucion en curso a la que se suman las peticiones que llegan"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class CheckService(object):
+    """Ejecuta checks con coalescencia de peticiones y cache con TTL"""
+
+    def __init__(self, testdir, ttl=DEFAULT_TTL, pool=None):
+        self.testdir = testdir
+        self.ttl = ttl
+        self.pool = pool
+        self.runs = 0
+        self._results = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _run(self, test_name):
+        # Importado aqui para que el cliente no cargue click ni los tests
+        from webtest.nrpe import check_result, nagios_output, NAGIOSCODES
+        try:
+            code, response, times = check_result(test_name, testdir=self.testdir,
+                pool=self.pool)
+        except Exception as e:
+            log.exception("Error running {}".format(test_name))
+            code, response, times = 'UNKNOWN', "Error running {}: {}".format(test_name, e), None
+        return NAGIOSCODES[code], nagios_output(code, response, times)
+
+    def check(self, test_name, max_age=None):
+        """(codigo de salida, linea de salida, edad del resultado en s, de cache)"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            cached = self._results.get(test_name)
+            if cached is not None and time.time() - cached[0] <= max_age:
+                return cached[1], cached[2], time.time() - cached[0], True
+            inflight = self._inflight.get(test_name)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[test_name] = _Inflight()
+
+        if not owner:
+            inflight.done.wait()
+            finished, code, output = inflight.result
+            return code, output, time.time() - finished, True
+
+        try:
+            self.runs += 1
+            code, output = self._run(test_name)
+            inflight.result = (time.time(), code, output)
+            with self._lock:
+                self._results[test_name] = inflight.result
+        finally:
+            with self._lock:
+                del self._inflight[test_name]
+            if inflight.result is None:
+                inflight.result = (time.time(), 3, "UNKNOWN : check aborted")
+            inflight.done.set()
+        return code, output, 0.0, False
+
+    def status(self):
+        with self._lock:
+            now = time.time()
+            results = dict((name, {'code': code, 'age': now - finished})
+                for name, (finished, code, _) in self._results.items())
+            running = sorted(self._inflight)
+        status = {'results': results, 'running': running, 'runs': self.runs}
+        if self.pool is not None:
+            status['pool'] = self.pool.stats()
+        from webtest.grid import grid_stats
+        hubs = grid_stats()
+        if hubs:
+            status['grid'] = hubs
+        return status
+
+
+class CheckRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def _send_json(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(parsed.query)
+        service = self.server.service
+        if parsed.path.startswith('/check/'):
+            test_name = urllib.unquote(parsed.path[len('/check/'):])
+            try:
+                max_age = float(query['max_age'][0]) if 'max_age' in query else None
+            except ValueError:
+                self._send_json(400, {'error': 'max_age must be a number'})
+                return
+            code, output, age, cached = service.check(test_name, max_age=max_age)
+            self._send_json(200, {'code': code, 'output': output, 'age': age, 'cached': cached})
+        elif parsed.path == '/status':
+            self._send_json(200, service.status())
+        elif parsed.path == '/metrics':
+            from webtest.backends import render_prometheus, PROMETHEUS_CONTENT_TYPE
+            body = render_prometheus()
+            if body is None:
+                self._send_json(404, {'error': 'no prometheus metrics backend configured'})
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class CheckServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, service):
+        BaseHTTPServer.HTTPServer.__init__(self, address, CheckRequestHandler)
+        self.service = service
+
+
+def serve(testdir, port=DEFAULT_PORT, interface='127.0.0.1', ttl=DEFAULT_TTL, pool=None):
+    """Servidor en primer plano (webtest checkserver)"""
+    server = CheckServer((interface, port), CheckService(testdir, ttl=ttl, pool=pool))
+    stop = threading.Event()
+    if pool is not None:
+        def evict():
+            while not stop.wait(EVICT_INTERVAL):
+                pool.evict_idle()
+        evictor = threading.Thread(target=evict, name="webtest-evict")
+        evictor.daemon = True
+        evictor.start()
+    log.info("Check server listening on {}:{}".format(*server.server_address))
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        server.server_close()
+
+
+def request_check(server, test_name, max_age=None, timeout=DEFAULT_CLIENT_TIMEOUT):
+    """Cliente: (codigo de salida, linea de salida) con el formato de check_web"""
+    url = "http://{}/check/{}".format(server, urllib.quote(test_name))
+    if max_age is not None:
+        url += "?" + urllib.urlencode({'max_age': max_age})
+    try:
+        data = json.load(urllib2.urlopen(url, timeout=timeout))
+        return data['code'], data['output']
+    except Exception as e:
+        from webtest.nrpe import nagios_output, NAGIOSCODES
+        return NAGIOSCODES['UNKNOWN'], nagios_output('UNKNOWN',
+            "Check server {} unavailable: {}".format(server, e))
@@ -0,0 +1,226 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Almacen direccionado por contenido para screenshots y htmls.
+
+Cada contenido distinto se guarda una unica vez en
+SCREEN_LOG_PATH/.objects/<ab>/<clave>.<ext>; los ficheros de cada test son
+hard links a ese objeto. Cuando se sube a S3 se apunta junto al objeto
+(<clave>.<ext>.s3) la key en la que quedo, para que los duplicados se copien
+en el propio S3 en lugar de volver a subirlos.
+
+put, link y release se hacen con un flock sobre .objects/.lock: varios
+procesos pueden compartir SCREEN_LOG_PATH sin borrar un objeto que otro
+acaba de enlazar.
+
+Si el sistema de ficheros no admite hard links no se deduplica: cada
+fichero se guarda normal (y lo gestiona el indice de retencion) y no se
+dejan en .objects objetos que ningun release llegaria a borrar.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+OBJECTS_DIR = ".objects"
+LOCK_NAME = ".lock"
+REMOTE_SUFFIX = ".s3"
+
+_whitespace = re.compile(r"\s+")
+
+
+def bytes_key(data):
+    """Clave exacta: sha1 del contenido"""
+    return hashlib.sha1(data).hexdigest()
+
+
+def html_key(html):
+    """Clave de un html ignorando diferencias de espacios en blanco"""
+    return hashlib.sha1(_whitespace.sub(" ", html).strip()).hexdigest()
+
+
+def image_key(img, hash_size=16):
+    """
+    Clave perceptual (dHash) de una imagen PIL: capturas casi identicas
+    (antialiasing, un cursor parpadeando...) comparten clave.
+    """
+    small = img.convert("L").resize((hash_size + 1, hash_size))
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    # Incluimos el tamaño para no mezclar capturas de distinta resolucion
+    return "{:0{}x}_{}x{}".format(bits, hash_size * hash_size / 4, img.width, img.height)
+
+
+class ContentStore(object):
+    """Objetos de SCREEN_LOG_PATH/.objects enlazados desde cada test"""
+
+    def __init__(self, root):
+        self.root = os.path.join(os.path.abspath(root), OBJECTS_DIR)
+        self._lock = threading.Lock()
+        self._inodes = None     # inode -> objeto, para limpiar huerfanos
+        self._hardlinks = True  # False tras el primer os.link fallido
+
+    @contextmanager
+    def _locked(self):
+        """Exclusion entre hilos y entre procesos"""
+        with self._lock:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root)
+            with open(os.path.join(self.root, LOCK_NAME), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def object_path(self, key, ext):
+        return os.path.join(self.root, key[:2], "{}.{}".format(key, ext))
+
+    def _load_inodes(self):
+        self._inodes = {}
+        if not os.path.exists(self.root):
+            return
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(REMOTE_SUFFIX) or filename == LOCK_NAME:
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    self._inodes[os.stat(path).st_ino] = path
+                except OSError:
+                    pass
+
+    def _put(self, key, ext, data):
+        path = self.object_path(key, ext)
+        if os.path.exists(path):
+            return path, False
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+        if self._inodes is not None:
+            self._inodes[os.stat(path).st_ino] = path
+        return path, True
+
+    def _link(self, key, ext, dest):
+        path = self.object_path(key, ext)
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(path, dest)
+            return
+        except OSError as e:
+            log.warn("Hard links not supported in {}, not deduplicating: {}".format(
+                self.root, e))
+            self._hardlinks = False
+        shutil.copyfile(path, dest)
+        # Una copia no cuenta como enlace: el objeto no se liberaria nunca
+        if os.stat(path).st_nlink == 1:
+            self._remove_object(path)
+
+    def _remove_object(self, path):
+        try:
+            st = os.stat(path)
+            os.remove(path)
+        except OSError:
+            return
+        if self._inodes is not None:
+            self._inodes.pop(st.st_ino, None)
+
+    def put(self, key, ext, data):
+        """Guarda el contenido si no existia; devuelve (ruta, es_nuevo)"""
+        with self._locked():
+            return self._put(key, ext, data)
+
+    def link(self, key, ext, dest):
+        """
+        Enlaza el objeto en dest; si el sistema no soporta hard links lo
+        copia y borra el objeto si nadie mas lo enlaza
+        """
+        with self._locked():
+            self._link(key, ext, dest)
+
+    def save(self, key, ext, data, dest):
+        """put + link sin que otro proceso borre el objeto entre medias"""
+        with self._locked():
+            if not self._hardlinks:
+                with open(dest, "wb") as f:
+                    f.write(data)
+                return dest, True
+            result = self._put(key, ext, data)
+            self._link(key, ext, dest)
+            if not self._hardlinks:
+                return dest, True
+            return result
+
+    def release(self, path):
+        """
+        Llamar antes de borrar un fichero enlazado: si era el ultimo enlace al
+        objeto, borra tambien el objeto.
+        """
+        with self._locked():
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            if st.st_nlink != 2:
+                return
+            if self._inodes is None or st.st_ino not in self._inodes:
+                # Objetos guardados por otros procesos
+                self._load_inodes()
+            obj = self._inodes.pop(st.st_ino, None)
+            if obj and obj != os.path.abspath(path):
+                try:
+                    os.remove(obj)
+                except OSError:
+                    pass
+
+    def remote_key(self, key, ext):
+        """Key de S3 donde ya se subio este contenido, o None"""
+        try:
+            with open(self.object_path(key, ext) + REMOTE_SUFFIX) as f:
+                return f.read().strip() or None
+        except IOError:
+            return None
+
+    def set_remote_key(self, key, ext, remote_key):
+        path = self.object_path(key, ext) + REMOTE_SUFFIX
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(path, "w") as f:
+            f.write(remote_key)
+
+    def forget_remote(self, key, ext):
+        try:
+            os.remove(self.object_path(key, ext) + REMOTE_SUFFIX)
+        except OSError:
+            pass
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_content_store(screenshots_conf):
+    root = os.path.abspath(screenshots_conf["SCREEN_LOG_PATH"])
+    with _stores_lock:
+        store = _stores.get(root)
+        if store is None:
+            store = _stores[root] = ContentStore(root)
+        return store
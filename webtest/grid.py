@@ -0,0 +1,254 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Reparto de sesiones remotas entre varios hubs o nodos de Selenium.
+
+Si command_executor del driver remoto es una lista, cada sesion nueva se
+abre en el hub sano con mas slots libres y, a igualdad, con menor tiempo
+medio (EWMA) de arranque de sesion. El estado de cada hub se consulta con
+/status (y /grid/api/hub en hubs de Selenium 3) como mucho cada
+PROBE_INTERVAL segundos; los hubs que no responden o fallan al abrir una
+sesion salen del reparto hasta la siguiente consulta correcta.
+
+    class MyTest(WebTest):
+        DRIVER_ARGS = dict(WebTest.DRIVER_ARGS, remote=dict(
+            WebTest.DRIVER_ARGS['remote'],
+            command_executor=['http://hub1:4444/wd/hub', 'http://hub2:4444/wd/hub']))
+        GRID_ARGS = {'influx_conf': INFLUX_CONF}
+
+Con influx_conf se envian, por hub, las series
+webtest.grid.<hub>.sessions (time, elapsed, error) y
+webtest.grid.<hub>.slots (time, free, total, healthy).
+"""
+
+import json
+import logging
+import threading
+import time
+import urllib2
+import urlparse
+
+from webtest.lazy import LazyImport
+
+webdriver = LazyImport('selenium.webdriver')
+
+log = logging.getLogger(__name__)
+
+PROBE_INTERVAL = 30
+PROBE_TIMEOUT = 3
+EWMA_ALPHA = 0.3
+SERIES_PREFIX = "webtest.grid"
+
+
+class NoHubAvailable(Exception):
+    """Ningun hub ha podido abrir la sesion"""
+
+
+def hub_name(url):
+    """host_puerto del hub, usable en nombres de series"""
+    netloc = urlparse.urlparse(url).netloc
+    return netloc.replace(".", "_").replace(":", "_")
+
+
+def parse_status(status, hub_api=None):
+    """
+    (ready, free, total) a partir de /status y, si lo hay, /grid/api/hub.
+    free y total son None cuando el hub no los publica.
+    """
+    value = status.get('value') or {}
+    ready = bool(value.get('ready', status.get('status') == 0))
+    free = total = None
+    if hub_api and 'slotCounts' in hub_api:
+        # Hub de Selenium 3
+        free = hub_api['slotCounts'].get('free')
+        total = hub_api['slotCounts'].get('total')
+    elif 'nodes' in value:
+        # Grid de Selenium 4
+        slots = [slot for node in value['nodes']
+            if node.get('availability', 'UP') == 'UP'
+            for slot in node.get('slots', [])]
+        total = len(slots)
+        free = len([slot for slot in slots if slot.get('session') is None])
+    return ready, free, total
+
+
+class Hub(object):
+    """Estado conocido de un hub"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.name = hub_name(url)
+        self.healthy = True
+        self.free = None
+        self.total = None
+        self.placed = 0             # sesiones abiertas desde la ultima consulta
+        self.start_ewma = None
+        self.sessions = 0
+        self.failures = 0
+        self.last_probe = 0
+
+    @property
+    def available(self):
+        """Slots libres estimados; None si el hub no los publica"""
+        if self.free is None:
+            return None
+        return self.free - self.placed
+
+    def record_start(self, elapsed):
+        self.sessions += 1
+        self.placed += 1
+        if self.start_ewma is None:
+            self.start_ewma = elapsed
+        else:
+            self.start_ewma += EWMA_ALPHA * (elapsed - self.start_ewma)
+
+    def stats(self):
+        return {'url': self.url, 'healthy': self.healthy, 'free': self.available,
+            'total': self.total, 'start_ewma': self.start_ewma,
+            'sessions': self.sessions, 'failures': self.failures}
+
+
+def _get_json(url, timeout):
+    return json.load(urllib2.urlopen(url, timeout=timeout))
+
+
+def probe_hub(url, timeout=PROBE_TIMEOUT):
+    """(ready, free, total) del hub; lanza excepcion si no responde"""
+    status = _get_json(url + "/status", timeout)
+    hub_api = None
+    if 'nodes' not in (status.get('value') or {}):
+        parsed = urlparse.urlparse(url)
+        try:
+            hub_api = _get_json("{}://{}/grid/api/hub".format(parsed.scheme, parsed.netloc),
+                timeout)
+        except Exception:
+            # Nodo suelto o hub sin api: solo sabemos si esta listo
+            pass
+    return parse_status(status, hub_api)
+
+
+class HubGrid(object):
+    """Conjunto de hubs entre los que se reparten las sesiones nuevas"""
+
+    def __init__(self, urls, probe_interval=PROBE_INTERVAL,
+            probe_timeout=PROBE_TIMEOUT, influx_conf=None):
+        self.hubs = [Hub(url) for url in urls]
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.influx_conf = influx_conf
+        self._lock = threading.Lock()
+
+    def _write(self, points):
+        if not self.influx_conf:
+            return
+        from webtest.metrics import get_metrics_writer
+        try:
+            get_metrics_writer(self.influx_conf).write_points(points)
+        except Exception as e:
+            log.warning("Could not send grid metrics: {}".format(e))
+
+    def _probe(self, hub):
+        try:
+            ready, free, total = probe_hub(hub.url, self.probe_timeout)
+        except Exception as e:
+            log.warning("Hub {} failed health probe: {}".format(hub.url, e))
+            ready, free, total = False, None, None
+        with self._lock:
+            hub.healthy = ready
+            hub.free, hub.total = free, total
+            hub.placed = 0
+            hub.last_probe = time.time()
+        self._write([{
+            'name': "{}.{}.slots".format(SERIES_PREFIX, hub.name),
+            'columns': ['time', 'free', 'total', 'healthy'],
+            'points': [[time.time(), free, total, int(ready)]],
+        }])
+
+    def refresh(self, force=False):
+        """Consulta en paralelo los hubs cuyo estado ha caducado"""
+        now = time.time()
+        stale = [hub for hub in self.hubs
+            if force or now - hub.last_probe >= self.probe_interval]
+        threads = [threading.Thread(target=self._probe, args=(hub,),
+            name="webtest-grid-probe") for hub in stale]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(self.probe_timeout * 2 + 1)
+
+    def candidates(self):
+        """Hubs sanos en orden de preferencia"""
+        self.refresh()
+        with self._lock:
+            healthy = [hub for hub in self.hubs if hub.healthy]
+
+        def preference(hub):
+            available = hub.available
+            # Con slots conocidos primero los que tienen sitio; los que no
+            # publican slots van detras de estos y delante de los llenos
+            room = 1 if available is None else (2 if available > 0 else 0)
+            return (-room, -(available or 0),
+                hub.start_ewma if hub.start_ewma is not None else 0)
+        return sorted(healthy, key=preference)
+
+    def create(self, **kwargs):
+        """Abre un webdriver.Remote en el mejor hub; kwargs como webdriver.Remote"""
+        kwargs.pop('command_executor', None)
+        errors = []
+        for hub in self.candidates():
+            t1 = time.time()
+            try:
+                driver = webdriver.Remote(command_executor=hub.url, **kwargs)
+            except Exception as e:
+                elapsed = time.time() - t1
+                log.warning("Hub {} could not start a session: {}".format(hub.url, e))
+                with self._lock:
+                    hub.failures += 1
+                    hub.healthy = False
+                errors.append("{}: {}".format(hub.url, e))
+                self._write([{
+                    'name': "{}.{}.sessions".format(SERIES_PREFIX, hub.name),
+                    'columns': ['time', 'elapsed', 'error'],
+                    'points': [[time.time(), elapsed, str(e)[:300]]],
+                }])
+                continue
+            elapsed = time.time() - t1
+            with self._lock:
+                hub.record_start(elapsed)
+            log.debug("Session placed on {} in {:.2f}s".format(hub.url, elapsed))
+            self._write([{
+                'name': "{}.{}.sessions".format(SERIES_PREFIX, hub.name),
+                'columns': ['time', 'elapsed', 'error'],
+                'points': [[time.time(), elapsed, None]],
+            }])
+            return driver
+        raise NoHubAvailable("No hub could start a session: {}".format(
+            "; ".join(errors) or "all hubs are unhealthy"))
+
+    def stats(self):
+        with self._lock:
+            return [hub.stats() for hub in self.hubs]
+
+
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+def get_grid(urls, **kwargs):
+    """HubGrid compartido por los tests del proceso para esa lista de hubs y opciones"""
+    # repr: influx_conf es un dict y no se puede usar como clave
+    key = (tuple(urls), repr(sorted(kwargs.items())))
+    with _grids_lock:
+        grid = _grids.get(key)
+        if grid is None:
+            grid = _grids[key] = HubGrid(urls, **kwargs)
+        return grid
+
+
+def grid_stats():
+    """Estado de los hubs de todos los grids del proceso"""
+    with _grids_lock:
+        grids = list(_grids.values())
+    return [stats for grid in grids for stats in grid.stats()]
@@ -0,0 +1,222 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Captura HAR de lo que pasa por webtest.proxy.
+
+Con `WebTest(har_conf={...})` el test se ejecuta a traves del proxy y cada
+run abre una captura (identificada por su test_uid) con una pagina por
+step. El proxy apunta cada peticion con sus tiempos (dns, connect, wait,
+receive), estado y tamaños. Al terminar se guarda el HAR y se generan
+metricas agregadas por host y por content type para cada step.
+
+Varios tests pueden compartir el mismo proxy a la vez: cada uno entra por
+un puerto propio (RewritingProxy.lease_port) y su captura solo apunta las
+peticiones que llegan por ese puerto.
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+HAR_VERSION = "1.2"
+HOST_COLUMNS = ['time', 'host', 'requests', 'bytes', 'total', 'max_wait', 'errors', 'test_uid']
+CONTENT_TYPE_COLUMNS = ['time', 'content_type', 'requests', 'bytes', 'total', 'max_wait', 'errors', 'test_uid']
+
+
+def iso_time(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).isoformat() + "Z"
+
+
+def har_headers(headers):
+    """[(nombre, [valores])] -> lista HAR"""
+    return [{'name': name, 'value': value} for name, values in headers for value in values]
+
+
+def headers_size(first_line, headers):
+    return len(first_line) + 2 + sum(len(name) + len(value) + 4
+        for name, values in headers for value in values) + 2
+
+
+class HarCapture(object):
+    """Peticiones de un run de un test, agrupadas por step"""
+
+    def __init__(self, test_uid, title=None, port=None):
+        self.test_uid = test_uid
+        self.title = title or test_uid
+        self.port = port            # None = todas las peticiones del proxy
+        self.started = time.time()
+        self.pages = []
+        self.entries = []
+        self.page = None
+
+    def step(self, name):
+        self.page = {
+            'id': "{}_{}".format(len(self.pages), name),
+            'title': name,
+            'startedDateTime': iso_time(time.time()),
+            'pageTimings': {},
+        }
+        self.pages.append(self.page)
+        return self.page['id']
+
+    def har(self):
+        return {'log': {
+            'version': HAR_VERSION,
+            'creator': {'name': 'webtest', 'version': HAR_VERSION},
+            'pages': self.pages,
+            'entries': sorted(self.entries, key=lambda e: e['startedDateTime']),
+            'comment': self.title,
+        }}
+
+    def breakdown(self):
+        """
+        Agregados por step: {step: {'hosts': {host: stats}, 'content_types': {ct: stats}}}
+        stats = {'requests', 'bytes', 'total' (ms), 'max_wait' (ms), 'errors'}
+        """
+        titles = dict((page['id'], page['title']) for page in self.pages)
+        result = defaultdict(lambda: {'hosts': defaultdict(_stats), 'content_types': defaultdict(_stats)})
+        for entry in self.entries:
+            step = titles.get(entry.get('pageref'), '_')
+            host = entry['_host']
+            content_type = (entry['response']['content']['mimeType'] or 'unknown').split(';')[0].strip()
+            for stats in (result[step]['hosts'][host], result[step]['content_types'][content_type]):
+                stats['requests'] += 1
+                stats['bytes'] += max(0, entry['response']['bodySize'])
+                stats['total'] += entry['time']
+                stats['max_wait'] = max(stats['max_wait'], entry['timings']['wait'])
+                if entry['response']['status'] == 0 or entry['response']['status'] >= 400:
+                    stats['errors'] += 1
+        return result
+
+
+def _stats():
+    return {'requests': 0, 'bytes': 0, 'total': 0, 'max_wait': 0, 'errors': 0}
+
+
+class HarRecorder(object):
+    """Capturas activas en un proxy; el proxy llama a pages() y add()"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._captures = set()
+
+    @property
+    def active(self):
+        return bool(self._captures)
+
+    def begin(self, test_uid, title=None, port=None):
+        capture = HarCapture(test_uid, title, port)
+        with self._lock:
+            self._captures.add(capture)
+        return capture
+
+    def end(self, capture):
+        with self._lock:
+            self._captures.discard(capture)
+        return capture
+
+    def pages(self, port=None):
+        """
+        (captura, pagina actual) en el momento de empezar una peticion que
+        ha llegado por `port`
+        """
+        with self._lock:
+            return [(capture, capture.page['id'] if capture.page else None)
+                for capture in self._captures
+                if capture.port is None or capture.port == port]
+
+    def add(self, pages, entry):
+        for capture, pageref in pages:
+            capture_entry = dict(entry)
+            if pageref:
+                capture_entry['pageref'] = pageref
+            with self._lock:
+                capture.entries.append(capture_entry)
+
+
+def make_entry(started, method, url, http_version, request_headers, request_body_size,
+        status, status_text, response_headers, response_body_size, timings, host,
+        error=None):
+    """Entrada HAR; timings en ms con -1 para lo que no aplica"""
+    content_type = ''
+    for name, values in response_headers:
+        if name.lower() == 'content-type':
+            content_type = values[0]
+    location = ''
+    for name, values in response_headers:
+        if name.lower() == 'location':
+            location = values[0]
+    total = sum(value for value in timings.values() if value > 0)
+    entry = {
+        'startedDateTime': iso_time(started),
+        'time': total,
+        'request': {
+            'method': method,
+            'url': url,
+            'httpVersion': http_version,
+            'headers': har_headers(request_headers),
+            'queryString': [],
+            'cookies': [],
+            'headersSize': headers_size("{} {} {}".format(method, url, http_version), request_headers),
+            'bodySize': request_body_size,
+        },
+        'response': {
+            'status': status,
+            'statusText': status_text,
+            'httpVersion': http_version,
+            'headers': har_headers(response_headers),
+            'cookies': [],
+            'content': {'size': max(0, response_body_size), 'mimeType': content_type},
+            'redirectURL': location,
+            'headersSize': headers_size("{} {} {}".format(http_version, status, status_text),
+                response_headers) if status else -1,
+            'bodySize': response_body_size,
+        },
+        'cache': {},
+        'timings': {
+            'blocked': -1,
+            'dns': timings.get('dns', -1),
+            'connect': timings.get('connect', -1),
+            'send': timings.get('send', 0),
+            'wait': timings.get('wait', 0),
+            'receive': timings.get('receive', 0),
+            'ssl': -1,
+        },
+        '_host': host,
+    }
+    if error:
+        entry['_error'] = error
+    return entry
+
+
+def save_har(capture, har_conf, stats_name):
+    """Guarda el HAR en HAR_PATH/<stats_name>/<test_uid>.har si se ha configurado"""
+    har_path = har_conf.get("HAR_PATH")
+    if not har_path:
+        return None
+    folder = os.path.join(har_path, stats_name)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    file_name = os.path.join(folder, "{}.har".format(capture.test_uid))
+    with open(file_name, "w") as f:
+        json.dump(capture.har(), f)
+    return file_name
+
+
+def har_points(capture, now, serie_name):
+    """
+    Puntos 0.8 por step: <serie>.hosts y <serie>.content_types.
+    serie_name(step, suffix) compone el nombre de la serie.
+    """
+    points = []
+    for step, groups in capture.breakdown().iteritems():
+        for group, columns in (('hosts', HOST_COLUMNS), ('content_types', CONTENT_TYPE_COLUMNS)):
+            rows = [[now, key] + [stats[c] for c in columns[2:-1]] + [capture.test_uid]
+                for key, stats in sorted(groups[group].items())]
+            if rows:
+                points.append({'points': rows, 'name': serie_name(step, group), 'columns': columns})
+    return points
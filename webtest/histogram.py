@@ -0,0 +1,179 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Histogramas de latencia agregables.
+
+En lugar de mandar a influx un punto por step y ejecucion, se acumulan las
+latencias de cada serie en un histograma log-lineal (al estilo HDR: error
+relativo acotado, memoria constante, se pueden sumar entre si) y cada
+intervalo se envia solo un resumen: count, p50, p90, p99 y max.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+# Importado aqui para que el atexit de los agregadores (registrado despues)
+# vuelque antes de que se cierren los writers de metrics
+from webtest.metrics import get_metrics_writer
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIGNIFICANT_BITS = 7      # error relativo < 1%
+DEFAULT_UNIT = 1e-6               # se guardan microsegundos
+DEFAULT_AGGREGATE_INTERVAL = 60
+SUMMARY_PERCENTILES = (50, 90, 99)
+SUMMARY_COLUMNS = ['time', 'count', 'p50', 'p90', 'p99', 'max']
+
+
+class Histogram(object):
+    """Histograma log-lineal de valores positivos (segundos)"""
+
+    def __init__(self, significant_bits=DEFAULT_SIGNIFICANT_BITS, unit=DEFAULT_UNIT):
+        self.significant_bits = significant_bits
+        self.unit = unit
+        self._sub = 1 << significant_bits
+        self._half = self._sub >> 1
+        self.counts = {}
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, units):
+        if units < self._sub:
+            return units
+        shift = units.bit_length() - self.significant_bits
+        return self._sub + (shift - 1) * self._half + ((units >> shift) - self._half)
+
+    def _bounds(self, index):
+        """(limite inferior, ancho) del bucket en unidades"""
+        if index < self._sub:
+            return index, 1
+        k = index - self._sub
+        shift = k // self._half + 1
+        return (k % self._half + self._half) << shift, 1 << shift
+
+    def record(self, value, count=1):
+        units = max(0, int(value / self.unit))
+        index = self._index(units)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Suma otro histograma con la misma precision"""
+        if (other.significant_bits, other.unit) != (self.significant_bits, self.unit):
+            raise ValueError("Cannot merge histograms with different precision")
+        for index, count in other.counts.iteritems():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        target = max(1, int(round(pct / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                lower, width = self._bounds(index)
+                value = (lower + width / 2.0) * self.unit
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """{'count', 'p50', 'p90', 'p99', 'max'}"""
+        summary = {'count': self.count, 'max': self.max}
+        for pct in SUMMARY_PERCENTILES:
+            summary['p{}'.format(pct)] = self.percentile(pct)
+        return summary
+
+
+class HistogramAggregator(object):
+    """
+    Histogramas por serie que se vuelcan como resumen cada `interval`
+    segundos a `writer` (algo con write_points, ver metrics.get_metrics_writer).
+    """
+
+    def __init__(self, writer, interval=DEFAULT_AGGREGATE_INTERVAL):
+        self.writer = writer
+        self.interval = interval
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="webtest-aggregator")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, series, value):
+        with self._lock:
+            histogram = self._histograms.get(series)
+            if histogram is None:
+                histogram = self._histograms[series] = Histogram()
+            histogram.record(value)
+
+    def points(self):
+        """Resumenes del intervalo como puntos; vacia los histogramas"""
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+        now = time.time()
+        points = []
+        for series, histogram in sorted(histograms.items()):
+            summary = histogram.summary()
+            points.append({
+                'points': [[now] + [summary[c] for c in SUMMARY_COLUMNS[1:]]],
+                'name': series,
+                'columns': SUMMARY_COLUMNS,
+            })
+        return points
+
+    def flush(self):
+        points = self.points()
+        if points:
+            self.writer.write_points(points)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Error flushing histograms")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+
+_aggregators = {}
+_aggregators_lock = threading.Lock()
+
+
+def get_histogram_aggregator(influx_conf):
+    """Agregador compartido por configuracion de influx (AGGREGATE_INTERVAL)"""
+    key = repr(sorted(influx_conf.items()))
+    with _aggregators_lock:
+        aggregator = _aggregators.get(key)
+        if aggregator is None:
+            aggregator = _aggregators[key] = HistogramAggregator(
+                get_metrics_writer(influx_conf),
+                interval=influx_conf.get("AGGREGATE_INTERVAL", DEFAULT_AGGREGATE_INTERVAL))
+        return aggregator
+
+
+@atexit.register
+def close_histogram_aggregators():
+    with _aggregators_lock:
+        aggregators = list(_aggregators.values())
+        _aggregators.clear()
+    for aggregator in aggregators:
+        aggregator.close()
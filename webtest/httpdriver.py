@@ -0,0 +1,325 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Driver solo HTTP para checks que no necesitan javascript.
+
+Implementa la parte del API de webdriver que usan los helpers de WebTest
+(get, find_element*, page_source, title, current_url, cookies, waits)
+sobre requests, con un pool de conexiones compartido por todos los
+drivers del proceso, y lxml/cssselect para el html:
+
+    class HomeCheck(WebTest):
+        URL = 'http://www.example.com/'
+
+    HomeCheck(driver=WebTest.DRIVER_HTTP).run()
+
+El DOM es estatico: las esperas miran una sola vez y fallan en el acto si
+no encuentran el elemento. execute_script y los screenshots no estan
+disponibles.
+"""
+
+import logging
+import threading
+import urlparse
+
+from webtest.lazy import LazyImport
+
+requests = LazyImport('requests')
+HTTPAdapter = LazyImport('requests.adapters', 'HTTPAdapter')
+lxml_html = LazyImport('lxml.html')
+CSSSelector = LazyImport('lxml.cssselect', 'CSSSelector')
+exceptions = LazyImport('selenium.common.exceptions')
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+POOL_CONNECTIONS = 20       # hosts distintos con conexiones guardadas
+POOL_MAXSIZE = 20           # conexiones guardadas por host
+USER_AGENT = "Mozilla/5.0 (compatible; webtest-http)"
+EMPTY_DOCUMENT = "<html><head></head><body></body></html>"
+
+_adapter = None
+_adapter_lock = threading.Lock()
+_selectors = {}
+
+
+def get_http_adapter():
+    """Adapter (pool de conexiones keep-alive) compartido por los HttpDriver"""
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                pool_maxsize=POOL_MAXSIZE)
+        return _adapter
+
+
+def css_selector(value):
+    selector = _selectors.get(value)
+    if selector is None:
+        selector = _selectors[value] = CSSSelector(value)
+    return selector
+
+
+def find_all(root, by, value):
+    """Elementos lxml bajo root para un locator de webdriver (By.*)"""
+    if by == 'id':
+        return root.xpath('descendant-or-self::*[@id=$v]', v=value)
+    if by == 'css selector':
+        return css_selector(value)(root)
+    if by == 'xpath':
+        return [e for e in root.xpath(value) if hasattr(e, 'tag')]
+    if by == 'class name':
+        return css_selector("." + value)(root)
+    if by == 'name':
+        return root.xpath('descendant-or-self::*[@name=$v]', v=value)
+    if by == 'tag name':
+        return list(root.iter(value))
+    if by == 'link text':
+        return root.xpath('descendant-or-self::a[normalize-space(.)=$v]', v=value)
+    if by == 'partial link text':
+        return root.xpath('descendant-or-self::a[contains(., $v)]', v=value)
+    raise exceptions.InvalidSelectorException("Unsupported locator: {}".format(by))
+
+
+def is_hidden(element):
+    """Oculto por el propio html (hidden, type=hidden o display:none en linea)"""
+    while element is not None:
+        style = (element.get('style') or '').replace(' ', '').lower()
+        if (element.get('hidden') is not None or element.get('type') == 'hidden'
+                or 'display:none' in style or 'visibility:hidden' in style):
+            return True
+        element = element.getparent()
+    return False
+
+
+class _Finder(object):
+    """
+    find_element* comunes al driver y a los elementos: buscan bajo
+    _search_root (nodo lxml) y devuelven elementos de _owner (HttpDriver).
+    Cada subclase fija ambos en su __init__
+    """
+
+    def find_elements(self, by='id', value=None):
+        return [HttpElement(self._owner, e) for e in find_all(self._search_root, by, value)]
+
+    def find_element(self, by='id', value=None):
+        found = find_all(self._search_root, by, value)
+        if not found:
+            raise exceptions.NoSuchElementException(
+                "Unable to locate element: {}={}".format(by, value))
+        return HttpElement(self._owner, found[0])
+
+    def find_element_by_id(self, value):
+        return self.find_element('id', value)
+
+    def find_element_by_name(self, value):
+        return self.find_element('name', value)
+
+    def find_element_by_class_name(self, value):
+        return self.find_element('class name', value)
+
+    def find_element_by_css_selector(self, value):
+        return self.find_element('css selector', value)
+
+    def find_element_by_xpath(self, value):
+        return self.find_element('xpath', value)
+
+    def find_element_by_tag_name(self, value):
+        return self.find_element('tag name', value)
+
+    def find_element_by_link_text(self, value):
+        return self.find_element('link text', value)
+
+    def find_elements_by_css_selector(self, value):
+        return self.find_elements('css selector', value)
+
+    def find_elements_by_xpath(self, value):
+        return self.find_elements('xpath', value)
+
+
+class HttpElement(_Finder):
+
+    def __init__(self, driver, element):
+        self.parent = self._owner = driver
+        self.element = self._search_root = element
+
+    @property
+    def tag_name(self):
+        return self.element.tag
+
+    @property
+    def text(self):
+        return " ".join(self.element.text_content().split())
+
+    def get_attribute(self, name):
+        if name == 'value' and self.element.tag == 'textarea':
+            return self.element.text
+        return self.element.get(name)
+
+    def is_displayed(self):
+        return not is_hidden(self.element)
+
+    def send_keys(self, *values):
+        current = self.element.get('value') or ''
+        self.element.set('value', current + "".join(values))
+
+    def clear(self):
+        self.element.set('value', '')
+
+    def _form(self):
+        for ancestor in self.element.iterancestors('form'):
+            return ancestor
+        return None
+
+    def click(self):
+        """Sigue enlaces y envia formularios; el resto no hace nada"""
+        href = self.element.get('href')
+        if self.element.tag == 'a' and href:
+            self.parent.get(urlparse.urljoin(self.parent.current_url, href))
+        elif (self.element.tag in ('button', 'input')
+                and self.element.get('type', 'submit' if self.element.tag == 'button' else '') == 'submit'):
+            self.submit()
+
+    def submit(self):
+        form = self.element if self.element.tag == 'form' else self._form()
+        if form is None:
+            return
+        values = [(name, value) for name, value in form.form_values()]
+        action = urlparse.urljoin(self.parent.current_url, form.get('action') or '')
+        if (form.get('method') or 'get').lower() == 'post':
+            self.parent._load('POST', action, data=values)
+        else:
+            self.parent._load('GET', action, params=values)
+
+
+class StaticWait(object):
+    """Mismo interfaz que webtest.waits.BrowserWait, sin esperar: el DOM no cambia"""
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def until_any(self, locators, timeout, visible=False, root=None):
+        search_root = root.element if isinstance(root, HttpElement) else self.driver.document
+        for index, (by, value) in enumerate(locators):
+            for element in find_all(search_root, by, value):
+                if not visible or not is_hidden(element):
+                    return index, HttpElement(self.driver, element)
+        raise exceptions.TimeoutException(
+            "Not found in static page {}: {}".format(self.driver.current_url,
+                " or ".join("{}={}".format(*l) for l in locators)))
+
+
+class HttpDriver(_Finder):
+    """Subconjunto de WebDriver sobre requests + lxml"""
+
+    STATIC_DOM = True
+    WAITER = StaticWait
+
+    def __init__(self, proxy=None, timeout=DEFAULT_TIMEOUT, headers=None, verify=True):
+        """proxy: "host:puerto" o un selenium Proxy"""
+        self.session = requests.Session()
+        adapter = get_http_adapter()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.headers.update(headers or {})
+        self.session.verify = verify
+        proxy = getattr(proxy, 'http_proxy', proxy)
+        if proxy:
+            self.session.proxies = {'http': 'http://' + proxy, 'https': 'http://' + proxy}
+        self.timeout = timeout
+        self._owner = self
+        self.response = None
+        self.current_url = 'about:blank'
+        self._set_document(EMPTY_DOCUMENT)
+        self._window = {'width': 1280, 'height': 800}
+
+    def _set_document(self, source, raw=None):
+        # lxml lee los bytes (respeta el charset declarado en el html)
+        self.page_source = source
+        try:
+            self.document = lxml_html.document_fromstring(raw or source or EMPTY_DOCUMENT)
+        except Exception as e:
+            log.debug("Could not parse {}: {}".format(self.current_url, e))
+            self.document = lxml_html.document_fromstring(EMPTY_DOCUMENT)
+        self._search_root = self.document
+
+    def _load(self, method, url, **kwargs):
+        try:
+            self.response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise exceptions.WebDriverException("Error loading {}: {}".format(url, e))
+        self.current_url = self.response.url
+        content_type = self.response.headers.get('content-type', '')
+        if 'html' in content_type or 'xml' in content_type or not content_type:
+            self._set_document(self.response.text, self.response.content)
+        else:
+            self._set_document(EMPTY_DOCUMENT)
+            self.page_source = self.response.text
+
+    def get(self, url):
+        if url == 'about:blank':
+            self.response = None
+            self.current_url = url
+            self._set_document(EMPTY_DOCUMENT)
+            return
+        self._load('GET', url)
+
+    @property
+    def status_code(self):
+        """Codigo HTTP de la ultima pagina (no existe en webdriver)"""
+        return self.response.status_code if self.response is not None else None
+
+    @property
+    def title(self):
+        titles = self.document.xpath('//title')
+        return titles[0].text_content().strip() if titles else ''
+
+    def back(self):
+        raise exceptions.WebDriverException("HttpDriver has no history")
+
+    def refresh(self):
+        if self.current_url != 'about:blank':
+            self._load('GET', self.current_url)
+
+    def implicitly_wait(self, seconds):
+        pass
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def set_page_load_timeout(self, seconds):
+        self.timeout = seconds
+
+    def execute_script(self, script, *args):
+        raise exceptions.WebDriverException("HttpDriver does not run javascript")
+
+    execute_async_script = execute_script
+
+    def get_screenshot_as_png(self):
+        raise exceptions.WebDriverException("HttpDriver cannot take screenshots")
+
+    def get_window_size(self):
+        return dict(self._window)
+
+    def set_window_size(self, width, height):
+        self._window = {'width': width, 'height': height}
+
+    def get_cookies(self):
+        return [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path}
+            for c in self.session.cookies]
+
+    def add_cookie(self, cookie):
+        self.session.cookies.set(cookie['name'], cookie['value'],
+            domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+
+    def delete_all_cookies(self):
+        self.session.cookies.clear()
+
+    def quit(self):
+        # El adapter es compartido: solo se olvida el estado de la sesion
+        self.session.cookies.clear()
+        self.response = None
+
+    close = quit
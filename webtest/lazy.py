@@ -0,0 +1,59 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Importacion diferida de los backends opcionales.
+
+`check_web` se ejecuta una vez por check y por host: no queremos pagar la
+importacion de selenium, influxdb, PIL o tinys3 hasta que de verdad se
+usan. Un LazyImport se comporta como el modulo (o el atributo del modulo)
+que representa e importa en el primer acceso.
+
+    webdriver = LazyImport('selenium.webdriver')
+    By = LazyImport('selenium.webdriver.common.by', 'By')
+    FIREFOX = LazyImport('selenium.webdriver', 'DesiredCapabilities.FIREFOX')
+"""
+
+import importlib
+
+
+class LazyImport(object):
+    """Proxy de un modulo, o de un atributo de un modulo, que se importa al usarlo"""
+
+    def __init__(self, module_name, attr=None):
+        self.__dict__['_module_name'] = module_name
+        self.__dict__['_attr'] = attr
+        self.__dict__['_target'] = None
+
+    def _load(self):
+        target = self.__dict__['_target']
+        if target is None:
+            target = importlib.import_module(self._module_name)
+            if self._attr:
+                for attr in self._attr.split("."):
+                    target = getattr(target, attr)
+            self.__dict__['_target'] = target
+        return target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self):
+        name = self._module_name
+        if self._attr:
+            name += "." + self._attr
+        state = "loaded" if self.__dict__['_target'] is not None else "not loaded"
+        return "<LazyImport {} ({})>".format(name, state)
+
+
+def resolve(value):
+    """Devuelve el objeto real si value es un LazyImport"""
+    if isinstance(value, LazyImport):
+        return value._load()
+    return value
@@ -0,0 +1,207 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Generador de carga para `webtest load`.
+
+Lanza N usuarios virtuales que ejecutan en bucle un WebTest sobre sesiones
+del SessionPool, con rampa de arranque, tiempo de espera entre iteraciones,
+ritmo objetivo global y duracion fija, e informa periodicamente del
+throughput y de los percentiles de latencia de cada step. Con aggregate y
+influx_conf en el test, los tiempos de cada iteracion van tambien a los
+histogramas <serie>.summary (webtest.histogram).
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from webtest.histogram import Histogram
+
+log = logging.getLogger(__name__)
+
+DEFAULT_REPORT_INTERVAL = 5
+
+
+class LoadStats(object):
+    """Latencias por step e iteraciones acumuladas durante la carga"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = defaultdict(Histogram)
+        self.errors = defaultdict(int)
+        self.iterations = 0
+        self.failures = 0
+
+    def record_step(self, name, elapsed, error=None):
+        with self._lock:
+            if error:
+                self.errors[name] += 1
+            else:
+                self.histograms[name].record(elapsed)
+
+    def record_iteration(self, ok):
+        with self._lock:
+            self.iterations += 1
+            if not ok:
+                self.failures += 1
+
+    def snapshot(self):
+        """{step: {'count', 'errors', 'p50', 'p90', 'p99', 'max'}}"""
+        with self._lock:
+            summary = {}
+            for name in set(self.histograms) | set(self.errors):
+                summary[name] = self.histograms[name].summary()
+                summary[name]['errors'] = self.errors.get(name, 0)
+        return summary
+
+
+class RateLimiter(object):
+    """Reparte como maximo `rate` inicios de iteracion por segundo entre todos los usuarios"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self, stop):
+        with self._lock:
+            now = time.time()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            stop.wait(slot - now)
+
+
+class LoadRunner(object):
+    """Ejecuta un WebTest con `users` usuarios virtuales durante `duration` segundos"""
+
+    def __init__(self, test_class, users=1, duration=60, ramp_up=0,
+            think_time=0, rate=None, test_kwargs=None, pool=None,
+            report_interval=DEFAULT_REPORT_INTERVAL, out=sys.stdout):
+        """
+        ramp_up: segundos en los que se van arrancando los usuarios
+        think_time: segundos de espera de cada usuario entre iteraciones
+                    (se aplica entre 0.5x y 1.5x para no sincronizarlos)
+        rate: iteraciones por segundo como maximo entre todos los usuarios
+        """
+        self.test_class = test_class
+        self.users = users
+        self.duration = duration
+        self.ramp_up = ramp_up
+        self.think_time = think_time
+        self.limiter = RateLimiter(rate) if rate else None
+        self.test_kwargs = dict(test_kwargs or {})
+        if pool is not None:
+            self.test_kwargs['pool'] = pool
+        self.report_interval = report_interval
+        self.out = out
+        self.stats = LoadStats()
+        self.active = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._warned_aggregate = False
+
+    def run_iteration(self):
+        ok = True
+        ok_times = []
+        test = self.test_class(**self.test_kwargs)
+        t1 = time.time()
+        try:
+            for elapsed, name, doc, error in test:
+                self.stats.record_step(name, elapsed, error)
+                if error:
+                    ok = False
+                    log.debug("Error in {}: {}".format(name, error))
+                    break
+                ok_times.append((name, elapsed))
+            if ok:
+                ok_times.append(('total', time.time() - t1))
+        finally:
+            test.close()
+        self.stats.record_iteration(ok)
+        if getattr(test, 'aggregate', False):
+            self._aggregate(test, ok_times)
+
+    def _aggregate(self, test, ok_times):
+        """Como WebTest.run con aggregate: resumenes periodicos a influx"""
+        if not test.influx_conf:
+            if not self._warned_aggregate:
+                self._warned_aggregate = True
+                log.warn("aggregate ignored: {} has no influx_conf".format(
+                    self.test_class.__name__))
+            return
+        try:
+            test.record_summaries(ok_times)
+        except Exception as e:
+            log.error("Error aggregating {}: {}".format(self.test_class.__name__, e))
+
+    def _user(self, index):
+        if self.ramp_up:
+            self._stop.wait(self.ramp_up * index / float(self.users))
+        with self._lock:
+            self.active += 1
+        try:
+            while not self._stop.is_set():
+                if self.limiter:
+                    self.limiter.wait(self._stop)
+                    if self._stop.is_set():
+                        break
+                try:
+                    self.run_iteration()
+                except Exception:
+                    log.exception("Error starting {}".format(self.test_class.__name__))
+                    self.stats.record_iteration(False)
+                if self.think_time:
+                    self._stop.wait(self.think_time * random.uniform(0.5, 1.5))
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def report(self, elapsed, last_iterations, interval):
+        iterations = self.stats.iterations
+        throughput = (iterations - last_iterations) / float(interval or 1)
+        print >> self.out, "[{:7.1f}s] users={} iterations={} failures={} throughput={:.2f}/s".format(
+            elapsed, self.active, iterations, self.stats.failures, throughput)
+        for name, row in sorted(self.stats.snapshot().items()):
+            print >> self.out, "    {0:<30} n={count:<6} err={errors:<4} {1}".format(
+                name, " ".join("{}={}".format(key, format_seconds(row[key]))
+                    for key in ['p50', 'p90', 'p99', 'max']), **row)
+        self.out.flush()
+        return iterations
+
+    def run(self):
+        """Lanza la carga y devuelve el resumen final por step"""
+        threads = []
+        for index in range(self.users):
+            thread = threading.Thread(target=self._user, args=(index,),
+                name="webtest-user-{}".format(index))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        start = time.time()
+        deadline = start + self.duration
+        last_report = start
+        last_iterations = 0
+        try:
+            while time.time() < deadline:
+                self._stop.wait(min(self.report_interval, max(0, deadline - time.time())))
+                now = time.time()
+                last_iterations = self.report(now - start, last_iterations, now - last_report)
+                last_report = now
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        # Resumen final con el throughput de toda la prueba
+        total = time.time() - start
+        self.report(total, 0, total)
+        return self.stats.snapshot()
+
+
+def format_seconds(value):
+    return "-" if value is None else "{:.3f}s".format(value)
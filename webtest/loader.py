@@ -1,10 +1,12 @@
 #!/bin/env python
 # -*- coding: utf-8 -*-
 
+import imp
 import inspect
 import logging
 import sys
 import os
+import threading
 from .base import WebTest
 
 DEFAULT_TESTDIR = "/etc/webtests"
@@ -28,24 +30,127 @@ def is_webtest(tup):
     )
 
 
-def get_test(testfile, testdir=DEFAULT_TESTDIR, *args, **kwargs):
-    """WebTest factory"""
-    sys.path.insert(0, testdir)
+class TestRegistry(object):
+    """
+    Index of the WebTest classes in a test directory.
+
+    Modules are imported once and only reloaded when their file mtime
+    changes, so looking up a test is a dict access plus a stat.
+    """
+
+    def __init__(self, testdir=DEFAULT_TESTDIR):
+        self.testdir = os.path.abspath(testdir)
+        self._modules = {}  # module_name -> (mtime, {class_name: class}, [class_name, ...])
+        self._lock = threading.RLock()
+        if self.testdir not in sys.path:
+            sys.path.insert(0, self.testdir)
+
+    def _path(self, module_name):
+        return os.path.join(self.testdir, module_name + ".py")
+
+    def _load(self, module_name, path, mtime):
+        try:
+            imported = imp.load_source(module_name, path)
+        except Exception as e:
+            log.warn("Error importing {path}: {e}".format(**locals()))
+            self._modules.pop(module_name, None)
+            return None
+        webtests = dict(filter(is_webtest, vars(imported).items()))
+        # Preferimos las clases definidas en el propio modulo, en orden de
+        # definicion, a las importadas de otros
+        own = [name for name, Test in webtests.items()
+            if Test.__module__ == imported.__name__]
+        order = sorted(own, key=lambda name: _source_line(webtests[name]))
+        order += sorted(set(webtests) - set(own))
+        entry = (mtime, webtests, order)
+        self._modules[module_name] = entry
+        return entry
+
+    def _entry(self, module_name):
+        """Module entry, (re)importing it if the file is new or has changed"""
+        path = self._path(module_name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            with self._lock:
+                self._modules.pop(module_name, None)
+            return None
+        with self._lock:
+            entry = self._modules.get(module_name)
+            if entry is None or entry[0] != mtime:
+                if entry is not None:
+                    log.info("Reloading {}".format(path))
+                entry = self._load(module_name, path, mtime)
+            return entry
+
+    def scan(self):
+        """Indexes every module in testdir; returns [(module_name, WebTest class)]"""
+        found = []
+        names = set()
+        for filename in sorted(os.listdir(self.testdir)):
+            module_name, ext = os.path.splitext(filename)
+            if ext != '.py' or module_name.startswith('_'):
+                continue
+            names.add(module_name)
+            entry = self._entry(module_name)
+            if entry:
+                _, webtests, order = entry
+                found.extend((module_name, webtests[name]) for name in order
+                    if webtests[name].__module__ == module_name)
+        with self._lock:
+            for module_name in set(self._modules) - names:
+                del self._modules[module_name]
+        return found
+
+    def get(self, module_name, class_name=None):
+        """WebTest class by module and (optional) class name, or None"""
+        entry = self._entry(os.path.splitext(module_name)[0])
+        if not entry:
+            return None
+        _, webtests, order = entry
+        if class_name:
+            return webtests.get(class_name)
+        if len(order) > 1:
+            log.debug("{} has several tests, using {}".format(module_name, order[0]))
+        return webtests[order[0]] if order else None
+
+
+def _source_line(Test):
     try:
-        imported = __import__(os.path.splitext(testfile)[0])
-    except ImportError:
+        return inspect.getsourcelines(Test)[1]
+    except (IOError, TypeError):
+        return 0
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(testdir=DEFAULT_TESTDIR):
+    """TestRegistry shared by the process for testdir"""
+    testdir = os.path.abspath(testdir)
+    with _registries_lock:
+        registry = _registries.get(testdir)
+        if registry is None:
+            registry = _registries[testdir] = TestRegistry(testdir)
+        return registry
+
+
+def get_test(testfile, testdir=DEFAULT_TESTDIR, *args, **kwargs):
+    """WebTest factory. Pass test_class to choose among several tests in testfile"""
+    test_class = kwargs.pop('test_class', None)
+    Test = get_registry(testdir).get(testfile, test_class)
+    if Test is None:
         log.warn("Test {testfile} not found in {testdir}".format(**locals()))
         return None
 
-    webtests = dict(filter(is_webtest, vars(imported).items()))
+    log.info("Loading test {}".format(Test.__name__))
+    return Test(*args, **kwargs)
 
-    try:
-        name, Test = webtests.items()[0]
-    except IndexError:
-        pass
-    else:
-        log.info("Loading test {}".format(name))
-        return Test(*args, **kwargs)
+
+def discover_tests(testdir=DEFAULT_TESTDIR):
+    """Imports every module in testdir, returns [(module_name, WebTest class)]"""
+    return get_registry(testdir).scan()
 
 
 if __name__ == "__main__":
@@ -6,8 +6,12 @@ from webtest import __VERSION__
 from webtest.loader import get_test, DEFAULT_TESTDIR
 
 from optparse import OptionParser
+import datetime
+import json
 import logging
+import os
 import sys
+import time
 
 DEFAULT_CONFIG_FILE = "/etc/apconf.ini"
 NAME = 'webtest'
@@ -15,22 +19,312 @@ NAME = 'webtest'
 log = logging.getLogger(NAME)
 
 
+def serve(argv):
+    """Runs every test in testdir periodically from a single process"""
+    from webtest.loader import get_registry
+    from webtest.pool import SessionPool
+    from webtest.scheduler import Scheduler, DEFAULT_WORKERS, DEFAULT_JITTER
+
+    parser = OptionParser(usage="usage: %prog serve [options]")
+    parser.add_option("--verbose", "-V", action="store_true")
+    parser.add_option("--testdir", "-d", action="store", dest="testdir",
+        default=DEFAULT_TESTDIR,
+        help="Directory containing tests")
+    parser.add_option("--driver", action="store", default='remote',
+        help="Webdriver to use (firefox, phantomjs, remote or http)")
+    parser.add_option("--workers", "-w", action="store", type="int",
+        default=DEFAULT_WORKERS,
+        help="Number of tests running at the same time")
+    parser.add_option("--max-sessions", action="store", type="int",
+        dest="max_sessions",
+        help="Browser sessions kept alive (defaults to --workers)")
+    parser.add_option("--jitter", action="store", type="float",
+        default=DEFAULT_JITTER,
+        help="Random fraction of the interval added to each run")
+    parser.add_option("--aggregate", action="store_true",
+        help="Send periodic latency summaries instead of one point per run")
+    parser.add_option("--origin-only", action="store_true", dest="origin_only",
+        help="Block third party requests and cache static assets (series get an .origin sufix)")
+    parser.add_option("--adaptive-timeouts", action="store_true", dest="adaptive_timeouts",
+        help="Per step timeouts learned from previous runs (see webtest.adaptive)")
+
+    options, args = parser.parse_args(argv)
+
+    level = logging.DEBUG if options.verbose else logging.INFO
+    logging.basicConfig(level=level)
+
+    registry = get_registry(options.testdir)
+    tests = registry.scan()
+    if not tests:
+        print "No hay tests en {}".format(options.testdir)
+        return 1
+
+    pool = SessionPool(max_sessions=options.max_sessions or options.workers)
+    scheduler = Scheduler(tests, workers=options.workers,
+        jitter=options.jitter,
+        test_kwargs={'driver': options.driver, 'aggregate': bool(options.aggregate),
+            'origin_only': bool(options.origin_only),
+            'adaptive_conf': {} if options.adaptive_timeouts else None},
+        pool=pool, registry=registry)
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+    return 0
+
+
+def load(argv):
+    """Load test: runs one test with many virtual users"""
+    from webtest.loader import get_registry
+    from webtest.load import LoadRunner, DEFAULT_REPORT_INTERVAL
+    from webtest.pool import SessionPool
+
+    parser = OptionParser(usage="usage: %prog load [options] test_name")
+    parser.add_option("--verbose", "-V", action="store_true")
+    parser.add_option("--testdir", "-d", action="store", dest="testdir",
+        default=DEFAULT_TESTDIR,
+        help="Directory containing tests")
+    parser.add_option("--class", action="store", dest="test_class",
+        help="Test class, when the module has several")
+    parser.add_option("--driver", action="store", default='phantomjs',
+        help="Webdriver to use (firefox, phantomjs, remote or http)")
+    parser.add_option("--users", "-u", action="store", type="int", default=1,
+        help="Virtual users")
+    parser.add_option("--ramp-up", action="store", type="float", default=0,
+        dest="ramp_up", help="Seconds to start all the users")
+    parser.add_option("--duration", "-t", action="store", type="float",
+        default=60, help="Seconds to run")
+    parser.add_option("--think-time", action="store", type="float", default=0,
+        dest="think_time", help="Seconds each user waits between iterations")
+    parser.add_option("--rate", "-r", action="store", type="float",
+        help="Max iterations per second across all users")
+    parser.add_option("--report-interval", action="store", type="float",
+        default=DEFAULT_REPORT_INTERVAL, dest="report_interval",
+        help="Seconds between live reports")
+    parser.add_option("--aggregate", action="store_true",
+        help="Send periodic latency summaries instead of one point per run")
+    parser.add_option("--origin-only", action="store_true", dest="origin_only",
+        help="Block third party requests and cache static assets (series get an .origin sufix)")
+
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.print_help()
+        return 1
+
+    level = logging.DEBUG if options.verbose else logging.WARNING
+    logging.basicConfig(level=level)
+
+    Test = get_registry(options.testdir).get(args[0], options.test_class)
+    if not Test:
+        print "Test {} no encontrado en {}".format(args[0], options.testdir)
+        return 1
+
+    pool = SessionPool(max_sessions=options.users)
+    runner = LoadRunner(Test, users=options.users, duration=options.duration,
+        ramp_up=options.ramp_up, think_time=options.think_time,
+        rate=options.rate, pool=pool,
+        test_kwargs={'driver': options.driver, 'aggregate': bool(options.aggregate),
+            'origin_only': bool(options.origin_only)},
+        report_interval=options.report_interval)
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+    return 0 if not runner.stats.failures else 2
+
+
+def stats(argv):
+    """Percentiles and trends from the local results store"""
+    from webtest.load import format_seconds
+    from webtest.results import ResultsStore, DEFAULT_RESULTS_PATH, parse_time, parse_interval
+
+    parser = OptionParser(usage="usage: %prog stats [options] [series_regex]")
+    parser.add_option("--path", "-p", action="store",
+        default=DEFAULT_RESULTS_PATH,
+        help="Results store directory")
+    parser.add_option("--since", "-s", action="store", default="24h",
+        help="Start of the range: epoch or age like 30m, 12h, 7d")
+    parser.add_option("--until", action="store",
+        help="End of the range: epoch or age like 30m, 12h, 7d")
+    parser.add_option("--trend", action="store",
+        help="Show percentiles per interval, e.g. 1h")
+
+    options, args = parser.parse_args(argv)
+    if not os.path.isdir(options.path):
+        print "No hay resultados en {}".format(options.path)
+        return 1
+
+    store = ResultsStore(options.path)
+    bucket = parse_interval(options.trend) if options.trend else None
+    summary = store.summarize(since=parse_time(options.since),
+        until=parse_time(options.until), match=args[0] if args else None,
+        bucket=bucket)
+    if not summary:
+        print "No hay resultados en {}".format(options.path)
+        return 1
+
+    for name, entry in sorted(summary.items()):
+        row = entry['all'].summary()
+        print "{0:<40} n={count:<7} err={1:<5} {2}".format(name, entry['errors'],
+            " ".join("{}={}".format(key, format_seconds(row[key]))
+                for key in ['p50', 'p90', 'p99', 'max']), **row)
+        for start, histogram in sorted(entry['buckets'].items()):
+            row = histogram.summary()
+            print "    {0:%Y-%m-%d %H:%M}  n={count:<7} {1}".format(
+                datetime.datetime.fromtimestamp(start),
+                " ".join("{}={}".format(key, format_seconds(row[key]))
+                    for key in ['p50', 'p90', 'p99']), **row)
+    return 0
+
+
+def proxy(argv):
+    """Host rewriting proxy in the foreground"""
+    from webtest.loader import get_registry
+    from webtest import proxy as webtest_proxy
+    from webtest.requestpolicy import RequestPolicy, DEFAULT_BLOCK_URLS
+
+    parser = OptionParser(usage="usage: %prog proxy [options] [test_name]")
+    parser.add_option("--verbose", "-V", action="store_true")
+    parser.add_option("--testdir", "-d", action="store", dest="testdir",
+        default=DEFAULT_TESTDIR,
+        help="Directory containing tests")
+    parser.add_option("--class", action="store", dest="test_class",
+        help="Test class, when the module has several")
+    parser.add_option("--port", "-p", action="store", type="int",
+        default=webtest_proxy.DEFAULT_PORT)
+    parser.add_option("--interface", "-i", action="store", default="",
+        help="Address to listen on (all by default)")
+    parser.add_option("--override", "-o", action="append", default=[],
+        help="HOST=IP, can be repeated; '.example.com' matches subdomains")
+    parser.add_option("--max-per-host", action="store", type="int",
+        default=webtest_proxy.DEFAULT_MAX_PER_HOST, dest="max_per_host",
+        help="Keep-alive connections kept per origin")
+    parser.add_option("--origin-only", action="store_true", dest="origin_only",
+        help="Block the test's BLOCK_URLS (or the defaults) and cache static assets")
+    parser.add_option("--block", action="append", default=[],
+        help="URL regexp answered with an empty 204, can be repeated (implies --origin-only)")
+
+    options, args = parser.parse_args(argv)
+
+    level = logging.DEBUG if options.verbose else logging.INFO
+    logging.basicConfig(level=level)
+
+    host_overrides = {}
+    block = list(DEFAULT_BLOCK_URLS) if options.origin_only else []
+    cache = bool(options.origin_only or options.block)
+    if args:
+        Test = get_registry(options.testdir).get(args[0], options.test_class)
+        if not Test:
+            print "Test {} no encontrado en {}".format(args[0], options.testdir)
+            return 1
+        host_overrides.update(Test.HOST_OVERRIDES or {})
+        if options.origin_only:
+            block = list(Test.BLOCK_URLS or [])
+            cache = Test.CACHE_STATIC
+    for override in options.override:
+        host, _, ip = override.partition("=")
+        if not ip:
+            parser.error("--override must be HOST=IP")
+        host_overrides[host] = ip
+
+    policy = RequestPolicy(block + options.block, cache) if cache else None
+    webtest_proxy.serve(host_overrides, port=options.port,
+        interface=options.interface, max_per_host=options.max_per_host,
+        policy=policy)
+    return 0
+
+
+def checkserver(argv):
+    """Resident nagios check server (clients: check_web --server)"""
+    from webtest import checkserver as check_server
+    from webtest.pool import SessionPool
+
+    parser = OptionParser(usage="usage: %prog checkserver [options]")
+    parser.add_option("--verbose", "-V", action="store_true")
+    parser.add_option("--testdir", "-d", action="store", dest="testdir",
+        default=DEFAULT_TESTDIR,
+        help="Directory containing tests")
+    parser.add_option("--port", "-p", action="store", type="int",
+        default=check_server.DEFAULT_PORT)
+    parser.add_option("--interface", "-i", action="store", default="127.0.0.1",
+        help="Address to listen on")
+    parser.add_option("--ttl", action="store", type="float",
+        default=check_server.DEFAULT_TTL,
+        help="Seconds a check result is served from cache")
+    parser.add_option("--max-sessions", action="store", type="int",
+        dest="max_sessions", default=4,
+        help="Browser sessions kept alive")
+
+    options, args = parser.parse_args(argv)
+
+    level = logging.DEBUG if options.verbose else logging.INFO
+    logging.basicConfig(level=level)
+
+    pool = SessionPool(max_sessions=options.max_sessions)
+    try:
+        check_server.serve(options.testdir, port=options.port,
+            interface=options.interface, ttl=options.ttl, pool=pool)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+    return 0
+
+
+COMMANDS = {
+    'serve': serve,
+    'load': load,
+    'stats': stats,
+    'proxy': proxy,
+    'checkserver': checkserver,
+}
+
+
 def main():
     """Opciones test"""
-    parser = OptionParser(usage="usage: %prog [options] test_name")
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
+    parser = OptionParser(usage="usage: %prog [options] test_name [test_name|glob|module:Class ...]\n"
+        "       %prog serve [options]\n"
+        "       %prog load [options] test_name\n"
+        "       %prog stats [options] [series_regex]\n"
+        "       %prog proxy [options] [test_name]\n"
+        "       %prog checkserver [options]")
     parser.add_option("--version", "-v", action="store_true")
     parser.add_option("--verbose", "-V", action="store_true")
     parser.add_option("--testdir", "-d", action="store", dest="testdir",
         default=DEFAULT_TESTDIR,
         help="Directory containing tests")
+    parser.add_option("--driver", action="store", default='remote',
+        help="Webdriver to use (firefox, phantomjs, remote or http)")
+    parser.add_option("--jobs", "-j", action="store", type="int",
+        help="Tests running at the same time; prints one json line per test")
+    parser.add_option("--threads", action="store_true",
+        help="With --jobs, use threads instead of processes")
+    parser.add_option("--summary", action="store",
+        help="Write a json summary with per test and per step timings to this file")
 
     options, args = parser.parse_args()
-    
+
+    if options.version:
+        print "%s v. %s" % (NAME, __VERSION__)
+        return 0
+
     level = logging.DEBUG if options.verbose else logging.INFO
     logging.basicConfig(level=level)
 
+    batch = (len(args) > 1 or options.jobs or options.summary
+        or any(c in arg for arg in args for c in "*?[:"))
+    if batch:
+        return run_batch(args, options)
+
     if args:
-        test = get_test(args[0], testdir=options.testdir, driver='remote')
+        test = get_test(args[0], testdir=options.testdir, driver=options.driver)
 
         if not test:
             print "Test {} no encontrado en {}".format(args[0], options.testdir)
@@ -42,13 +336,27 @@ def main():
         parser.print_help()
         return 1
 
-    if options.version:
-        print "%s v. %s" % (NAME, __VERSION__)
-        return 0
-    else:
-        parser.print_help()
+
+def run_batch(patterns, options):
+    """Varios tests en paralelo: lineas json en stdout y resumen opcional"""
+    from webtest.batch import expand_tests, run_tests, summarize, write_json_line, DEFAULT_JOBS
+
+    tests = expand_tests(patterns, options.testdir)
+    if not tests:
+        print >> sys.stderr, "No hay tests para {} en {}".format(" ".join(patterns), options.testdir)
         return 1
-    return 0
+
+    started = time.time()
+    results = run_tests(tests, testdir=options.testdir, jobs=options.jobs or DEFAULT_JOBS,
+        threads=options.threads, test_kwargs={'driver': options.driver},
+        callback=write_json_line)
+    summary = summarize(results, time.time() - started)
+    if options.summary:
+        with open(options.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+    print >> sys.stderr, "{} tests, {} passed, {} failed in {:.2f}s".format(
+        summary['tests'], summary['passed'], len(summary['failed']), summary['elapsed'])
+    return 0 if not summary['failed'] else 2
 
 
 if __name__ == '__main__':
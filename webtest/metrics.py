@@ -5,11 +5,301 @@
 Metrics backend for webtest
 """
 
-from influxdb.influxdb08 import InfluxDBClient
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import Queue
+
+from webtest.lazy import LazyImport
+
+InfluxDBClient = LazyImport('influxdb.influxdb08', 'InfluxDBClient')
+
+# BACKEND en influx_conf -> cliente con write_points (ver webtest.backends)
+BACKEND_INFLUX08 = 'influx08'
+BACKENDS = {
+    'influx_line': LazyImport('webtest.backends', 'InfluxLineClient'),
+    'influx_udp': LazyImport('webtest.backends', 'InfluxUdpClient'),
+    'statsd': LazyImport('webtest.backends', 'StatsdClient'),
+    'prometheus': LazyImport('webtest.backends', 'PrometheusClient'),
+}
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_CLOSE_TIMEOUT = 10
+
+OVERFLOW_DROP = 'drop'                # descarta los puntos nuevos
+OVERFLOW_DROP_OLDEST = 'drop_oldest'  # descarta los puntos mas antiguos
+OVERFLOW_SPILL = 'spill'              # vuelca a SPILL_PATH y reenvia despues
+
 
 def get_metrics_client(influx_conf):
     if not influx_conf:
         raise Exception("Se ha intentado conectar a Influx sin los datos de conexion")
 
+    backend = influx_conf.get("BACKEND", BACKEND_INFLUX08)
+    if backend != BACKEND_INFLUX08:
+        if backend not in BACKENDS:
+            raise Exception("Unknown metrics BACKEND {!r}".format(backend))
+        return BACKENDS[backend](influx_conf)
+
     client = InfluxDBClient(influx_conf["HOST"], influx_conf["PORT"], influx_conf["USER"], influx_conf["PASSWD"], influx_conf["DBNAME"])
     return client
+
+
+class _Marker(object):
+    """Orden para el hilo de escritura (flush o stop)"""
+
+    def __init__(self, stop=False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class BufferedMetricsWriter(object):
+    """
+    Encola los puntos y los escribe por lotes desde un hilo en segundo plano,
+    reutilizando una unica conexion, para que un Influx lento o caido no
+    retrase nunca el test.
+
+    Opciones en influx_conf (todas opcionales):
+        BACKEND: 'influx08' (por defecto), 'influx_line', 'influx_udp',
+                 'statsd' o 'prometheus' (webtest.backends)
+        BATCH_SIZE: puntos por escritura
+        FLUSH_INTERVAL: segundos maximos que un punto espera en memoria
+        QUEUE_SIZE: puntos en memoria como maximo
+        OVERFLOW: 'drop', 'drop_oldest' o 'spill' cuando la cola esta llena
+        SPILL_PATH: fichero donde volcar lo que no se ha podido escribir
+        BUFFER_PATH: directorio de un ResultsStore (webtest.results) donde
+                     guardar los tiempos de step que no se han podido
+                     escribir; se reenvian en cuanto Influx vuelve a responder
+    """
+
+    def __init__(self, influx_conf, client=None):
+        self.influx_conf = influx_conf
+        self.batch_size = influx_conf.get("BATCH_SIZE", DEFAULT_BATCH_SIZE)
+        self.flush_interval = influx_conf.get("FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)
+        self.overflow = influx_conf.get("OVERFLOW", OVERFLOW_DROP_OLDEST)
+        self.spill_path = influx_conf.get("SPILL_PATH")
+        self.buffer_path = influx_conf.get("BUFFER_PATH")
+        self.dropped = 0
+        self._client = client
+        self._spill_lock = threading.Lock()
+        self._queue = Queue.Queue(maxsize=influx_conf.get("QUEUE_SIZE", DEFAULT_QUEUE_SIZE))
+        self._thread = threading.Thread(target=self._run, name="webtest-metrics")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_metrics_client(self.influx_conf)
+        return self._client
+
+    def write_points(self, points):
+        """Encola los puntos, nunca bloquea"""
+        for index, point in enumerate(points):
+            try:
+                self._queue.put_nowait(point)
+            except Queue.Full:
+                self._overflow(points[index:])
+                return
+
+    def _overflow(self, points):
+        if self.overflow == OVERFLOW_SPILL and self.spill_path:
+            try:
+                self._spill(points)
+                return
+            except (IOError, OSError) as e:
+                log.error("Error spilling {} points to {}: {}".format(
+                    len(points), self.spill_path, e))
+                self.dropped += len(points)
+                return
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            for point in points:
+                try:
+                    old = self._queue.get_nowait()
+                    if isinstance(old, _Marker):
+                        old.done.set()
+                    else:
+                        self.dropped += 1
+                    self._queue.put_nowait(point)
+                except (Queue.Empty, Queue.Full):
+                    self.dropped += 1
+        else:
+            self.dropped += len(points)
+        log.warn("Metrics queue full, {} points dropped so far".format(self.dropped))
+
+    def _spill(self, points):
+        with self._spill_lock:
+            with open(self.spill_path, "a") as f:
+                f.write(json.dumps(points) + "\n")
+
+    def _read_spill_cursor(self, cursor_path):
+        try:
+            with open(cursor_path) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return 0
+
+    def _write_spill_cursor(self, cursor_path, offset):
+        with open(cursor_path + ".tmp", "w") as f:
+            f.write(str(offset))
+        os.rename(cursor_path + ".tmp", cursor_path)
+
+    def _replay_spill(self):
+        """
+        Reenvia lo volcado a disco una vez Influx vuelve a responder. El
+        cursor (<SPILL_PATH>.replay.cursor) avanza tras cada lote enviado:
+        si falla a medias se sigue por donde se quedo, sin duplicar puntos
+        """
+        if not self.spill_path:
+            return
+        replaying = self.spill_path + ".replay"
+        cursor_path = replaying + ".cursor"
+        with self._spill_lock:
+            if not os.path.exists(replaying):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.rename(self.spill_path, replaying)
+                self._write_spill_cursor(cursor_path, 0)
+        offset = self._read_spill_cursor(cursor_path)
+        with open(replaying) as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    # Linea a medio escribir (el proceso murio volcando)
+                    break
+                try:
+                    points = json.loads(line)
+                except ValueError:
+                    log.error("Skipping corrupt line in {}".format(replaying))
+                    points = None
+                if points:
+                    self.client.write_points(points)
+                offset += len(line)
+                self._write_spill_cursor(cursor_path, offset)
+        os.remove(replaying)
+        os.remove(cursor_path)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            self.client.write_points(batch)
+        except Exception as e:
+            log.error("Error writing {} points to influx: {}".format(len(batch), e))
+            if self.buffer_path:
+                batch = self._buffer(batch)
+            if not batch:
+                return
+            if self.spill_path:
+                try:
+                    self._spill(batch)
+                    return
+                except (IOError, OSError) as e:
+                    # Disco lleno o sin permisos: el hilo de escritura sigue vivo
+                    log.error("Error spilling {} points to {}: {}".format(
+                        len(batch), self.spill_path, e))
+            self.dropped += len(batch)
+            return
+        try:
+            self._replay_spill()
+        except Exception as e:
+            log.error("Error replaying {}: {}".format(self.spill_path, e))
+        if self.buffer_path:
+            try:
+                self._replay_buffer()
+            except Exception as e:
+                log.error("Error replaying {}: {}".format(self.buffer_path, e))
+
+    def _buffer(self, points):
+        """Guarda los tiempos de step en el ResultsStore; devuelve el resto"""
+        # Importado aqui: webtest.results depende de histogram, que depende de metrics
+        from webtest.results import get_results_store, split_step_points
+        rows, others = split_step_points(points)
+        try:
+            get_results_store(self.buffer_path).append(rows)
+        except Exception as e:
+            log.error("Error buffering {} rows in {}: {}".format(len(rows), self.buffer_path, e))
+            return points
+        return others
+
+    def _replay_buffer(self):
+        from webtest.results import get_results_store
+        store = get_results_store(self.buffer_path)
+        sent = store.replay(self.client, batch_size=self.batch_size)
+        if sent:
+            log.info("Replayed {} buffered rows from {}".format(sent, self.buffer_path))
+            store.discard_replayed()
+
+    def _run(self):
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.time()))
+            except Queue.Empty:
+                item = None
+            if isinstance(item, _Marker):
+                self._write(batch)
+                batch = []
+                item.done.set()
+                if item.stop:
+                    return
+            elif item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.time() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.time() + self.flush_interval
+
+    def flush(self, timeout=None):
+        """Escribe todo lo encolado hasta ahora"""
+        marker = _Marker()
+        self._queue.put(marker, timeout=timeout)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout=DEFAULT_CLOSE_TIMEOUT):
+        """Vacia la cola y para el hilo de escritura"""
+        if not self._thread.is_alive():
+            return
+        marker = _Marker(stop=True)
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except Queue.Full:
+            log.error("Metrics queue still full at shutdown, points lost")
+            return
+        marker.done.wait(timeout)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_metrics_writer(influx_conf, client=None):
+    """
+    BufferedMetricsWriter compartido para una configuracion de influx
+    (client solo se usa al crearlo, p.ej. webtest.testing.NullMetricsClient)
+    """
+    if not influx_conf:
+        raise Exception("Se ha intentado conectar a Influx sin los datos de conexion")
+    key = repr(sorted(influx_conf.items()))
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = BufferedMetricsWriter(influx_conf, client=client)
+        return writer
+
+
+@atexit.register
+def close_metrics_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 
 """
-Base multimechanize transaction
+Base multimechanize transaction (see also `webtest load`, which runs the
+same WebTest with virtual users without multi-mechanize)
 usage:
 
 from webtest import BaseTransaction
@@ -23,29 +24,32 @@ class BaseTransaction(object):
     testname = None
     url = None
     timeout = 40
+    pool = None  # SessionPool opcional para reutilizar navegadores
 
     def __init__(self):
         if not self.testname:
             raise ValueError("testname must be set in Transaction inherited class")
-        self.custom_timers = []
+        self.custom_timers = {}
 
     def run(self):
         gctest = self.get_webtest()
-        for elapsed, name, doc, error in gctest:
-            self.custom_timers[doc] = elapsed
-            if error:
-                print "ERROR {name} in {elapsed:10.2f}s ({doc}) --> -- ERROR {name}: --\n{error}\n ----".format(**locals())
-                #self.driver.save_screenshot('error-{}.png'.format(name))
-            else:
-                print "Run {name} in {elapsed:10.2f}s ({doc})".format(**locals())
-                #self.driver.save_screenshot('ok-{}.png'.format(name))
-            assert (not error), error.strip()
-        gctest.close()
+        try:
+            for elapsed, name, doc, error in gctest:
+                self.custom_timers[doc] = elapsed
+                if error:
+                    print "ERROR {name} in {elapsed:10.2f}s ({doc}) --> -- ERROR {name}: --\n{error}\n ----".format(**locals())
+                    #self.driver.save_screenshot('error-{}.png'.format(name))
+                else:
+                    print "Run {name} in {elapsed:10.2f}s ({doc})".format(**locals())
+                    #self.driver.save_screenshot('ok-{}.png'.format(name))
+                assert (not error), error.strip()
+        finally:
+            gctest.close()
 
     def get_webtest(self, timeout=None):
         timeout = timeout or self.timeout
         gctest = get_test(self.testname, url=self.url,
-                driver="phantomjs", timeout=timeout)
+                driver="phantomjs", timeout=timeout, pool=self.pool)
         if not gctest:
             msg = "WebTest {} not found at dir {}".format(self.testname, DEFAULT_TESTDIR)
             log.error(msg)
@@ -21,26 +21,29 @@ NAGIOSCODES = {
 
 log = logging.getLogger(NAME)
 
-def nagios_return(code, response, times=None):
-    """ prints the response message
-        and exits the script with one
-        of the defined exit codes
-        DOES NOT RETURN
-    """
+def nagios_output(code, response, times=None):
+    """Linea de salida para nagios (con perfdata si hay tiempos)"""
     perfdata = None
     out = "{code} : {response}" 
     if times:
         perfdata = " ".join("'{0}'={1:.3}s".format(*t) for t in times.iteritems())
         out += " | {perfdata}"
 
-    print out.format(code=code, response=response, perfdata=perfdata)
+    return out.format(code=code, response=response, perfdata=perfdata)
 
-    return NAGIOSCODES[code]
 
+def nagios_return(code, response, times=None):
+    """ prints the response message
+        and returns one of the defined
+        exit codes
+    """
+    print nagios_output(code, response, times)
+
+    return NAGIOSCODES[code]
 
 
-def do_test(webtest):
-    """runs webtest"""
+def evaluate(webtest):
+    """runs webtest, returns (code, response, times)"""
   
     start = time.time() 
     times = dict()
@@ -49,32 +52,62 @@ def do_test(webtest):
         if error:
             total = time.time() - start
             times['total'] = total
-            return nagios_return(code='CRITICAL',
-                response="Error in {name}: {error}".format(**locals()),
-                times=times)
+            return ('CRITICAL', "Error in {name}: {error}".format(**locals()), times)
     total = time.time() - start
     times["Total"] = total
-    return nagios_return(code='OK',
-        response="Test Ok en {}s".format(total), 
-        times=times)
+    return ('OK', "Test Ok en {}s".format(total), times)
+
+
+def do_test(webtest):
+    """runs webtest"""
+    code, response, times = evaluate(webtest)
+    return nagios_return(code=code, response=response, times=times)
+
+
+def check_result(test_name, testdir=DEFAULT_TESTDIR, pool=None):
+    """Runs a check without printing: (code, response, times)"""
+    webtest = get_test(test_name, testdir=testdir, driver='remote', pool=pool)
+    if not webtest:
+        return ('UNKNOWN', "Test {test_name} not found in {testdir}".format(
+            **locals()), None)
+
+    try:
+        return evaluate(webtest)
+    finally:
+        webtest.close()
+
+
+def run_check(test_name, testdir=DEFAULT_TESTDIR, pool=None):
+    """Runs a check, borrowing the browser from pool if given"""
+    code, response, times = check_result(test_name, testdir=testdir, pool=pool)
+    return nagios_return(code=code, response=response, times=times)
+
 
 @click.command()
 @click.option('--testdir', type=click.Path(exists=True, readable=True), 
         default=DEFAULT_TESTDIR, 
         help='Directory containing tests')
+@click.option('--server', default=None,
+        help='host:port of a running `webtest checkserver` to ask instead')
+@click.option('--max-age', type=float, default=None,
+        help='With --server, oldest cached result accepted (seconds)')
+@click.option('--timeout', type=float, default=None,
+        help='With --server, seconds to wait for the answer')
 @click.version_option(__VERSION__)
 @click.argument('test_name')
-def test(testdir, test_name):
+def test(testdir, test_name, server, max_age, timeout):
     """NRPRE nagios Test"""
 
-    webtest = get_test(test_name, testdir=testdir, driver='remote')
-    if not webtest:
-        return(nagios_return(code='UNKNOWN', 
-            response="Test {test_name} not found in {testdir}".format(
-                **locals())))
+    if server:
+        from webtest.checkserver import request_check, DEFAULT_CLIENT_TIMEOUT
+        code, output = request_check(server, test_name, max_age=max_age,
+            timeout=timeout or DEFAULT_CLIENT_TIMEOUT)
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+        print output
+        sys.exit(code)
 
-    code = do_test(webtest)
-    webtest.close()
+    code = run_check(test_name, testdir=testdir)
     sys.exit(code)
 
 
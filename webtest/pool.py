@@ -0,0 +1,300 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pool de sesiones de webdriver reutilizables.
+
+Arrancar PhantomJS o una sesion remota cuesta mas que muchos de los tests,
+asi que el pool mantiene sesiones calientes agrupadas por
+(driver, proxy, min_window_width), las limpia entre tests y descarta las
+que llevan demasiado tiempo paradas o han dejado de responder.
+
+usage:
+
+    from webtest.pool import get_session_pool
+
+    pool = get_session_pool()
+    test = get_test('mytest', driver='remote', pool=pool)
+    test.run()   # al cerrar, la sesion vuelve al pool
+
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SESSIONS = 4
+DEFAULT_MAX_IDLE = 300
+DEFAULT_ACQUIRE_TIMEOUT = 60
+
+RESET_STORAGE_SCRIPT = """
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+"""
+
+
+class PoolTimeout(Exception):
+    """No se ha podido obtener una sesion del pool a tiempo"""
+
+
+class _Session(object):
+    """Sesion de webdriver gestionada por el pool"""
+
+    def __init__(self, key, driver):
+        self.key = key
+        self.driver = driver
+        self.created = time.time()
+        self.last_used = self.created
+        self.uses = 0
+
+
+class SessionPool(object):
+    """Pool de sesiones de webdriver agrupadas por driver, proxy y tamaño"""
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS,
+            max_idle=DEFAULT_MAX_IDLE, max_uses=None,
+            acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT, factory=None):
+        """
+        max_sessions: sesiones vivas como maximo (prestadas + libres)
+        max_idle: segundos que una sesion libre puede esperar antes de cerrarla
+        max_uses: numero de tests tras el que se recicla una sesion
+        factory: callable(driver, proxy, min_window_width) que arranca
+                 una sesion. Por defecto WebTest.create_driver
+        """
+        self.max_sessions = max_sessions
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self._factory = factory
+        self._idle = {}       # key -> [_Session, ...]
+        self._borrowed = {}   # id(driver) -> _Session
+        self._starting = 0
+        # Sesiones vivas fuera de _idle y _borrowed: comprobandose al
+        # prestarlas, limpiandose al devolverlas o cerrandose
+        self._in_transit = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+
+    @property
+    def factory(self):
+        if self._factory is None:
+            from .base import WebTest
+            self._factory = WebTest.create_driver
+        return self._factory
+
+    @staticmethod
+    def make_key(driver, proxy=None, min_window_width=None):
+        return (driver, proxy, min_window_width)
+
+    def _live_sessions(self):
+        idle = sum(len(sessions) for sessions in self._idle.values())
+        return idle + len(self._borrowed) + self._starting + self._in_transit
+
+    def _pop_oldest_idle(self):
+        """Saca del pool la sesion libre que lleva mas tiempo sin usarse"""
+        oldest = None
+        for sessions in self._idle.values():
+            for session in sessions:
+                if oldest is None or session.last_used < oldest.last_used:
+                    oldest = session
+        if oldest is not None:
+            self._idle[oldest.key].remove(oldest)
+        return oldest
+
+    def _pop_expired(self):
+        now = time.time()
+        expired = []
+        for key, sessions in self._idle.items():
+            for session in list(sessions):
+                if now - session.last_used > self.max_idle:
+                    sessions.remove(session)
+                    expired.append(session)
+        return expired
+
+    def acquire(self, driver, proxy=None, min_window_width=None, timeout=None):
+        """Devuelve un webdriver listo para usar, reutilizando si es posible"""
+        key = self.make_key(driver, proxy, min_window_width)
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        to_quit = []
+        retry = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Session pool is closed")
+                expired = self._pop_expired()
+                self._in_transit += len(expired)
+                to_quit.extend(expired)
+                sessions = self._idle.get(key)
+                if sessions:
+                    session = sessions.pop()
+                    self._in_transit += 1
+                    break
+                if self._live_sessions() < self.max_sessions:
+                    session = None
+                    self._starting += 1
+                    break
+                # Pool lleno: liberamos una sesion libre de otro tipo
+                victim = self._pop_oldest_idle()
+                if victim is not None:
+                    self._in_transit += 1
+                    to_quit.append(victim)
+                # Las sesiones a cerrar siguen contando hasta cerrarlas:
+                # se cierran fuera del lock y se vuelve a intentar
+                if to_quit:
+                    session = None
+                    retry = True
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        "No free session for {} after {}s".format(key, timeout))
+                self._cond.wait(remaining)
+
+        for old in to_quit:
+            self._discard(old)
+        if retry:
+            return self.acquire(driver, proxy=proxy,
+                min_window_width=min_window_width,
+                timeout=max(0, deadline - time.time()))
+
+        if session is None:
+            try:
+                web_driver = self.factory(driver, proxy=proxy,
+                    min_window_width=min_window_width)
+            except Exception:
+                with self._cond:
+                    self._starting -= 1
+                    self._cond.notify()
+                raise
+            session = _Session(key, web_driver)
+            log.debug("New session for {}".format(key))
+            session.uses += 1
+            with self._cond:
+                self._starting -= 1
+                self._borrowed[id(session.driver)] = session
+            return session.driver
+
+        if not self.is_alive(session.driver):
+            log.warn("Discarding dead session for {}".format(key))
+            self._discard(session)
+            return self.acquire(driver, proxy=proxy,
+                min_window_width=min_window_width,
+                timeout=max(0, deadline - time.time()))
+
+        log.debug("Reusing session for {}".format(key))
+        session.uses += 1
+        with self._cond:
+            self._in_transit -= 1
+            self._borrowed[id(session.driver)] = session
+        return session.driver
+
+    def release(self, driver, broken=False):
+        """Devuelve el webdriver al pool, limpio, o lo cierra si esta roto"""
+        with self._cond:
+            session = self._borrowed.pop(id(driver), None)
+            if session is not None:
+                self._in_transit += 1
+        if session is None:
+            log.warn("Releasing a driver not borrowed from this pool")
+            driver.quit()
+            return
+
+        recycle = (broken or self._closed or
+            (self.max_uses and session.uses >= self.max_uses))
+        if not recycle:
+            try:
+                self.reset(driver)
+            except Exception as e:
+                log.warn("Discarding broken session {}: {}".format(session.key, e))
+                recycle = True
+
+        if recycle:
+            self._discard(session)
+        else:
+            session.last_used = time.time()
+            with self._cond:
+                self._in_transit -= 1
+                self._idle.setdefault(session.key, []).append(session)
+                self._cond.notify()
+
+    def reset(self, driver):
+        """Deja la sesion como nueva: sin cookies, sin storage y en blanco"""
+        driver.delete_all_cookies()
+        try:
+            driver.execute_script(RESET_STORAGE_SCRIPT)
+        except Exception as e:
+            # about:blank o drivers sin javascript no tienen storage
+            log.debug("Could not clear storage: {}".format(e))
+        driver.get("about:blank")
+
+    def is_alive(self, driver):
+        """Comprueba que la sesion sigue respondiendo"""
+        try:
+            driver.current_url
+        except Exception:
+            return False
+        return True
+
+    def evict_idle(self):
+        """Cierra las sesiones libres que han superado max_idle"""
+        with self._cond:
+            expired = self._pop_expired()
+            self._in_transit += len(expired)
+        for session in expired:
+            self._discard(session)
+        return len(expired)
+
+    def _quit(self, session):
+        try:
+            session.driver.quit()
+        except Exception as e:
+            log.debug("Error closing session {}: {}".format(session.key, e))
+
+    def _discard(self, session):
+        """Cierra una sesion contada en _in_transit y deja sitio para otra"""
+        self._quit(session)
+        with self._cond:
+            self._in_transit -= 1
+            self._cond.notify()
+
+    def close(self):
+        """Cierra todas las sesiones libres; las prestadas al devolverse"""
+        with self._cond:
+            self._closed = True
+            sessions = [s for ss in self._idle.values() for s in ss]
+            self._idle.clear()
+            self._in_transit += len(sessions)
+            self._cond.notify_all()
+        for session in sessions:
+            self._discard(session)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'idle': sum(len(s) for s in self._idle.values()),
+                'borrowed': len(self._borrowed),
+                'starting': self._starting,
+                'in_transit': self._in_transit,
+            }
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_session_pool(**kwargs):
+    """Pool compartido por el proceso (se crea la primera vez)"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None or _default_pool._closed:
+            _default_pool = SessionPool(**kwargs)
+            atexit.register(_default_pool.close)
+        return _default_pool
+
+
+if __name__ == "__main__":
+    pass
@@ -1,51 +1,589 @@
-from twisted.web import proxy, http
-from twisted.internet import reactor
-from twisted.python import log
-import sys
-log.startLogging(sys.stdout)
-
-from twisted.web.http import HTTPClient, Request, HTTPChannel
-from twisted.web.proxy import ProxyClientFactory, ProxyRequest
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Proxy HTTP que reescribe hosts.
+
+Sirve para probar los origenes que hay detras de un CDN: las peticiones a
+los hosts de HOST_OVERRIDES se envian a la IP indicada manteniendo la
+cabecera Host. Las conexiones con los origenes se reutilizan (keep-alive) y
+los CONNECT (https) se pasan tal cual, aplicando tambien la reescritura.
+Si hay capturas HAR activas (webtest.har) se apunta cada peticion. Con una
+RequestPolicy (webtest.requestpolicy) bloquea URLs y cachea estaticos.
+
+Uso desde un test:
+
+    class MyTest(WebTest):
+        HOST_OVERRIDES = {'www.example.com': '10.0.0.12'}
+
+o bien `WebTest(proxy=get_proxy({...}))`. Desde consola: `webtest proxy`.
+"""
+
+import atexit
+import logging
+import socket
+import threading
+import time
 import urlparse
 
+from twisted.internet import defer, endpoints, protocol, reactor
+from twisted.internet.abstract import isIPAddress
+from twisted.internet.threads import blockingCallFromThread
+from twisted.web import client, http
+from twisted.web.error import SchemeNotSupported
+from twisted.web.http_headers import Headers
+
+from webtest.har import HarRecorder, make_entry
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8088
+DEFAULT_INTERFACE = '127.0.0.1'
+DEFAULT_MAX_PER_HOST = 8
+DEFAULT_KEEPALIVE = 120
+DEFAULT_CONNECT_TIMEOUT = 10
+
+HOP_BY_HOP = frozenset(['connection', 'keep-alive', 'proxy-connection',
+    'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+    'transfer-encoding', 'upgrade'])
+
+
+def resolve_host(host_overrides, host):
+    """IP a la que enviar `host`; '.example.com' vale para sus subdominios"""
+    target = host_overrides.get(host)
+    if target is not None:
+        return target
+    for pattern, target in host_overrides.iteritems():
+        if pattern.startswith('.') and (host.endswith(pattern) or host == pattern[1:]):
+            return target
+    return host
+
+
+def reachable_host(url):
+    """
+    IP local por la que sale el trafico hacia `url`: la que puede usar un
+    navegador remoto (hub en `url`) para llegar a un proxy en esta maquina
+    """
+    host = urlparse.urlsplit(url or '').hostname
+    if not host:
+        raise ValueError("Cannot find the remote browser host in {!r}; "
+            "set public_host in PROXY_ARGS".format(url))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # UDP no envia nada al conectar, solo elige la ruta
+        sock.connect((host, 9))
+        return sock.getsockname()[0]
+    except socket.error as e:
+        raise ValueError("Cannot find a local address reachable from {}: {}; "
+            "set public_host in PROXY_ARGS".format(host, e))
+    finally:
+        sock.close()
+
+
+class OverrideEndpointFactory(object):
+    """Endpoints hacia la IP reescrita; el pool de conexiones se agrupa por host"""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def endpointForURI(self, uri):
+        if uri.scheme != 'http':
+            raise SchemeNotSupported("Unsupported scheme: {}".format(uri.scheme))
+        return endpoints.TCP4ClientEndpoint(reactor,
+            self.factory.resolve(uri.host), uri.port,
+            timeout=self.factory.connect_timeout)
+
+
+def _ms(start, end=None):
+    return int(round(((end or time.time()) - start) * 1000))
+
+
+class _TimedEndpoint(object):
+    """Como TCP4ClientEndpoint, pero apunta dns y connect en `timings` (ms)"""
+
+    def __init__(self, host, port, timeout, timings):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.timings = timings
+
+    def connect(self, protocolFactory):
+        start = time.time()
+        lookup = not isIPAddress(self.host)
+        d = reactor.resolve(self.host) if lookup else defer.succeed(self.host)
+
+        def resolved(ip):
+            if lookup:
+                self.timings['dns'] = _ms(start)
+            connect_start = time.time()
+            endpoint = endpoints.TCP4ClientEndpoint(reactor, ip, self.port, timeout=self.timeout)
+            return endpoint.connect(protocolFactory).addCallback(connected, connect_start)
+
+        def connected(result, connect_start):
+            self.timings['connect'] = _ms(connect_start)
+            return result
+
+        return d.addCallback(resolved)
+
+
+class TimedEndpointFactory(OverrideEndpointFactory):
+    """Endpoints de una sola peticion que registran sus tiempos"""
+
+    def __init__(self, factory, timings):
+        OverrideEndpointFactory.__init__(self, factory)
+        self.timings = timings
+
+    def endpointForURI(self, uri):
+        if uri.scheme != 'http':
+            raise SchemeNotSupported("Unsupported scheme: {}".format(uri.scheme))
+        return _TimedEndpoint(self.factory.resolve(uri.host), uri.port,
+            self.factory.connect_timeout, self.timings)
+
+
+class _Relay(protocol.Protocol):
+    """Pasa el cuerpo de la respuesta del origen al navegador"""
+
+    def __init__(self, request):
+        self.request = request
+
+    def dataReceived(self, data):
+        if self.request.gone:
+            self.transport.stopProducing()
+            return
+        self.request.body_size += len(data)
+        self.request.keep_for_cache(data)
+        self.request.write(data)
+
+    def connectionLost(self, reason):
+        if self.request.gone:
+            self.request.record(error="client gone")
+            return
+        if reason.check(client.ResponseDone, http.PotentialDataLoss):
+            self.request.store_in_cache()
+            self.request.record()
+            self.request.finish()
+        else:
+            log.warn("Upstream body for {} truncated: {}".format(
+                self.request.uri, reason.getErrorMessage()))
+            self.request.record(error=reason.getErrorMessage())
+            self.request.channel.transport.loseConnection()
+
+
+class _Tunnel(protocol.Protocol):
+    """Extremo hacia el origen de un CONNECT"""
+
+    def __init__(self, request):
+        self.request = request
+        self.channel = request.channel
+
+    def connectionMade(self):
+        self.request.timings['connect'] = _ms(self.request.started)
+        self.request.response_started = time.time()
+        self.channel.tunnel = self
+        self.channel.setTimeout(None)
+        self.channel.transport.write("HTTP/1.1 200 Connection established\r\n\r\n")
+
+    def dataReceived(self, data):
+        self.request.body_size += len(data)
+        self.channel.transport.write(data)
+
+    def connectionLost(self, reason):
+        self.request.record()
+        self.channel.transport.loseConnection()
+
+
+class RewritingProxyRequest(http.Request):
 
-class IPProxyRequest(ProxyRequest):
+    gone = False
+    upstream = None         # (codigo, frase, cabeceras)
+    content_length = 0
+    response_started = None
+    cache_key = None
+    cache_chunks = None
 
     def process(self):
-        parsed = urlparse.urlparse(self.uri)
-        protocol = parsed[0]
-        host = parsed[1]
-        port = self.ports[protocol]
-        if ':' in host:
-            host, port = host.split(':')
-            port = int(port)
-        rest = urlparse.urlunparse(('', '') + parsed[2:])
-        if not rest:
-            rest = rest + '/'
-        class_ = self.protocols[protocol]
-        headers = self.getAllHeaders().copy()
-        if 'host' not in headers:
-            headers['host'] = host
+        self.notifyFinish().addErrback(self._client_gone)
+        self.started = time.time()
+        self.body_size = 0
+        self.timings = {}
+        recorder = self.channel.factory.recorder
+        self.har_pages = None
+        if recorder.active:
+            self.har_pages = recorder.pages(self.channel.transport.getHost().port)
+        policy = self.channel.factory.policy
+        if policy is not None and policy.blocked(self.target_url()):
+            self.respond(http.NO_CONTENT, "No Content", [], "", note='blocked')
+            return
+        if self.method == 'CONNECT':
+            self.process_connect()
+        else:
+            self.process_http()
+
+    def _client_gone(self, reason):
+        self.gone = True
+
+    def target_url(self):
+        if self.method == 'CONNECT':
+            return "https://{}/".format(self.uri)
+        return self.uri
+
+    def respond(self, code, phrase, headers, body, note):
+        """Respuesta generada por el propio proxy (bloqueo o cache)"""
+        self.upstream = (code, phrase, headers)
+        self.response_started = time.time()
+        self.setResponseCode(code, phrase)
+        for name, values in headers:
+            self.responseHeaders.setRawHeaders(name, values)
+        self.setHeader('x-webtest-proxy', note)
+        self.setHeader('content-length', str(len(body)))
+        if body:
+            self.write(body)
+        self.body_size = len(body)
+        self.record(note=note)
+        self.finish()
+
+    def keep_for_cache(self, data):
+        if self.cache_chunks is None:
+            return
+        self.cache_chunks.append(data)
+        if self.body_size > self.channel.factory.policy.cache.max_item_bytes:
+            self.cache_chunks = None
+
+    def store_in_cache(self):
+        if self.cache_chunks is None:
+            return
+        policy = self.channel.factory.policy
+        code, phrase, headers = self.upstream
+        headers = [(name, values) for name, values in policy.cached_headers(headers)
+            if name.lower() not in HOP_BY_HOP]
+        policy.cache.put(self.cache_key, (code, phrase, headers, "".join(self.cache_chunks)),
+            self.cache_ttl)
+        self.cache_chunks = None
+
+    def record(self, error=None, note=None):
+        """Entrada HAR para las capturas activas al empezar la peticion"""
+        if not self.har_pages:
+            return
+        now = time.time()
+        url = self.target_url()
+        if self.method == 'CONNECT':
+            host = self.uri.rpartition(':')[0]
+        else:
+            host = self.getRequestHostname()
+        timings = dict(self.timings)
+        if self.response_started is not None:
+            timings['wait'] = max(0, _ms(self.started, self.response_started)
+                - max(0, timings.get('dns', 0)) - max(0, timings.get('connect', 0)))
+            timings['receive'] = _ms(self.response_started, now)
+        elif error:
+            timings['wait'] = _ms(self.started, now)
+        if self.upstream is not None:
+            code, phrase, headers = self.upstream
+        elif self.method == 'CONNECT' and not error:
+            code, phrase, headers = 200, "Connection established", []
+        else:
+            code, phrase, headers = 0, "", []
+        entry = make_entry(self.started, self.method, url, self.clientproto,
+            list(self.requestHeaders.getAllRawHeaders()), self.content_length,
+            code, phrase, headers, self.body_size, timings, host, error=error)
+        if note:
+            entry['_proxy'] = note
+        self.channel.factory.recorder.add(self.har_pages, entry)
+        self.har_pages = None
+
+    def _fail(self, failure):
+        self.record(error=failure.getErrorMessage())
+        if self.gone:
+            return
+        log.warn("Proxy error for {} {}: {}".format(self.method, self.uri,
+            failure.getErrorMessage()))
+        if self.startedWriting:
+            self.channel.transport.loseConnection()
+            return
+        self.setResponseCode(http.BAD_GATEWAY)
+        self.setHeader('content-type', 'text/plain')
+        self.write("Proxy error: {}".format(failure.getErrorMessage()))
+        self.finish()
+
+    def process_connect(self):
+        host, _, port = self.uri.rpartition(':')
+        if not host or not port.isdigit():
+            self.setResponseCode(http.BAD_REQUEST)
+            self.finish()
+            return
+        factory = self.channel.factory
+        endpoint = endpoints.TCP4ClientEndpoint(reactor, factory.resolve(host),
+            int(port), timeout=factory.connect_timeout)
+        self.content_length = 0
+        endpoints.connectProtocol(endpoint, _Tunnel(self)).addErrback(self._fail)
+
+    def process_http(self):
+        if not self.uri.startswith('http://'):
+            self.setResponseCode(http.BAD_REQUEST)
+            self.write("Only absolute http:// URIs are proxied")
+            self.finish()
+            return
+        headers = Headers()
+        for name, values in self.requestHeaders.getAllRawHeaders():
+            if name.lower() not in HOP_BY_HOP:
+                headers.setRawHeaders(name, values)
+        self.content.seek(0, 2)
+        self.content_length = self.content.tell()
         self.content.seek(0, 0)
-        s = self.content.read()
-        clientFactory = class_(self.method, rest, self.clientproto, headers,
-                               s, self)
+        factory = self.channel.factory
+        if factory.policy is not None:
+            self.cache_key = factory.policy.cache_key(self.method, self.uri,
+                headers.getAllRawHeaders(),
+                resolve_host(factory.host_overrides, urlparse.urlsplit(self.uri).hostname or ''))
+            if self.cache_key is not None:
+                cached = factory.policy.cache.get(self.cache_key)
+                if cached is not None:
+                    self.respond(*cached, note='cache')
+                    return
+        body = client.FileBodyProducer(self.content) if self.content_length else None
+        agent = factory.timed_agent(self.timings) if self.har_pages else factory.agent
+        d = agent.request(self.method, self.uri, headers, body)
+        d.addCallback(self._response)
+        d.addErrback(self._fail)
+
+    def _response(self, response):
+        self.response_started = time.time()
+        self.upstream = (response.code, response.phrase,
+            list(response.headers.getAllRawHeaders()))
+        if self.cache_key is not None:
+            self.cache_ttl = self.channel.factory.policy.response_ttl(response.code, self.upstream[2])
+            if self.cache_ttl:
+                self.cache_chunks = []
+        if self.gone:
+            self.record(error="client gone")
+            response.deliverBody(protocol.Protocol())
+            return
+        self.setResponseCode(response.code, response.phrase)
+        for name, values in response.headers.getAllRawHeaders():
+            if name.lower() not in HOP_BY_HOP:
+                self.responseHeaders.setRawHeaders(name, values)
+        if self.method == 'HEAD' or response.code in (http.NO_CONTENT, http.NOT_MODIFIED):
+            response.deliverBody(protocol.Protocol())
+            self.record()
+            self.finish()
+            return
+        response.deliverBody(_Relay(self))
+
+
+class RewritingProxyChannel(http.HTTPChannel):
+    requestFactory = RewritingProxyRequest
+    tunnel = None
+
+    def dataReceived(self, data):
+        if self.tunnel is not None:
+            self.tunnel.transport.write(data)
+        else:
+            http.HTTPChannel.dataReceived(self, data)
+
+    def connectionLost(self, reason):
+        if self.tunnel is not None:
+            self.tunnel.transport.loseConnection()
+        http.HTTPChannel.connectionLost(self, reason)
+
+
+class RewritingProxyFactory(http.HTTPFactory):
+    protocol = RewritingProxyChannel
+
+    def __init__(self, host_overrides=None, max_per_host=DEFAULT_MAX_PER_HOST,
+            keepalive=DEFAULT_KEEPALIVE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+            policy=None):
+        """policy: webtest.requestpolicy.RequestPolicy (bloqueos y cache)"""
+        http.HTTPFactory.__init__(self)
+        self.host_overrides = dict(host_overrides or {})
+        self.policy = policy
+        self.connect_timeout = connect_timeout
+        self.pool = client.HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = max_per_host
+        self.pool.cachedConnectionTimeout = keepalive
+        self.pool.retryAutomatically = True
+        self.agent = client.Agent.usingEndpointFactory(reactor,
+            OverrideEndpointFactory(self), pool=self.pool)
+        self.recorder = HarRecorder()
+
+    def timed_agent(self, timings):
+        """Agent de una peticion que se esta grabando; comparte el pool"""
+        return client.Agent.usingEndpointFactory(reactor,
+            TimedEndpointFactory(self, timings), pool=self.pool)
+
+    def resolve(self, host):
+        target = resolve_host(self.host_overrides, host)
+        if target != host:
+            log.debug("{} -> {}".format(host, target))
+        return target
+
+    def log(self, request):
+        # Sin log de accesos por peticion
+        pass
+
+
+_reactor_lock = threading.Lock()
+_reactor_thread = None
+
+
+def start_reactor():
+    """Arranca el reactor de twisted en un hilo si no esta ya en marcha"""
+    global _reactor_thread
+    with _reactor_lock:
+        if reactor.running or _reactor_thread is not None:
+            return
+        started = threading.Event()
+        reactor.callWhenRunning(started.set)
+        _reactor_thread = threading.Thread(target=reactor.run,
+            kwargs={'installSignalHandlers': False}, name="webtest-reactor")
+        _reactor_thread.daemon = True
+        _reactor_thread.start()
+        started.wait()
+
+
+def _in_reactor(func, *args, **kwargs):
+    if _reactor_thread is not None and threading.current_thread() is not _reactor_thread:
+        return blockingCallFromThread(reactor, func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
+class RewritingProxy(object):
+    """
+    Proxy en segundo plano. Se puede pasar como WebTest(proxy=...): se usa
+    su `address` ("host:puerto").
+
+    port: 0 = puerto libre cualquiera
+    public_host: nombre con el que lo ve el navegador (p.ej. si es remoto y
+                 se escucha en 0.0.0.0)
+    """
+
+    def __init__(self, host_overrides=None, port=0, interface=DEFAULT_INTERFACE,
+            public_host=None, **factory_kwargs):
+        self.factory = RewritingProxyFactory(host_overrides, **factory_kwargs)
+        self.port = port
+        self.interface = interface
+        self.public_host = public_host
+        self._listening = None
+        self._ports_lock = threading.Lock()
+        self._leased = {}       # puerto -> listener
+        self._free_ports = []
+
+    @property
+    def host_overrides(self):
+        return self.factory.host_overrides
+
+    @property
+    def recorder(self):
+        return self.factory.recorder
+
+    def set_host_overrides(self, host_overrides):
+        self.factory.host_overrides = dict(host_overrides)
+
+    def listen(self):
+        """Empieza a escuchar; el reactor lo tiene que arrancar quien llama"""
+        self._listening = reactor.listenTCP(self.port, self.factory,
+            interface=self.interface)
+        return self
+
+    def start(self):
+        start_reactor()
+        _in_reactor(self.listen)
+        log.info("Proxy listening on {}".format(self.address))
+        return self
+
+    def lease_port(self):
+        """
+        Puerto propio en este proxy para un test: las capturas HAR abiertas
+        con ese puerto solo ven sus peticiones. Se devuelve con release_port
+        """
+        with self._ports_lock:
+            if self._free_ports:
+                return self._free_ports.pop()
+        listening = _in_reactor(reactor.listenTCP, 0, self.factory,
+            interface=self.interface)
+        port = listening.getHost().port
+        with self._ports_lock:
+            self._leased[port] = listening
+        return port
+
+    def release_port(self, port):
+        with self._ports_lock:
+            if port in self._leased and port not in self._free_ports:
+                self._free_ports.append(port)
+
+    def _stop(self):
+        d = self.factory.pool.closeCachedConnections()
+        if self._listening is not None:
+            self._listening.stopListening()
+            self._listening = None
+        with self._ports_lock:
+            leased = list(self._leased.values())
+            self._leased.clear()
+            self._free_ports = []
+        for listening in leased:
+            listening.stopListening()
+        return d
+
+    def stop(self):
+        if self._listening is not None and reactor.running:
+            _in_reactor(self._stop)
+
+    @property
+    def address(self):
+        if self._listening is None:
+            raise RuntimeError("Proxy not started")
+        return self.address_for(self._listening.getHost().port)
+
+    def address_for(self, port):
+        """"host:puerto" con el que el navegador llega a `port`"""
+        host = self.public_host
+        if host is None:
+            host = self.interface
+            if host in ('', '0.0.0.0'):
+                host = socket.getfqdn()
+        return "{}:{}".format(host, port)
+
+    def __str__(self):
+        return self.address
+
+
+_proxies = {}
+_proxies_lock = threading.Lock()
 
-        if "host1" in host or "host2" in host:
-            print("CHANGE")
-            #host = "ip1"
-            host = "ip2" 
 
-        self.reactor.connectTCP(host, port, clientFactory)
+def get_proxy(host_overrides, **kwargs):
+    """Proxy compartido en segundo plano para un mapa de hosts"""
+    key = repr((sorted(host_overrides.items()), sorted(kwargs.items())))
+    with _proxies_lock:
+        proxy = _proxies.get(key)
+        if proxy is None:
+            proxy = _proxies[key] = RewritingProxy(host_overrides, **kwargs).start()
+        return proxy
 
 
-class IPProxy(HTTPChannel):
-    requestFactory = IPProxyRequest
+@atexit.register
+def stop_proxies():
+    with _proxies_lock:
+        proxies = list(_proxies.values())
+        _proxies.clear()
+    for proxy in proxies:
+        try:
+            proxy.stop()
+        except Exception:
+            log.exception("Error stopping proxy")
+    if _reactor_thread is not None and reactor.running:
+        reactor.callFromThread(reactor.stop)
+        _reactor_thread.join(DEFAULT_CONNECT_TIMEOUT)
 
 
-class IPProxyFactory(http.HTTPFactory):
-    protocol = IPProxy
+def serve(host_overrides=None, port=DEFAULT_PORT, interface='', **kwargs):
+    """Proxy en primer plano (webtest proxy)"""
+    proxy = RewritingProxy(host_overrides, port=port, interface=interface,
+        **kwargs).listen()
+    log.info("Proxy listening on {} with {}".format(proxy.address,
+        proxy.host_overrides or "no host overrides"))
+    reactor.run()
 
 
-reactor.listenTCP(8088, IPProxyFactory())
-#reactor.listenUnix("/tmp/ps", IPProxyFactory())
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve()
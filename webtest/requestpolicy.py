@@ -0,0 +1,165 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Politica de peticiones del proxy en modo "origin only".
+
+Para medir solo el origen se bloquean las URLs de terceros (analitica,
+publicidad, fuentes...), que el proxy contesta con un 204 vacio, y los
+estaticos inmutables se sirven desde una cache local compartida por todos
+los tests del proceso, limitada en bytes y con expulsion LRU. La clave
+incluye el origen al que el proxy envia la peticion, para que tests con
+distintos HOST_OVERRIDES para un mismo host no compartan estaticos.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_BLOCK_URLS = (
+    r"google-analytics\.com",
+    r"googletagmanager\.com",
+    r"googleadservices\.com",
+    r"doubleclick\.net",
+    r"googlesyndication\.com",
+    r"connect\.facebook\.net",
+    r"hotjar\.com",
+    r"fonts\.(googleapis|gstatic)\.com",
+)
+DEFAULT_CACHE_BYTES = 128 * 1024 * 1024
+DEFAULT_MAX_ITEM_BYTES = 8 * 1024 * 1024
+# Sin max-age, cuanto se guarda un estatico (s)
+DEFAULT_TTL = 3600
+
+STATIC_EXTENSIONS = frozenset(['js', 'css', 'png', 'jpg', 'jpeg', 'gif',
+    'svg', 'webp', 'ico', 'woff', 'woff2', 'ttf', 'otf', 'eot', 'mp4', 'webm'])
+# Cabeceras de respuesta que no se guardan en cache
+UNCACHED_HEADERS = frozenset(['date', 'age', 'set-cookie'])
+
+_max_age_re = re.compile(r"max-age=(\d+)")
+
+
+class AssetCache(object):
+    """Cache LRU en memoria de respuestas estaticas, limitada en bytes"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, max_item_bytes=DEFAULT_MAX_ITEM_BYTES):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(codigo, frase, cabeceras, cuerpo) o None"""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    self.size -= len(item[1][3])
+                self.misses += 1
+                return None
+            self._items[key] = item
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, response, ttl):
+        body = response[3]
+        if len(body) > self.max_item_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1][3])
+            self._items[key] = (time.time() + ttl, response)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.size -= len(evicted[3])
+
+    def stats(self):
+        with self._lock:
+            return {'items': len(self._items), 'bytes': self.size,
+                'hits': self.hits, 'misses': self.misses}
+
+
+_asset_cache = None
+_asset_cache_lock = threading.Lock()
+
+
+def get_asset_cache():
+    """Cache de estaticos compartida por todo el proceso"""
+    global _asset_cache
+    with _asset_cache_lock:
+        if _asset_cache is None:
+            _asset_cache = AssetCache()
+        return _asset_cache
+
+
+class RequestPolicy(object):
+    """
+    Que hace el proxy con cada peticion.
+
+    block: expresiones regulares sobre la URL; las que casan reciben un 204
+    cache: True para usar la cache compartida, o un AssetCache
+    """
+
+    def __init__(self, block=DEFAULT_BLOCK_URLS, cache=True):
+        self.block_patterns = tuple(block or ())
+        self._block_re = re.compile("|".join("(?:{})".format(p) for p in self.block_patterns)) \
+            if self.block_patterns else None
+        self.cache = get_asset_cache() if cache is True else (cache or None)
+
+    def __repr__(self):
+        # Estable para que get_proxy reutilice el proxy de una misma politica
+        return "RequestPolicy(block={!r}, cache={})".format(self.block_patterns,
+            'shared' if self.cache is _asset_cache else id(self.cache) if self.cache else None)
+
+    def blocked(self, url):
+        return self._block_re is not None and self._block_re.search(url) is not None
+
+    def cache_key(self, method, url, request_headers, origin=None):
+        """
+        Clave de cache para una peticion o None si no es cacheable.
+        origin: host o IP a la que se envia de verdad (HOST_OVERRIDES)
+        """
+        if self.cache is None or method != 'GET':
+            return None
+        path = url.split('?', 1)[0]
+        extension = path.rpartition('.')[2].lower() if '.' in path.rpartition('/')[2] else ''
+        if extension not in STATIC_EXTENSIONS:
+            return None
+        accept_encoding = ''
+        for name, values in request_headers:
+            if name.lower() == 'accept-encoding':
+                accept_encoding = ','.join(values)
+            elif name.lower() in ('authorization', 'range'):
+                return None
+        return url, origin, accept_encoding
+
+    def response_ttl(self, code, headers):
+        """Segundos que se puede guardar la respuesta o None"""
+        if code != 200:
+            return None
+        cache_control = ''
+        for name, values in headers:
+            lower = name.lower()
+            if lower == 'cache-control':
+                cache_control = ','.join(values).lower()
+            elif lower == 'set-cookie':
+                return None
+            elif lower == 'vary' and any(v.strip().lower() not in ('accept-encoding', '')
+                    for v in ','.join(values).split(',')):
+                return None
+        if 'no-store' in cache_control or 'no-cache' in cache_control or 'private' in cache_control:
+            return None
+        match = _max_age_re.search(cache_control)
+        if match:
+            return int(match.group(1)) or None
+        return DEFAULT_TTL
+
+    def cached_headers(self, headers):
+        return [(name, values) for name, values in headers
+            if name.lower() not in UNCACHED_HEADERS]
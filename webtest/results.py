@@ -0,0 +1,464 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Almacen local de resultados.
+
+Guarda los tiempos de cada step en un log binario de solo añadir, por
+columnas, para poder consultarlos sin influx (`webtest stats`) y para servir
+de buffer cuando influx no responde.
+
+Estructura de RESULTS_PATH:
+
+    series.txt          nombre de serie por linea; el id es el numero de linea
+    000001.time         float64 por fila (epoch)
+    000001.elapsed      float32 por fila (segundos)
+    000001.series       uint32 por fila (id de serie)
+    000001.flags        uint8 por fila (1 = error)
+    000001.uid          16 bytes por fila (test_uid)
+    000001.errors       json por linea [fila, error] de las filas con error
+    000001.unsorted     existe si alguna fila llego fuera de orden de tiempo
+    000002.time ...     segmento siguiente al superar SEGMENT_ROWS filas
+    .lock               flock para escribir desde varios procesos
+
+Las lecturas usan mmap y busqueda binaria sobre la columna time; en los
+segmentos marcados como desordenados (escrituras concurrentes o filas
+reenviadas tarde) se filtra fila a fila.
+"""
+
+import array
+import binascii
+import fcntl
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from webtest.histogram import Histogram
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RESULTS_PATH = os.path.expanduser("~/.webtest/results")
+SEGMENT_ROWS = 1000000
+SERIES_FILE = "series.txt"
+CURSOR_FILE = "replay.cursor"
+ERRORS_SUFFIX = "errors"
+UNSORTED_SUFFIX = "unsorted"
+
+# columna -> (typecode de array, bytes por fila)
+COLUMNS = (
+    ('time', 'd', 8),
+    ('elapsed', 'f', 4),
+    ('series', 'I', 4),
+    ('flags', 'B', 1),
+    ('uid', None, 16),
+)
+FLAG_ERROR = 1
+
+_segment_re = re.compile(r"^(\d{6})\.time$")
+
+
+class Row(object):
+    __slots__ = ('time', 'series', 'elapsed', 'error', 'test_uid')
+
+    def __init__(self, time, series, elapsed, error, test_uid):
+        self.time = time
+        self.series = series
+        self.elapsed = elapsed
+        self.error = error
+        self.test_uid = test_uid
+
+
+def _uid_bytes(test_uid):
+    try:
+        # Mas rapido que uuid.UUID para el formato habitual de uuid1()
+        return binascii.unhexlify(test_uid.replace("-", ""))[:16].ljust(16, "\0")
+    except (AttributeError, TypeError, binascii.Error):
+        return "\0" * 16
+
+
+class ResultsStore(object):
+    """Log de tiempos por serie, por columnas y de solo añadir"""
+
+    def __init__(self, path=DEFAULT_RESULTS_PATH, segment_rows=SEGMENT_ROWS):
+        self.path = path
+        self.segment_rows = segment_rows
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._series = []
+        self._series_ids = {}
+        self._series_size = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """Exclusion entre hilos y entre procesos"""
+        with self._lock:
+            with open(os.path.join(self.path, ".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _column_path(self, segment, column):
+        return os.path.join(self.path, "{:06d}.{}".format(segment, column))
+
+    def segments(self):
+        return sorted(int(m.group(1)) for m in
+            (_segment_re.match(name) for name in os.listdir(self.path)) if m)
+
+    def _load_series(self):
+        """Lee los nombres de serie añadidos (tambien por otros procesos)"""
+        series_path = os.path.join(self.path, SERIES_FILE)
+        if not os.path.exists(series_path):
+            return
+        size = os.path.getsize(series_path)
+        if size == self._series_size:
+            return
+        with open(series_path) as f:
+            f.seek(self._series_size)
+            data = f.read(size - self._series_size)
+        complete = data[:data.rfind("\n") + 1]
+        for name in complete.splitlines():
+            self._series_ids[name] = len(self._series)
+            self._series.append(name)
+        self._series_size += len(complete)
+
+    def _series_id(self, name):
+        series_id = self._series_ids.get(name)
+        if series_id is None:
+            self._load_series()
+            series_id = self._series_ids.get(name)
+        if series_id is None:
+            with open(os.path.join(self.path, SERIES_FILE), "a") as f:
+                f.write(name + "\n")
+            self._load_series()
+            series_id = self._series_ids[name]
+        return series_id
+
+    def series_names(self):
+        with self._lock:
+            self._load_series()
+            return list(self._series)
+
+    def _rows(self, segment):
+        """Filas completas del segmento (la columna mas corta manda)"""
+        return min(os.path.getsize(self._column_path(segment, column)) // size
+            if os.path.exists(self._column_path(segment, column)) else 0
+            for column, _, size in COLUMNS)
+
+    def _last_time(self, segment, count):
+        if not count:
+            return None
+        with open(self._column_path(segment, 'time'), "rb") as f:
+            f.seek((count - 1) * 8)
+            return struct.unpack("d", f.read(8))[0]
+
+    def _truncate(self, segment, count):
+        """
+        Deja todas las columnas en `count` filas: un append que fallo a
+        medias (disco lleno, proceso muerto) no desalinea las siguientes
+        """
+        truncated = False
+        for column, _, size in COLUMNS:
+            path = self._column_path(segment, column)
+            if os.path.exists(path) and os.path.getsize(path) > count * size:
+                with open(path, "r+b") as f:
+                    f.truncate(count * size)
+                truncated = True
+        if truncated:
+            errors = self._errors(segment)
+            with open(self._column_path(segment, ERRORS_SUFFIX), "w") as f:
+                for row in sorted(errors):
+                    if row < count:
+                        f.write(json.dumps([row, errors[row]]) + "\n")
+            log.warn("Discarded a partial append in {}".format(
+                self._column_path(segment, "*")))
+
+    def append(self, rows):
+        """
+        rows: [(time, series, elapsed, error, test_uid), ...]
+        error: False/True o el texto (html) del error, que se guarda aparte
+        """
+        if not rows:
+            return
+        with self._locked():
+            segments = self.segments()
+            segment = segments[-1] if segments else 1
+            count = self._rows(segment) if segments else 0
+            if count >= self.segment_rows:
+                segment += 1
+                count = 0
+            self._truncate(segment, count)
+            columns = dict((column, array.array(typecode) if typecode else [])
+                for column, typecode, _ in COLUMNS)
+            errors = []
+            last = self._last_time(segment, count)
+            ordered = True
+            for index, (timestamp, series, elapsed, error, test_uid) in enumerate(rows):
+                if last is not None and timestamp < last:
+                    ordered = False
+                last = timestamp
+                columns['time'].append(timestamp)
+                columns['elapsed'].append(elapsed)
+                columns['series'].append(self._series_id(series))
+                columns['flags'].append(FLAG_ERROR if error else 0)
+                columns['uid'].append(_uid_bytes(test_uid))
+                if isinstance(error, basestring) and error:
+                    errors.append(json.dumps([count + index, error]))
+            if not ordered:
+                # Sin busqueda binaria en este segmento a partir de ahora
+                open(self._column_path(segment, UNSORTED_SUFFIX), "a").close()
+            for column, typecode, _ in COLUMNS:
+                values = columns[column]
+                with open(self._column_path(segment, column), "ab") as f:
+                    f.write(values.tostring() if typecode else "".join(values))
+            if errors:
+                with open(self._column_path(segment, ERRORS_SUFFIX), "a") as f:
+                    f.write("\n".join(errors) + "\n")
+
+    def _ordered(self, segment):
+        return not os.path.exists(self._column_path(segment, UNSORTED_SUFFIX))
+
+    def _errors(self, segment):
+        """{fila: texto del error} del segmento"""
+        errors = {}
+        try:
+            with open(self._column_path(segment, ERRORS_SUFFIX)) as f:
+                for line in f:
+                    try:
+                        row, error = json.loads(line)
+                    except ValueError:
+                        continue
+                    errors[row] = error
+        except IOError:
+            pass
+        return errors
+
+    def _bisect(self, times, count, value):
+        """Primera fila con time >= value en la columna mapeada"""
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            if struct.unpack_from("d", times, mid * 8)[0] < value:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _read(self, segment, column, typecode, size, start, stop):
+        with open(self._column_path(segment, column), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                data = mapped[start * size:stop * size]
+            finally:
+                mapped.close()
+        if typecode is None:
+            return [data[i:i + 16] for i in xrange(0, len(data), 16)]
+        values = array.array(typecode)
+        values.fromstring(data)
+        return values
+
+    def _ranges(self, since=None, until=None, start=None):
+        """
+        (segmento, fila inicial, fila final, ordenado) dentro del rango de
+        tiempo; en los segmentos desordenados es el segmento entero
+        """
+        for segment in self.segments():
+            if start and segment < start[0]:
+                continue
+            count = self._rows(segment)
+            first = start[1] if start and segment == start[0] else 0
+            if not count or first >= count:
+                continue
+            if not self._ordered(segment):
+                yield segment, first, count, False
+                continue
+            with open(self._column_path(segment, 'time'), "rb") as f:
+                times = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    lo = max(first, self._bisect(times, count, since)) if since else first
+                    hi = self._bisect(times, count, until) if until else count
+                finally:
+                    times.close()
+            if lo < hi:
+                yield segment, lo, hi, True
+
+    def scan_columns(self, since=None, until=None, with_uid=False, start=None):
+        """
+        Genera bloques (segmento, fila inicial, times, elapsed, series_ids, flags[, uids])
+        con arrays por columna; es la forma rapida de recorrer millones de filas.
+        En segmentos desordenados con since/until el bloque trae solo las
+        filas del rango y la fila inicial deja de ser contigua.
+        """
+        for segment, lo, hi, ordered in self._ranges(since, until, start):
+            block = [segment, lo]
+            for column, typecode, size in COLUMNS:
+                if column == 'uid' and not with_uid:
+                    continue
+                block.append(self._read(segment, column, typecode, size, lo, hi))
+            if not ordered and (since or until):
+                times = block[2]
+                keep = [i for i in xrange(len(times))
+                    if (not since or times[i] >= since) and (not until or times[i] < until)]
+                if not keep:
+                    continue
+                block[2:] = [array.array(values.typecode, (values[i] for i in keep))
+                    if isinstance(values, array.array) else [values[i] for i in keep]
+                    for values in block[2:]]
+            yield tuple(block)
+
+    def scan(self, since=None, until=None, series=None):
+        """Genera Row para cada fila en el rango (series: conjunto de nombres)"""
+        names = self.series_names()
+        wanted = None
+        if series is not None:
+            wanted = set(i for i, name in enumerate(names) if name in series)
+        for _, _, times, elapsed, ids, flags, uids in self.scan_columns(since, until, with_uid=True):
+            for i in xrange(len(times)):
+                if wanted is not None and ids[i] not in wanted:
+                    continue
+                yield Row(times[i], names[ids[i]], elapsed[i], bool(flags[i] & FLAG_ERROR),
+                    str(uuid.UUID(bytes=uids[i])))
+
+    def summarize(self, since=None, until=None, match=None, bucket=None):
+        """
+        Histograma por serie (y por intervalo de `bucket` segundos si se pide).
+        match: expresion regular sobre el nombre de serie.
+        Devuelve {serie: {'all': Histogram, 'errors': n, 'buckets': {inicio: Histogram}}}
+        """
+        names = self.series_names()
+        pattern = re.compile(match) if match else None
+        wanted = set(i for i, name in enumerate(names)
+            if pattern is None or pattern.search(name))
+        result = defaultdict(lambda: {'all': Histogram(), 'errors': 0,
+            'buckets': defaultdict(Histogram)})
+        for _, _, times, elapsed, ids, flags in self.scan_columns(since, until):
+            for timestamp, series_id, value, flag in zip(times, ids, elapsed, flags):
+                if series_id not in wanted:
+                    continue
+                entry = result[names[series_id]]
+                if flag & FLAG_ERROR:
+                    entry['errors'] += 1
+                    continue
+                entry['all'].record(value)
+                if bucket:
+                    entry['buckets'][timestamp - timestamp % bucket].record(value)
+        return dict(result)
+
+    def _read_cursor(self):
+        try:
+            with open(os.path.join(self.path, CURSOR_FILE)) as f:
+                segment, row = f.read().split()
+                return int(segment), int(row)
+        except (IOError, ValueError):
+            return None
+
+    def _write_cursor(self, segment, row):
+        cursor_path = os.path.join(self.path, CURSOR_FILE)
+        with open(cursor_path + ".tmp", "w") as f:
+            f.write("{} {}".format(segment, row))
+        os.rename(cursor_path + ".tmp", cursor_path)
+
+    def replay(self, client, batch_size=5000):
+        """
+        Envia a influx (client.write_points) las filas que aun no se han
+        enviado y avanza el cursor; devuelve el numero de filas enviadas.
+        """
+        names = self.series_names()
+        sent = 0
+        for segment, lo, times, elapsed, ids, flags, uids in self.scan_columns(
+                start=self._read_cursor(), with_uid=True):
+            error_texts = self._errors(segment)
+            for offset in xrange(0, len(times), batch_size):
+                ok = defaultdict(list)
+                errors = defaultdict(list)
+                for i in xrange(offset, min(offset + batch_size, len(times))):
+                    row = [times[i], elapsed[i], str(uuid.UUID(bytes=uids[i]))]
+                    if flags[i] & FLAG_ERROR:
+                        errors[names[ids[i]]].append(row[:2] + [error_texts.get(lo + i, "")] + row[2:])
+                    else:
+                        ok[names[ids[i]]].append(row)
+                points = [{'name': name, 'points': rows, 'columns': ['time', 'elapsed', 'test_uid']}
+                    for name, rows in ok.items()]
+                points += [{'name': name, 'points': rows, 'columns': ['time', 'elapsed', 'error', 'test_uid']}
+                    for name, rows in errors.items()]
+                client.write_points(points)
+                done = min(offset + batch_size, len(times))
+                sent += done - offset
+                self._write_cursor(segment, lo + done)
+        return sent
+
+    def discard_replayed(self):
+        """Borra los segmentos cerrados que ya se han reenviado por completo"""
+        cursor = self._read_cursor()
+        if not cursor:
+            return
+        for segment in self.segments()[:-1]:
+            if segment < cursor[0] or (segment == cursor[0] and cursor[1] >= self._rows(segment)):
+                for column in [c for c, _, _ in COLUMNS] + [ERRORS_SUFFIX, UNSORTED_SUFFIX]:
+                    try:
+                        os.remove(self._column_path(segment, column))
+                    except OSError:
+                        pass
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_results_store(path=DEFAULT_RESULTS_PATH):
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ResultsStore(path)
+        return store
+
+
+def split_step_points(points):
+    """
+    Separa los puntos 0.8 con tiempos de step (time, elapsed, ..., test_uid)
+    en filas para el almacen; devuelve (filas, resto de puntos)
+    """
+    rows = []
+    others = []
+    for point in points:
+        columns = point['columns']
+        if columns[:2] != ['time', 'elapsed'] or 'test_uid' not in columns:
+            others.append(point)
+            continue
+        uid_index = columns.index('test_uid')
+        error_index = columns.index('error') if 'error' in columns else None
+        for values in point['points']:
+            # Se guarda el texto del error para poder reenviarlo
+            error = (values[error_index] or True) if error_index is not None else False
+            rows.append((values[0], point['name'], values[1], error, values[uid_index]))
+    return rows, others
+
+
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_interval(value):
+    """'45s', '30m', '1h', '2d', '1w' o segundos"""
+    if value[-1:] in INTERVAL_UNITS:
+        return float(value[:-1]) * INTERVAL_UNITS[value[-1]]
+    return float(value)
+
+
+def parse_time(value, now=None):
+    """Hace cuanto ('1h', '30m', '2d') o epoch"""
+    if value is None:
+        return None
+    if value[-1:] in INTERVAL_UNITS:
+        return (now or time.time()) - parse_interval(value)
+    return float(value)
@@ -0,0 +1,260 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Indice de retencion para el directorio de screenshots.
+
+Mantiene en memoria, por carpeta, los ficheros guardados en orden de
+antiguedad junto con su tamaño, de forma que comprobar el espacio usado y
+liberar lo justo es O(1) por fichero en lugar de un listdir + stat de todo
+el directorio en cada captura.
+
+El indice se persiste en SCREEN_LOG_PATH/.retention como un diario de solo
+añadir ("+ size mtime path" / "- path") que se compacta cuando crece
+demasiado. Si no existe se reconstruye recorriendo el directorio una vez.
+
+Varios procesos pueden compartir el directorio: cada cambio se hace con un
+flock sobre .retention.lock y antes se leen las lineas que hayan añadido
+los demas (o el diario entero si otro proceso lo ha compactado).
+"""
+
+import fcntl
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".retention"
+LOCK_NAME = ".retention.lock"
+MB = 1024 * 1024
+COMPACT_RATIO = 4   # compactamos cuando el diario es 4 veces el indice
+
+
+class RetentionIndex(object):
+    """Indice LRU de los ficheros de un directorio con presupuesto de bytes"""
+
+    def __init__(self, root, max_dir_bytes=None, max_total_bytes=None):
+        """
+        max_dir_bytes: maximo por carpeta de test (MAX_DIR_SIZE)
+        max_total_bytes: maximo entre todas las carpetas (MAX_TOTAL_SIZE)
+        """
+        self.root = os.path.abspath(root)
+        self.max_dir_bytes = max_dir_bytes
+        self.max_total_bytes = max_total_bytes
+        self.manifest_path = os.path.join(self.root, MANIFEST_NAME)
+        self._reset()
+        self._journal = None
+        self._inode = None      # diario que tenemos abierto
+        self._offset = 0        # bytes del diario ya aplicados
+        self._lock = threading.RLock()
+        self.evict_listeners = []   # callables(path) antes de borrar
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        with self._locked():
+            if os.path.exists(self.manifest_path):
+                self._sync()
+            else:
+                self._scan()
+
+    @contextmanager
+    def _locked(self):
+        """Exclusion entre hilos y entre procesos; deja el indice al dia"""
+        with self._lock:
+            with open(os.path.join(self.root, LOCK_NAME), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if self._journal is not None:
+                        self._sync()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self._folders = {}      # folder -> OrderedDict(name -> (size, mtime))
+        self._folder_bytes = {}
+        self.total_bytes = 0
+        self._journal_lines = 0
+
+    def _split(self, path):
+        path = os.path.abspath(path)
+        return os.path.dirname(path), os.path.basename(path)
+
+    def _add(self, folder, name, size, mtime):
+        entries = self._folders.setdefault(folder, OrderedDict())
+        old = entries.pop(name, None)
+        if old:
+            self._folder_bytes[folder] -= old[0]
+            self.total_bytes -= old[0]
+        entries[name] = (size, mtime)
+        self._folder_bytes[folder] = self._folder_bytes.get(folder, 0) + size
+        self.total_bytes += size
+
+    def _remove(self, folder, name):
+        entries = self._folders.get(folder)
+        if not entries or name not in entries:
+            return 0
+        size, _ = entries.pop(name)
+        self._folder_bytes[folder] -= size
+        self.total_bytes -= size
+        return size
+
+    def _open_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.manifest_path, "a")
+        st = os.fstat(self._journal.fileno())
+        self._inode = st.st_ino
+        return st.st_size
+
+    def _sync(self):
+        """Aplica lo que otros procesos han escrito en el diario"""
+        try:
+            st = os.stat(self.manifest_path)
+        except OSError:
+            # Lo han borrado: lo rehacemos con lo que sabemos
+            self._write_manifest()
+            return
+        if self._journal is None or st.st_ino != self._inode:
+            # Primera lectura o compactado por otro proceso
+            self._reset()
+            self._offset = 0
+            self._open_journal()
+        if st.st_size > self._offset:
+            self._load()
+
+    def _load(self):
+        with open(self.manifest_path) as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Solo lineas completas; el resto se lee en el siguiente _sync
+        complete = data[:data.rfind("\n") + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            self._journal_lines += 1
+            if line.startswith("+ "):
+                size, mtime, path = line[2:].split(" ", 2)
+                folder, name = self._split(path)
+                self._add(folder, name, int(size), float(mtime))
+            elif line.startswith("- "):
+                self._remove(*self._split(line[2:]))
+
+    def _scan(self):
+        """Reconstruye el indice recorriendo el directorio (solo la primera vez)"""
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            # .objects (ContentStore) se gestiona desde los enlaces
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for filename in filenames:
+                if dirpath == self.root and filename in (MANIFEST_NAME, LOCK_NAME):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, st.st_size, dirpath, filename))
+        for mtime, size, folder, name in sorted(found):
+            self._add(folder, name, size, mtime)
+        self._write_manifest()
+
+    def _write_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for folder, entries in self._folders.items():
+                for name, (size, mtime) in entries.items():
+                    f.write("+ {} {!r} {}\n".format(size, mtime, os.path.join(folder, name)))
+        os.rename(tmp_path, self.manifest_path)
+        self._offset = self._open_journal()
+        self._journal_lines = sum(len(e) for e in self._folders.values())
+
+    def _log(self, line):
+        """Añade al diario; hay que tener el lock (_locked)"""
+        self._journal.write(line + "\n")
+        self._journal.flush()
+        self._offset = os.fstat(self._journal.fileno()).st_size
+        self._journal_lines += 1
+        entries = sum(len(e) for e in self._folders.values())
+        if self._journal_lines > COMPACT_RATIO * max(entries, 100):
+            # Con el lock y el diario al dia no se pierde nada de otros procesos
+            self._write_manifest()
+
+    def add(self, path):
+        """Registra un fichero recien escrito y libera espacio si hace falta"""
+        with self._locked():
+            st = os.stat(path)
+            folder, name = self._split(path)
+            self._add(folder, name, st.st_size, st.st_mtime)
+            # repr: str() redondea a centesimas y desordena las carpetas
+            self._log("+ {} {!r} {}".format(st.st_size, st.st_mtime, os.path.join(folder, name)))
+            return self._enforce(folder)
+
+    def discard(self, path):
+        """Olvida un fichero borrado por otros medios (p.e. subido a S3)"""
+        with self._locked():
+            folder, name = self._split(path)
+            if self._remove(folder, name):
+                self._log("- {}".format(os.path.join(folder, name)))
+
+    def _evict_from(self, folder):
+        entries = self._folders[folder]
+        name, _ = next(iter(entries.items()))
+        path = os.path.join(folder, name)
+        for listener in self.evict_listeners:
+            listener(path)
+        try:
+            os.remove(path)
+        except OSError as e:
+            log.debug("Could not remove {}: {}".format(path, e))
+        size = self._remove(folder, name)
+        self._log("- {}".format(path))
+        return path, size
+
+    def enforce(self, folder=None):
+        """Borra los ficheros mas antiguos justo hasta cumplir los limites"""
+        with self._locked():
+            return self._enforce(folder and os.path.abspath(folder))
+
+    def _enforce(self, folder):
+        evicted = []
+        if folder and self.max_dir_bytes is not None:
+            while self._folder_bytes.get(folder, 0) > self.max_dir_bytes:
+                evicted.append(self._evict_from(folder))
+        if self.max_total_bytes is not None:
+            while self.total_bytes > self.max_total_bytes:
+                # El fichero mas antiguo es la cabeza de alguna carpeta
+                _, oldest_folder = min(
+                    (next(iter(entries.values()))[1], entries_folder)
+                    for entries_folder, entries in self._folders.items()
+                    if entries)
+                evicted.append(self._evict_from(oldest_folder))
+        return evicted
+
+    def folder_bytes(self, folder):
+        return self._folder_bytes.get(os.path.abspath(folder), 0)
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_retention_index(screenshots_conf):
+    """Indice compartido para SCREEN_LOG_PATH (tamaños de la conf en MB)"""
+    root = os.path.abspath(screenshots_conf["SCREEN_LOG_PATH"])
+    max_dir = screenshots_conf.get("MAX_DIR_SIZE")
+    max_total = screenshots_conf.get("MAX_TOTAL_SIZE")
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = RetentionIndex(root,
+                max_dir_bytes=max_dir * MB if max_dir is not None else None,
+                max_total_bytes=max_total * MB if max_total is not None else None)
+        return index
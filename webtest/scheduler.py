@@ -0,0 +1,210 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Planificador de tests para `webtest serve`.
+
+Ejecuta todos los WebTest de un directorio dentro de un unico proceso:
+cada test se lanza cada `INTERVAL` segundos (atributo de la clase), con un
+poco de jitter para que no arranquen todos a la vez, sobre un numero fijo de
+workers y sin superar `MAX_CONCURRENCY` ejecuciones simultaneas por test.
+
+Con un TestRegistry el directorio se vuelve a recorrer cada
+`rescan_interval` segundos: los tests nuevos se planifican y los borrados
+dejan de lanzarse.
+"""
+
+import heapq
+import logging
+import random
+import threading
+import time
+import Queue
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_JITTER = 0.1
+DEFAULT_RESCAN_INTERVAL = 60
+
+
+class Job(object):
+    """Test planificado"""
+
+    def __init__(self, module_name, test_class, interval, max_concurrency):
+        self.name = "{}.{}".format(module_name, test_class.__name__)
+        self.module_name = module_name
+        self.test_class = test_class
+        self.interval = interval
+        self.max_concurrency = max_concurrency
+        self.running = 0
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0
+        self.removed = False
+
+    def __repr__(self):
+        return "<Job {} every {}s>".format(self.name, self.interval)
+
+
+class Scheduler(object):
+    """Lanza periodicamente los tests sobre un pool acotado de workers"""
+
+    def __init__(self, tests, workers=DEFAULT_WORKERS, jitter=DEFAULT_JITTER,
+            test_kwargs=None, pool=None, registry=None,
+            rescan_interval=DEFAULT_RESCAN_INTERVAL):
+        """
+        tests: [(module_name, WebTest class)], ver TestRegistry.scan
+        jitter: fraccion del intervalo que se suma o resta al azar
+        test_kwargs: argumentos para instanciar cada test
+        pool: SessionPool compartido por todos los tests
+        registry: TestRegistry del que recargar los tests que cambien
+        rescan_interval: segundos entre recorridos de registry en busca de
+                         tests nuevos o borrados
+        """
+        self.registry = registry
+        self.rescan_interval = rescan_interval
+        self.workers = workers
+        self.jitter = jitter
+        self.test_kwargs = dict(test_kwargs or {})
+        if pool is not None:
+            self.test_kwargs['pool'] = pool
+        self.jobs = [
+            Job(module_name, Test, Test.INTERVAL, Test.MAX_CONCURRENCY)
+            for module_name, Test in tests]
+        self._queue = Queue.Queue(maxsize=workers)
+        self._heap = []
+        self._seq = 0
+        self._next_scan = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _next_time(self, job, last):
+        delta = job.interval * self.jitter
+        return last + job.interval + random.uniform(-delta, delta)
+
+    def _schedule(self, job, now):
+        # Repartimos el primer arranque a lo largo del intervalo
+        first = now + random.uniform(0, job.interval)
+        heapq.heappush(self._heap, (first, self._seq, job))
+        self._seq += 1
+
+    def start(self):
+        now = time.time()
+        for job in self.jobs:
+            self._schedule(job, now)
+        self._next_scan = now + self.rescan_interval
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker,
+                name="webtest-worker-{}".format(index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        log.info("Scheduling {} tests on {} workers".format(
+            len(self.jobs), self.workers))
+
+    def run_forever(self):
+        self.start()
+        try:
+            while not self._stop.is_set():
+                self.tick()
+        finally:
+            self.stop()
+
+    def rescan(self):
+        """Planifica los tests nuevos del registry y retira los borrados"""
+        now = time.time()
+        self._next_scan = now + self.rescan_interval
+        try:
+            tests = self.registry.scan()
+        except Exception:
+            log.exception("Error scanning {}".format(self.registry.testdir))
+            return
+        found = dict(("{}.{}".format(module_name, Test.__name__), (module_name, Test))
+            for module_name, Test in tests)
+        for job in self.jobs:
+            if job.name not in found:
+                log.info("No longer scheduling {}".format(job.name))
+                job.removed = True
+        known = set(job.name for job in self.jobs)
+        self.jobs = [job for job in self.jobs if not job.removed]
+        for name, (module_name, Test) in sorted(found.items()):
+            if name in known:
+                continue
+            job = Job(module_name, Test, Test.INTERVAL, Test.MAX_CONCURRENCY)
+            log.info("Scheduling new test {}".format(job.name))
+            self.jobs.append(job)
+            self._schedule(job, now)
+
+    def tick(self):
+        """Encola los tests que toca lanzar y espera al siguiente"""
+        if self.registry is not None and self._next_scan is not None \
+                and time.time() >= self._next_scan:
+            self.rescan()
+        if not self._heap:
+            self._stop.wait(1)
+            return
+        when, seq, job = self._heap[0]
+        wait = when - time.time()
+        if wait > 0:
+            self._stop.wait(min(wait, 1))
+            return
+        if job.removed:
+            heapq.heappop(self._heap)
+            return
+        heapq.heapreplace(self._heap, (self._next_time(job, when), seq, job))
+        with self._lock:
+            if job.running >= job.max_concurrency:
+                job.skipped += 1
+                log.warn("Skipping {}: {} runs in progress".format(
+                    job.name, job.running))
+                return
+            job.running += 1
+        try:
+            self._queue.put_nowait(job)
+        except Queue.Full:
+            with self._lock:
+                job.running -= 1
+                job.skipped += 1
+            log.warn("Skipping {}: all workers busy".format(job.name))
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self.run_job(job)
+            finally:
+                with self._lock:
+                    job.running -= 1
+                    job.runs += 1
+
+    def run_job(self, job):
+        log.debug("Running {}".format(job.name))
+        if self.registry is not None:
+            # Si el fichero ha cambiado se recarga aqui
+            job.test_class = self.registry.get(job.module_name,
+                job.test_class.__name__) or job.test_class
+        try:
+            test = job.test_class(**self.test_kwargs)
+        except Exception:
+            job.errors += 1
+            log.exception("Error starting {}".format(job.name))
+            return
+        try:
+            test.run()
+        except Exception:
+            job.errors += 1
+            log.exception("Error running {}".format(job.name))
+            test.close()
+
+    def stop(self):
+        if self._threads:
+            self._stop.set()
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
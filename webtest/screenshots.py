@@ -1,85 +1,303 @@
+import atexit
 import os
-import tinys3
+import threading
+import time
+import Queue
 import logging
-from PIL import Image
+from io import BytesIO
+from contextlib import contextmanager
+from webtest.lazy import LazyImport
+from webtest.retention import get_retention_index
+from webtest.contentstore import get_content_store, bytes_key, html_key, image_key
 
+tinys3 = LazyImport('tinys3')
+Image = LazyImport('PIL.Image')
 
-def save_htmls_screenshots(folder, driver, filename, screenshots_conf):
+MAX_HEIGHT = 1800
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_UPLOAD_RETRIES = 3
+DEFAULT_CLOSE_TIMEOUT = 30
+
+
+class Artifact(object):
+    """ Captura (png + html) de un test pendiente de guardar """
+
+    def __init__(self, folder, filename, png, html, screenshots_conf):
+        self.folder = folder
+        self.filename = filename
+        self.png = png
+        self.html = html
+        self.screenshots_conf = screenshots_conf
 
-    def crop_height_img(fullpath, max_heigh=1800):
-        """ Recorta la imagen a lo largo """
-        img = Image.open(fullpath)
-        if img.height > max_heigh:
-            img = img.crop((0, 0, img.width, max_heigh)) # para que grafana pueda pintarla bien.
-        img.save(fullpath)
-
-    def size_of_dir(dirname):
-        """Walks through the directory, getting the cumulative size of the directory"""
-        suma = 0
-        files_names = os.listdir(dirname)
-        for file in files_names:
-            suma += os.path.getsize(dirname+"/"+file)
-        kilobytes = suma/1024
-        return kilobytes/1024 #megabytes
-
-    def clear_dir(path):
-        """ borra una tercera parte de los archivos """
-        files_paths = []
-        for filename in os.listdir(path):
-            files_paths.append(path + "/" + filename)
-        sorted_files = sorted(files_paths, key=lambda filepath: os.stat(filepath).st_mtime)
-        for file_path in sorted_files[0:len(sorted_files)/3]:
-            os.remove(file_path)
-    
-    path = screenshots_conf["SCREEN_LOG_PATH"]+"/"+folder
-    if not os.path.exists(path): os.makedirs(path)
-    
-    dir_size = size_of_dir(path)
-    if dir_size>=screenshots_conf["MAX_DIR_SIZE"]:
-        clear_dir(path)
 
+def capture_artifact(folder, driver, filename, screenshots_conf):
+    """ Lee del driver el screenshot y el html; lo unico que necesita el navegador """
+    png = html = None
     try:
-        fullpath = os.path.join(path, "%s.png" % filename)
-        driver.save_screenshot(fullpath)
-        # Recortamos la imagen a lo largo para una correcta visualizacion en grafana
-        crop_height_img(fullpath)
+        png = driver.get_screenshot_as_png()
     except Exception as ex:
-        logging.warning("No se ha podido guardar el screenshot '%s/%s.png' :\n %s" % (path, filename, ex))
-    else:
-        if screenshots_conf.get("BUCKET_NAME"):
-            push_file_to_s3("%s.png" % filename, path, folder, screenshots_conf)
+        logging.warning("No se ha podido capturar el screenshot '%s/%s.png' :\n %s" % (folder, filename, ex))
     try:
-        html_path = os.path.join(path, "%s.html" % filename)
-        with open(html_path, "wb") as f:
-            f.write(driver.page_source.encode('utf-8'))
+        html = driver.page_source.encode('utf-8')
     except Exception as ex:
-        logging.warning("No se ha podido guardar el screenshot '%s/%s.html':\n%s" % (path, filename, ex))
+        logging.warning("No se ha podido capturar el html '%s/%s.html':\n%s" % (folder, filename, ex))
+    return Artifact(folder, filename, png, html, screenshots_conf)
+
+
+# SCREENSHOT_FORMAT -> (extension, formato PIL)
+SCREENSHOT_FORMATS = {
+    'png': ('png', 'PNG'),
+    'png8': ('png', 'PNG'),     # png con paleta de 256 colores
+    'webp': ('webp', 'WEBP'),
+    'jpeg': ('jpg', 'JPEG'),
+}
+DEFAULT_QUALITY = 75
+
+
+def screenshot_extension(screenshots_conf):
+    """ Extension de los screenshots segun SCREENSHOT_FORMAT """
+    return SCREENSHOT_FORMATS[screenshots_conf.get("SCREENSHOT_FORMAT", "png")][0]
+
+
+def process_screenshot(png, screenshots_conf, max_heigh=MAX_HEIGHT):
+    """ Recorta y recodifica en memoria. Devuelve (bytes, imagen PIL) """
+    screenshot_format = screenshots_conf.get("SCREENSHOT_FORMAT", "png")
+    quality = screenshots_conf.get("SCREENSHOT_QUALITY", DEFAULT_QUALITY)
+    img = Image.open(BytesIO(png))
+    cropped = img.height > max_heigh
+    if cropped:
+        img = img.crop((0, 0, img.width, max_heigh)) # para que grafana pueda pintarla bien.
+    elif screenshot_format == 'png':
+        return png, img
+
+    output = BytesIO()
+    pil_format = SCREENSHOT_FORMATS[screenshot_format][1]
+    if screenshot_format == 'png8':
+        img.convert("RGB").quantize(colors=256).save(output, pil_format, optimize=True)
+    elif screenshot_format == 'png':
+        img.save(output, pil_format)
+    else:
+        img.convert("RGB").save(output, pil_format, quality=quality)
+    return output.getvalue(), img
+
+
+def write_file(fullpath, data, store=None, key=None, ext=None):
+    """ Escribe data en fullpath, o lo enlaza desde el store si se deduplica """
+    if store is None:
+        with open(fullpath, "wb") as f:
+            f.write(data)
     else:
-        if screenshots_conf.get("BUCKET_NAME"):
-            push_file_to_s3("%s.html" % filename, path, folder, screenshots_conf)
+        store.save(key, ext, data, fullpath)
+
+
+def save_artifact(artifact):
+    """ Recorta, guarda y sube a S3 una captura """
+    screenshots_conf = artifact.screenshots_conf
+    folder = artifact.folder
+    filename = artifact.filename
+
+    path = screenshots_conf["SCREEN_LOG_PATH"]+"/"+folder
+    if not os.path.exists(path): os.makedirs(path)
+    # Cada fichero escrito se apunta en el indice, que borra lo justo
+    # para no pasar de MAX_DIR_SIZE (y MAX_TOTAL_SIZE) megas
+    index = get_retention_index(screenshots_conf)
+
+    # Con DEDUPE cada contenido distinto se guarda y se sube una sola vez
+    store = None
+    if screenshots_conf.get("DEDUPE"):
+        store = get_content_store(screenshots_conf)
+        if store.release not in index.evict_listeners:
+            index.evict_listeners.append(store.release)
+    near_duplicates = screenshots_conf.get("NEAR_DUPLICATES", True)
+
+    if artifact.png is not None:
+        ext = screenshot_extension(screenshots_conf)
+        key = None
+        try:
+            fullpath = os.path.join(path, "%s.%s" % (filename, ext))
+            # Recortamos la imagen a lo largo para una correcta visualizacion en grafana
+            data, img = process_screenshot(artifact.png, screenshots_conf)
+            if store is not None:
+                key = image_key(img) if near_duplicates else bytes_key(data)
+                # png y png8 comparten extension pero no contenido
+                key = "%s_%s" % (key, screenshots_conf.get("SCREENSHOT_FORMAT", "png"))
+            write_file(fullpath, data, store, key, ext)
+            index.add(fullpath)
+        except Exception as ex:
+            logging.warning("No se ha podido guardar el screenshot '%s/%s.%s' :\n %s" % (path, filename, ext, ex))
+        else:
+            if screenshots_conf.get("BUCKET_NAME"):
+                push_file_to_s3("%s.%s" % (filename, ext), path, folder, screenshots_conf,
+                    store=store, key=key, ext=ext)
+    if artifact.html is not None:
+        key = None
+        try:
+            html_path = os.path.join(path, "%s.html" % filename)
+            if store is not None:
+                key = html_key(artifact.html) if near_duplicates else bytes_key(artifact.html)
+            write_file(html_path, artifact.html, store, key, "html")
+            index.add(html_path)
+        except Exception as ex:
+            logging.warning("No se ha podido guardar el screenshot '%s/%s.html':\n%s" % (path, filename, ex))
+        else:
+            if screenshots_conf.get("BUCKET_NAME"):
+                push_file_to_s3("%s.html" % filename, path, folder, screenshots_conf,
+                    store=store, key=key, ext="html")
+
+
+def save_htmls_screenshots(folder, driver, filename, screenshots_conf):
+    """ Captura y guarda en el momento, sin pasar por el pipeline """
+    save_artifact(capture_artifact(folder, driver, filename, screenshots_conf))
+
+
+class S3ConnectionPool(object):
+    """ Reutiliza las conexiones de tinys3 entre subidas """
+
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self, screenshots_conf):
+        key = (screenshots_conf["AWS_ACCESS_KEY_ID"],
+            screenshots_conf["AWS_SECRET_ACCESS_KEY"],
+            screenshots_conf["ENDPOINT"])
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            conn = free.pop() if free else None
+        if conn is None:
+            conn = tinys3.Connection(key[0], key[1], endpoint=key[2])
+        yield conn
+        # Si la subida falla no llegamos aqui y la conexion se descarta
+        with self._lock:
+            self._free[key].append(conn)
+
+
+s3_pool = S3ConnectionPool()
 
 
-def push_file_to_s3(filename, filepath, s3_folder, screenshots_conf):
+def copy_in_s3(s3_key, remote_key, screenshots_conf):
+    """ Copia dentro de S3 un contenido ya subido; no transfiere los bytes """
+    try:
+        with s3_pool.connection(screenshots_conf) as conn:
+            conn.copy(remote_key, screenshots_conf["BUCKET_NAME"], s3_key,
+                screenshots_conf["BUCKET_NAME"])
+    except Exception as e:
+        logging.warning("No se ha podido copiar %s en S3, se sube de nuevo: \n%s" % (remote_key, e))
+        return False
+    return True
+
+
+def push_file_to_s3(filename, filepath, s3_folder, screenshots_conf, store=None, key=None, ext=None):
     f = None
     fullpath = "%s/%s" % (filepath, filename)
+    s3_key = "%s/%s" % (s3_folder, filename)
+    if store is not None:
+        remote_key = store.remote_key(key, ext)
+        if remote_key:
+            if copy_in_s3(s3_key, remote_key, screenshots_conf):
+                print s3_key
+                store.release(fullpath)
+                os.remove(fullpath)
+                get_retention_index(screenshots_conf).discard(fullpath)
+                return
+            store.forget_remote(key, ext)
     try:
         f = open(fullpath, "rb")
     except IOError as e:
         logging.error("No se ha podido subir el archivo para subirlo a S3, posiblemente no se ha guardado: \n%s" % e)
     if f:
+        retries = screenshots_conf.get("UPLOAD_RETRIES", DEFAULT_UPLOAD_RETRIES)
+        with f:
+            for attempt in range(1, retries + 1):
+                try:
+                    f.seek(0)
+                    with s3_pool.connection(screenshots_conf) as conn:
+                        conn.upload(s3_key, f, screenshots_conf["BUCKET_NAME"])
+                except Exception as e:
+                    logging.error("error subiendo archivo a S3 (intento %s de %s): \n%s" % (attempt, retries, e))
+                    if attempt < retries:
+                        time.sleep(2 ** (attempt - 1))
+                else:
+                    print s3_key
+                    break
+            else:
+                return
+        if store is not None:
+            store.set_remote_key(key, ext, s3_key)
+            store.release(fullpath)
+        os.remove(fullpath)
+        get_retention_index(screenshots_conf).discard(fullpath)
+
+
+class ArtifactPipeline(object):
+    """
+    Guarda las capturas en segundo plano para que el test pueda soltar
+    el navegador en cuanto las ha leido.
+
+    Opciones en screenshots_conf:
+        WORKERS: hilos que recortan, guardan y suben
+        QUEUE_SIZE: capturas pendientes como maximo
+        UPLOAD_RETRIES: intentos de subida a S3
+        SCREENSHOT_FORMAT: 'png', 'png8', 'webp' o 'jpeg'
+        SCREENSHOT_QUALITY: calidad para webp y jpeg
+        DEDUPE: guarda y sube cada contenido distinto una sola vez
+        NEAR_DUPLICATES: con DEDUPE, trata como iguales capturas casi identicas
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker,
+                name="webtest-artifacts-{}".format(index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, artifact):
         try:
-            conn = tinys3.Connection(screenshots_conf["AWS_ACCESS_KEY_ID"],
-                screenshots_conf["AWS_SECRET_ACCESS_KEY"],
-                endpoint=screenshots_conf["ENDPOINT"])
-            conn.upload("%s/%s" % (s3_folder, filename), f, screenshots_conf["BUCKET_NAME"])
-            print "%s/%s" % (s3_folder, filename)
-            f.close()
-        except Exception as e:
-            f.close()
-            logging.error("error subiendo archivo a S3: \n%s" % e)
-        else:            
-            os.remove(fullpath)
+            self._queue.put_nowait(artifact)
+        except Queue.Full:
+            logging.warning("Cola de capturas llena, se descarta '%s/%s'" % (artifact.folder, artifact.filename))
+
+    def _worker(self):
+        while True:
+            artifact = self._queue.get()
+            try:
+                if artifact is None:
+                    return
+                save_artifact(artifact)
+            except Exception as e:
+                logging.exception("Error guardando '%s/%s': %s" % (artifact.folder, artifact.filename, e))
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """ Espera a que se hayan guardado todas las capturas encoladas """
+        self._queue.join()
+
+    def close(self, timeout=DEFAULT_CLOSE_TIMEOUT):
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.time()))
+        self._threads = []
 
 
+_pipeline = None
+_pipeline_lock = threading.Lock()
 
 
+def get_artifact_pipeline(screenshots_conf):
+    """ Pipeline compartido por el proceso """
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = ArtifactPipeline(
+                workers=screenshots_conf.get("WORKERS", DEFAULT_WORKERS),
+                queue_size=screenshots_conf.get("QUEUE_SIZE", DEFAULT_QUEUE_SIZE))
+            atexit.register(_pipeline.close)
+        return _pipeline
@@ -0,0 +1,241 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Utilidades para probar y medir webtest sin navegador ni red.
+
+FakeWebDriver implementa la parte del API de webdriver que usa WebTest y
+responde al instante. Las paginas las puede leer de un FixtureServer, un
+servidor HTTP local en un hilo. NullMetricsClient descarta los puntos.
+Los usa benchmarks/suite.py.
+"""
+
+import BaseHTTPServer
+import re
+import SocketServer
+import struct
+import threading
+import urllib2
+import zlib
+
+from webtest.lazy import LazyImport
+
+exceptions = LazyImport('selenium.common.exceptions')
+
+FIXTURE_PAGES = {
+    '/': """<!DOCTYPE html>
+<html><head><title>Fixture home</title>
+<link rel="stylesheet" href="/static/site.css"></head>
+<body>
+<div id="header" class="header"><a id="login" href="/login">Login</a></div>
+<div id="content" class="content">
+<ul class="items">{items}</ul>
+<form id="search" name="search"><input name="q" id="q"></form>
+</div>
+<div id="footer" class="footer">footer</div>
+</body></html>""".format(items="".join(
+        '<li class="item" id="item{0}"><a href="/item/{0}">Item {0}</a></li>'.format(i)
+        for i in range(50))),
+    '/login': """<!DOCTYPE html>
+<html><head><title>Login</title></head>
+<body><form id="login-form"><input id="user" name="user">
+<input id="password" name="password" type="password"></form></body></html>""",
+    '/static/site.css': "body { margin: 0 }",
+}
+
+_id_re = re.compile(r'id="([^"]+)"')
+_class_re = re.compile(r'class="([^"]+)"')
+_name_re = re.compile(r'name="([^"]+)"')
+_tag_re = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)')
+
+
+def make_png(width=1280, height=800):
+    """PNG en memoria (gris liso) sin depender de PIL"""
+    row = b"\0" + b"\x80" * width
+    raw = zlib.compress(row * height, 1)
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+            struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    return (b"\x89PNG\r\n\x1a\n" +
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)) +
+        chunk(b"IDAT", raw) + chunk(b"IEND", b""))
+
+
+class FakeWebElement(object):
+
+    def __init__(self, driver, by, value):
+        self.parent = driver
+        self.by = by
+        self.value = value
+        self.text = value
+        self.tag_name = 'div'
+
+    def is_displayed(self):
+        return True
+
+    def click(self):
+        pass
+
+    def send_keys(self, *values):
+        pass
+
+    def get_attribute(self, name):
+        return None
+
+    def find_element(self, by, value):
+        return self.parent.find_element(by, value)
+
+
+class FakeWebDriver(object):
+    """
+    Driver en memoria. Un elemento existe si su id, clase, name o tag
+    aparece en el html de la pagina actual; los css selector y xpath se
+    dan siempre por encontrados salvo que esten en `missing`.
+    """
+
+    def __init__(self, page_source=FIXTURE_PAGES['/'], screenshot=None, missing=()):
+        self.page_source = page_source
+        self.current_url = 'about:blank'
+        self.title = ''
+        self.missing = set(missing)
+        self._screenshot = screenshot
+        self._window = {'width': 1280, 'height': 800}
+        self._index()
+
+    def _index(self):
+        source = self.page_source
+        self._ids = set(_id_re.findall(source))
+        self._classes = set(c for value in _class_re.findall(source) for c in value.split())
+        self._names = set(_name_re.findall(source))
+        self._tags = set(t.lower() for t in _tag_re.findall(source))
+
+    def _exists(self, by, value):
+        if value in self.missing:
+            return False
+        if by == 'id':
+            return value in self._ids
+        if by == 'class name':
+            return value in self._classes
+        if by == 'name':
+            return value in self._names
+        if by == 'tag name':
+            return value.lower() in self._tags
+        return True
+
+    def get(self, url):
+        if url.startswith('http://') or url.startswith('https://'):
+            self.page_source = urllib2.urlopen(url, timeout=5).read()
+            self._index()
+        self.current_url = url
+
+    def find_element(self, by='id', value=None):
+        if not self._exists(by, value):
+            raise exceptions.NoSuchElementException("{}={}".format(by, value))
+        return FakeWebElement(self, by, value)
+
+    def find_elements(self, by='id', value=None):
+        return [FakeWebElement(self, by, value)] if self._exists(by, value) else []
+
+    def find_element_by_id(self, value):
+        return self.find_element('id', value)
+
+    def find_element_by_css_selector(self, value):
+        return self.find_element('css selector', value)
+
+    def find_element_by_xpath(self, value):
+        return self.find_element('xpath', value)
+
+    def find_element_by_class_name(self, value):
+        return self.find_element('class name', value)
+
+    def execute_script(self, script, *args):
+        return None
+
+    def execute_async_script(self, script, *args):
+        # Solo se usa para las esperas de webtest.waits y los tiempos de
+        # webtest.timing: locators en args[0]
+        if args and isinstance(args[0], list):
+            for index, (by, value) in enumerate(args[0]):
+                if self._exists(by, value):
+                    return [index, FakeWebElement(self, by, value)]
+            return None
+        return None
+
+    def implicitly_wait(self, seconds):
+        pass
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def get_window_size(self):
+        return dict(self._window)
+
+    def set_window_size(self, width, height):
+        self._window = {'width': width, 'height': height}
+
+    def get_screenshot_as_png(self):
+        if self._screenshot is None:
+            self._screenshot = make_png()
+        return self._screenshot
+
+    def delete_all_cookies(self):
+        pass
+
+    def quit(self):
+        pass
+
+
+class NullMetricsClient(object):
+    """Cliente de influx que solo cuenta los puntos"""
+
+    def __init__(self):
+        self.points = 0
+
+    def write_points(self, points):
+        self.points += sum(len(point['points']) for point in points)
+
+
+class FixtureRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = 64 * 1024
+
+    def do_GET(self):
+        body = self.server.pages.get(self.path.split('?')[0])
+        if body is None:
+            self.send_response(404)
+            body = "not found"
+        else:
+            self.send_response(200)
+        content_type = 'text/css' if self.path.endswith('.css') else 'text/html; charset=utf-8'
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Sitio de prueba local: FixtureServer().start().url('/')"""
+    daemon_threads = True
+
+    def __init__(self, pages=None, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FixtureRequestHandler)
+        self.pages = dict(FIXTURE_PAGES if pages is None else pages)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="webtest-fixtures")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def url(self, path='/'):
+        return "http://{}:{}{}".format(self.server_address[0], self.server_address[1], path)
@@ -0,0 +1,126 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tiempos del navegador por step (Navigation, Resource y Paint Timing).
+
+El tiempo de un step medido desde python mezcla la latencia de webdriver con
+la de la pagina. Con `WebTest(browser_timing=True)` al terminar cada step se
+leen del navegador las entradas de performance generadas durante el step:
+la navegacion (si la hubo), los paints y los recursos mas lentos.
+"""
+
+SLOWEST_RESOURCES = 10
+RESOURCE_BUFFER_SIZE = 1000
+# Espera maxima (ms) a que el PerformanceObserver entregue el LCP
+LCP_WAIT = 50
+
+NAVIGATION_COLUMNS = ['ttfb', 'dns', 'connect', 'dom_interactive',
+    'dom_content_loaded', 'load', 'first_paint', 'first_contentful_paint',
+    'largest_contentful_paint']
+RESOURCE_COLUMNS = ['name', 'initiator', 'duration', 'transfer_size']
+
+TIMING_SCRIPT = """
+var slowest = arguments[0], bufferSize = arguments[1], lcpWait = arguments[2],
+    done = arguments[arguments.length - 1];
+var p = window.performance;
+if (!p) { done(null); return; }
+
+function round(v) { return (v === undefined || v === null || v < 0) ? null : Math.round(v); }
+
+var out = {navigation: null, paint: {}, resources: []};
+var nav = p.getEntriesByType ? p.getEntriesByType('navigation')[0] : null;
+if (nav) {
+    out.navigation = {
+        id: String(p.timeOrigin) + nav.name,
+        ttfb: round(nav.responseStart),
+        dns: round(nav.domainLookupEnd - nav.domainLookupStart),
+        connect: round(nav.connectEnd - nav.connectStart),
+        dom_interactive: round(nav.domInteractive),
+        dom_content_loaded: round(nav.domContentLoadedEventEnd),
+        load: round(nav.loadEventEnd)
+    };
+} else if (p.timing && p.timing.navigationStart) {
+    var t = p.timing, start = t.navigationStart;
+    out.navigation = {
+        id: String(start) + document.location.href,
+        ttfb: round(t.responseStart - start),
+        dns: round(t.domainLookupEnd - t.domainLookupStart),
+        connect: round(t.connectEnd - t.connectStart),
+        dom_interactive: round(t.domInteractive - start),
+        dom_content_loaded: round(t.domContentLoadedEventEnd - start),
+        load: t.loadEventEnd ? round(t.loadEventEnd - start) : null
+    };
+}
+
+if (p.getEntriesByType) {
+    p.getEntriesByType('paint').forEach(function (e) {
+        out.paint[e.name.replace(/-/g, '_')] = round(e.startTime);
+    });
+    var resources = p.getEntriesByType('resource').map(function (e) {
+        return {name: e.name, initiator: e.initiatorType,
+                duration: round(e.duration), transfer_size: e.transferSize || 0};
+    });
+    resources.sort(function (a, b) { return b.duration - a.duration; });
+    out.resources = resources.slice(0, slowest);
+    // Cada step ve solo los recursos cargados durante el
+    if (p.clearResourceTimings) { p.clearResourceTimings(); }
+    if (p.setResourceTimingBufferSize) { p.setResourceTimingBufferSize(bufferSize); }
+}
+
+var observerTypes = window.PerformanceObserver && PerformanceObserver.supportedEntryTypes;
+if (!observerTypes || observerTypes.indexOf('largest-contentful-paint') < 0) {
+    done(out);
+    return;
+}
+var finished = false;
+function finish() {
+    if (finished) { return; }
+    finished = true;
+    observer.disconnect();
+    done(out);
+}
+var observer = new PerformanceObserver(function (list) {
+    var entries = list.getEntries();
+    if (entries.length) {
+        out.paint.largest_contentful_paint = round(entries[entries.length - 1].startTime);
+    }
+    finish();
+});
+observer.observe({type: 'largest-contentful-paint', buffered: true});
+setTimeout(finish, lcpWait);
+"""
+
+
+def collect_timing(driver, last_navigation=None):
+    """
+    Devuelve {'navigation': {...} o None, 'resources': [...]} con lo ocurrido
+    desde la ultima lectura. La navegacion solo se devuelve si es nueva
+    (su id difiere de last_navigation).
+    """
+    data = driver.execute_async_script(TIMING_SCRIPT,
+        SLOWEST_RESOURCES, RESOURCE_BUFFER_SIZE, LCP_WAIT)
+    if not data:
+        return None
+    navigation = data.get('navigation')
+    navigation_id = navigation.pop('id', None) if navigation else None
+    if navigation_id is not None and navigation_id == last_navigation:
+        navigation = None
+    elif navigation:
+        navigation.update(data.get('paint') or {})
+    return {
+        'navigation_id': navigation_id,
+        'navigation': navigation,
+        'resources': data.get('resources') or [],
+    }
+
+
+def timing_points(timing, now, test_uid):
+    """Filas para las series .timing y .resources de un step"""
+    navigation_rows = []
+    navigation = timing.get('navigation')
+    if navigation:
+        navigation_rows.append([now] + [navigation.get(c) for c in NAVIGATION_COLUMNS] + [test_uid])
+    resource_rows = [[now] + [r.get(c) for c in RESOURCE_COLUMNS] + [test_uid]
+        for r in timing.get('resources', [])]
+    return navigation_rows, resource_rows
@@ -0,0 +1,153 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Esperas resueltas dentro del navegador.
+
+En lugar de hacer un comando HTTP por cada sondeo de WebDriverWait (mas dos
+para cambiar implicitly_wait), se envia un unico script asincrono que espera
+en la propia pagina, con un MutationObserver y un sondeo corto de respaldo,
+hasta que aparece alguno de los elementos buscados o se agota el tiempo.
+"""
+
+import time
+
+from webtest.lazy import LazyImport
+
+exceptions = LazyImport('selenium.common.exceptions')
+
+# Margen para que el script termine antes que el script timeout del driver
+SCRIPT_TIMEOUT_MARGIN = 2
+RETRY_DELAY = 0.1
+# Mensajes de los drivers cuando la pagina cambia durante el script
+NAVIGATION_MESSAGES = ('unload', 'navigated')
+
+WAIT_SCRIPT = """
+var locators = arguments[0], visible = arguments[1], timeout = arguments[2],
+    root = arguments[3] || document, done = arguments[arguments.length - 1];
+
+function find(by, value) {
+    switch (by) {
+    case 'id':
+        return root === document ? document.getElementById(value)
+                                 : root.querySelector('[id="' + value + '"]');
+    case 'css selector':
+        return root.querySelector(value);
+    case 'class name':
+        return root.getElementsByClassName(value)[0] || null;
+    case 'name':
+        return root.querySelector('[name="' + value + '"]');
+    case 'tag name':
+        return root.getElementsByTagName(value)[0] || null;
+    case 'xpath':
+        return document.evaluate(value, root, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    }
+    throw new Error('Unsupported locator: ' + by);
+}
+
+function isVisible(el) {
+    if (!(el.offsetWidth || el.offsetHeight || el.getClientRects().length)) {
+        return false;
+    }
+    var style = window.getComputedStyle(el);
+    return style.visibility !== 'hidden' && style.opacity !== '0';
+}
+
+function check() {
+    for (var i = 0; i < locators.length; i++) {
+        var el = find(locators[i][0], locators[i][1]);
+        if (el && (!visible || isVisible(el))) {
+            return [i, el];
+        }
+    }
+    return null;
+}
+
+var result = check();
+if (result) {
+    done(result);
+    return;
+}
+
+var finished = false, observer = null, poll = null, timer = null;
+function finish(value) {
+    if (finished) { return; }
+    finished = true;
+    if (observer) { observer.disconnect(); }
+    clearInterval(poll);
+    clearTimeout(timer);
+    done(value);
+}
+function onChange() {
+    var value = check();
+    if (value) { finish(value); }
+}
+
+if (window.MutationObserver) {
+    observer = new MutationObserver(onChange);
+    observer.observe(document.documentElement || document,
+        {childList: true, subtree: true, attributes: true});
+}
+// La visibilidad puede cambiar sin mutaciones (css, animaciones)
+poll = setInterval(onChange, observer ? 100 : 50);
+timer = setTimeout(function () { finish(null); }, timeout);
+"""
+
+
+def is_navigation_error(error, root=None):
+    """El script se ha perdido porque la pagina ha navegado o se ha descargado"""
+    if isinstance(error, exceptions.NoSuchWindowException):
+        return True
+    if isinstance(error, exceptions.StaleElementReferenceException):
+        # Con root de la pagina anterior no se va a encontrar nada
+        return root is None
+    message = (getattr(error, 'msg', None) or str(error)).lower()
+    return any(text in message for text in NAVIGATION_MESSAGES)
+
+
+class BrowserWait(object):
+    """Espera en el navegador a que aparezca alguno de los locators"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.script_timeout = None
+
+    def _ensure_script_timeout(self, timeout):
+        # Solo se cambia cuando hace falta mas tiempo: un comando menos por espera
+        needed = timeout + SCRIPT_TIMEOUT_MARGIN
+        if self.script_timeout is None or self.script_timeout < needed:
+            self.driver.set_script_timeout(needed)
+            self.script_timeout = needed
+
+    def until_any(self, locators, timeout, visible=False, root=None):
+        """
+        locators: [(By.*, value), ...]
+        Devuelve (indice del locator, elemento) o lanza TimeoutException
+        """
+        locators = [list(locator) for locator in locators]
+        deadline = time.time() + timeout
+        self._ensure_script_timeout(timeout)
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                result = self.driver.execute_async_script(WAIT_SCRIPT,
+                    locators, visible, int(remaining * 1000), root)
+            except exceptions.TimeoutException:
+                break
+            except exceptions.WebDriverException as e:
+                # Si la pagina ha navegado mientras esperabamos volvemos a
+                # lanzar el script en la nueva; el resto de errores (selector
+                # invalido, javascript...) no se arreglan reintentando
+                if not is_navigation_error(e, root):
+                    raise
+                time.sleep(RETRY_DELAY)
+                continue
+            if result:
+                return result[0], result[1]
+            break
+        raise exceptions.TimeoutException(
+            "Timed out after {}s waiting for {}".format(timeout,
+                " or ".join("{}={}".format(*l) for l in locators)))